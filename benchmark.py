@@ -0,0 +1,268 @@
+"""
+SDM 商店转 ViScriptShop 工具 - 合成数据性能基准
+
+生成合成的 mods 目录（N 个 jar × M 个物品，混合 Forge / NeoForge / Fabric / mcmod.info 元数据）
+和合成的 sdmshop.snbt（可配置分类数和条目数），对各阶段计时：
+
+    python benchmark.py                          # 默认规模运行并与基准对比
+    python benchmark.py --jars 400 --items 200   # 指定规模
+    python benchmark.py --save-baseline          # 把本次结果保存为基准
+    python benchmark.py --threshold 15           # 比基准慢 15% 以上即判定退化（退出码 1）
+
+基准文件记录生成参数，参数不同时不做对比。
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from datetime import datetime
+
+import shop_toolkit_gui as toolkit
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+
+# ==================== 合成数据 ====================
+
+def generate_mods_dir(mods_dir, jar_count, items_per_jar, seed=0):
+    """生成合成的 mods 目录，返回 [mod_id, ...]
+
+    元数据按 Forge mods.toml / NeoForge neoforge.mods.toml / Fabric fabric.mod.json / mcmod.info 轮换，
+    物品条目交替使用 assets/<ns>/models/item/*.json 和 data/<ns>/item/ 目录两种布局。
+    """
+    rng = random.Random(seed)
+    os.makedirs(mods_dir, exist_ok=True)
+    mod_ids = []
+    for i in range(jar_count):
+        mod_id = f"benchmod{i}"
+        mod_ids.append(mod_id)
+        jar_path = os.path.join(mods_dir, f"{mod_id}-1.{rng.randint(0, 9)}.jar")
+        with zipfile.ZipFile(jar_path, "w", zipfile.ZIP_DEFLATED) as z:
+            kind = i % 4
+            if kind == 0:
+                z.writestr("META-INF/mods.toml",
+                           f'modLoader="javafml"\nloaderVersion="[47,)"\n[[mods]]\nmodId="{mod_id}"\n'
+                           f'version="1.0.{i}"\ndisplayName="Bench Mod {i}"\nauthors="forge_author{i % 7}"\n')
+            elif kind == 1:
+                z.writestr("META-INF/neoforge.mods.toml",
+                           f'modLoader="javafml"\n[[mods]]\nmodId="{mod_id}"\nversion="2.0.{i}"\n'
+                           f'displayName="Bench Mod {i}"\nauthors="neo_author{i % 5}"\n')
+            elif kind == 2:
+                z.writestr("fabric.mod.json", json.dumps({
+                    "schemaVersion": 1, "id": mod_id, "version": f"3.0.{i}",
+                    "name": f"Bench Mod {i}", "authors": [f"fabric_author{i % 3}"],
+                }))
+            else:
+                z.writestr("mcmod.info", json.dumps([{
+                    "modid": mod_id, "name": f"Bench Mod {i}", "version": f"4.0.{i}",
+                    "authorList": [f"legacy_author{i % 4}"],
+                }]))
+
+            for j in range(items_per_jar):
+                if j % 2 == 0:
+                    z.writestr(f"assets/{mod_id}/models/item/item_{j}.json", '{"parent": "item/generated"}')
+                else:
+                    z.writestr(f"data/{mod_id}/item/item_{j}/", "")
+            # 一些无关条目，让 namelist 更接近真实 jar
+            for j in range(items_per_jar // 4):
+                z.writestr(f"com/example/{mod_id}/Class{j}.class", b"\xca\xfe\xba\xbe")
+    return mod_ids
+
+
+def generate_snbt(path, tab_count, entries_per_tab, mod_ids, items_per_jar, seed=0):
+    """生成合成的 sdmshop.snbt，物品从给定模组与原版物品中随机选取（约 1/8 为不存在的物品）"""
+    rng = random.Random(seed)
+    vanilla = ["minecraft:stone", "minecraft:dirt", "minecraft:diamond", "minecraft:scute", "minecraft:iron_ingot"]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{\n\tshopTabs: [\n")
+        for t in range(tab_count):
+            f.write("\t\t{\n\t\t\ttabEntry: [\n")
+            for e in range(entries_per_tab):
+                roll = rng.random()
+                if roll < 0.25:
+                    item = rng.choice(vanilla)
+                elif roll < 0.375:
+                    item = f"missingmod{rng.randint(0, 50)}:item_{rng.randint(0, 9)}"
+                else:
+                    item = f"{rng.choice(mod_ids)}:item_{rng.randint(0, max(items_per_jar - 1, 0))}"
+                f.write(
+                    "\t\t\t\t{\n"
+                    f'\t\t\t\t\tentryUUID: "{t:04x}-{e:04x}"\n'
+                    f'\t\t\t\t\tentryType: {{ itemStack: {{ id: "{item}", Count: {rng.randint(1, 64)}b }}, type: "itemType" }}\n'
+                    f"\t\t\t\t\tentryPrice: {rng.randint(1, 9999)}L\n"
+                    f"\t\t\t\t\tisSell: {rng.randint(0, 1)}b\n"
+                    "\t\t\t\t}\n"
+                )
+            icon = f"{rng.choice(mod_ids)}:item_0" if mod_ids else "minecraft:stone"
+            f.write(f'\t\t\t]\n\t\t\ticon: {{ id: "{icon}", Count: 1b }}\n'
+                    f'\t\t\ttitle: "分类{t}"\n\t\t\tshopTabUUID: "tab-{t}"\n\t\t}}\n')
+        f.write("\t]\n}\n")
+    return path
+
+
+# ==================== 计时 ====================
+
+def measure(func, repeat):
+    """重复执行 repeat 次，返回最短耗时（秒）和最后一次的返回值"""
+    best = None
+    value = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        value = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, value
+
+
+def run_benchmarks(workdir, args):
+    """生成数据并对各阶段计时，返回 {基准项: 秒}"""
+    source_mods = os.path.join(workdir, "source", "mods")
+    target_mods_dir = os.path.join(workdir, "target", "mods")
+    snbt_file = os.path.join(workdir, "sdmshop.snbt")
+
+    print(f"生成合成数据: {args.jars} 个 jar × {args.items} 个物品, {args.tabs} 个分类 × {args.entries} 个条目")
+    mod_ids = generate_mods_dir(source_mods, args.jars, args.items, seed=1)
+    generate_mods_dir(target_mods_dir, args.jars, args.items, seed=2)
+    generate_snbt(snbt_file, args.tabs, args.entries, mod_ids, args.items, seed=3)
+
+    results = {}
+
+    results["get_installed_mods"], target_mods = measure(
+        lambda: toolkit.get_installed_mods(target_mods_dir), args.repeat)
+    results["scan_all_items_from_mods"], _ = measure(
+        lambda: toolkit.scan_all_items_from_mods(target_mods_dir, target_mods), args.repeat)
+    results["parse_snbt_by_category"], categories_data = measure(
+        lambda: toolkit.parse_snbt_by_category(snbt_file), args.repeat)
+
+    categories = [
+        toolkit.create_category(cat["title"], cat["icon"], [toolkit.create_shopproj_item(item) for item in cat["items"]])
+        for cat in categories_data
+    ]
+    shopproj = toolkit.build_shopproj(categories)
+
+    def encode():
+        writer = toolkit.NBTWriter()
+        writer.write_root(shopproj["_root_name"], shopproj["data"])
+        return writer.get_bytes()
+
+    results["NBTWriter"], nbt_bytes = measure(encode, args.repeat)
+    results["encode_category_payload"], _ = measure(
+        lambda: [toolkit.encode_category_payload(category) for category in categories], args.repeat)
+    results["NBTReader"], _ = measure(lambda: toolkit.NBTReader(nbt_bytes).read_root(), args.repeat)
+
+    # 生成的商店必须通过结构校验，否则计时没有意义
+    shop_file = os.path.join(workdir, "generated.shopproj")
+    with open(shop_file, "wb") as f:
+        f.write(nbt_bytes)
+    errors, error_count = toolkit.validate_shopproj(shop_file)
+    if error_count:
+        raise RuntimeError(f"生成的商店未通过结构校验（{error_count} 个问题）: {errors[0]}")
+
+    def end_to_end():
+        output_dir = os.path.join(workdir, "output")
+        shutil.rmtree(output_dir, ignore_errors=True)
+        options = toolkit.ConversionOptions(
+            source_dir=os.path.dirname(source_mods),
+            target_dir=os.path.dirname(target_mods_dir),
+            snbt_file=snbt_file,
+            output_dir=output_dir,
+            checkpoints=False,
+            perf_report=False,
+        )
+        result = toolkit.run_sdm_conversion(options)
+        # 失败的转换耗时没有参考价值，不能作为基准
+        if not result.nbt_file or result.validation_errors:
+            raise RuntimeError(f"完整转换失败: 输出 {result.nbt_file}, 结构问题 {len(result.validation_errors)} 个")
+        return result
+
+    results["end_to_end"], _ = measure(end_to_end, args.repeat)
+    return results
+
+
+# ==================== 基准对比 ====================
+
+def load_baseline(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def compare_with_baseline(results, baseline, threshold):
+    """打印与基准的对比，返回退化的基准项列表"""
+    regressions = []
+    print(f"\n{'基准项':<28}{'本次(s)':>12}{'基准(s)':>12}{'变化':>10}")
+    for name, seconds in results.items():
+        base = baseline["results"].get(name) if baseline else None
+        if base:
+            change = (seconds - base) / base * 100
+            flag = "  ✗" if change > threshold else ""
+            print(f"{name:<28}{seconds:>12.4f}{base:>12.4f}{change:>+9.1f}%{flag}")
+            if change > threshold:
+                regressions.append(name)
+        else:
+            print(f"{name:<28}{seconds:>12.4f}{'-':>12}{'-':>10}")
+    return regressions
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="SDM 商店转 ViScriptShop 工具的合成数据性能基准")
+    parser.add_argument("--jars", type=int, default=100, help="每个 mods 目录的 jar 数量 (默认: 100)")
+    parser.add_argument("--items", type=int, default=50, help="每个 jar 的物品条目数 (默认: 50)")
+    parser.add_argument("--tabs", type=int, default=40, help="snbt 分类数 (默认: 40)")
+    parser.add_argument("--entries", type=int, default=100, help="每个分类的条目数 (默认: 100)")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数，取最短耗时 (默认: 3)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基准文件路径")
+    parser.add_argument("--threshold", type=float, default=20.0, help="判定退化的百分比阈值 (默认: 20)")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基准")
+    parser.add_argument("--keep", action="store_true", help="保留生成的临时数据目录")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    # 基准只关心耗时，关闭转换日志输出
+    toolkit.logger.setLevel(logging.WARNING)
+    params = {key: getattr(args, key) for key in ("jars", "items", "tabs", "entries")}
+
+    workdir = tempfile.mkdtemp(prefix="shop_toolkit_bench_")
+    try:
+        results = run_benchmarks(workdir, args)
+    finally:
+        if args.keep:
+            print(f"合成数据保留在: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = load_baseline(args.baseline)
+    if baseline and baseline.get("params") != params:
+        print(f"基准的生成参数 {baseline.get('params')} 与本次不同，不做对比")
+        baseline = None
+    regressions = compare_with_baseline(results, baseline, args.threshold)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "tool_version": toolkit.TOOL_VERSION,
+                "generated": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                "params": params,
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\n基准已保存: {args.baseline}")
+
+    if regressions:
+        print(f"\n✗ 以下基准项比基准慢 {args.threshold:g}% 以上: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,19 +4,231 @@
 SDM商店转ViScriptShop工具 - GUI 版本
 功能:
   1. SDM商店转ViScriptShop工具
+
+用法:
+  python shop_toolkit_gui.py                 启动 GUI
+  python -m shop_toolkit_gui convert ...     无界面转换（见 --help）
 """
 
+import time
+_STARTUP_TIME = time.perf_counter()
+
 import json
+import hashlib
+import filecmp
 import re
 import os
+import glob
 import sys
+import shutil
+import tempfile
 import struct
+import logging
+import mmap
+import multiprocessing
+import functools
+import itertools
 import zipfile
+import zlib
+import threading
+import uuid
+from array import array
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
 from io import BytesIO
+from logging.handlers import RotatingFileHandler
 from pathlib import Path
 from datetime import datetime
-import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
+
+try:
+    import tomllib  # Python 3.11+
+except ImportError:
+    tomllib = None
+
+__version__ = "1.0.0"
+TOOL_VERSION = __version__  # 参与检查点键的计算，版本变化后旧检查点自动失效
+
+# tkinter 只在启动 GUI 时导入，命令行和库调用不需要图形环境
+tk = ttk = filedialog = messagebox = None
+
+
+def _import_tkinter():
+    """按需导入 tkinter"""
+    global tk, ttk, filedialog, messagebox
+    if tk is None:
+        import tkinter
+        from tkinter import ttk as _ttk, filedialog as _filedialog, messagebox as _messagebox
+        tk, ttk, filedialog, messagebox = tkinter, _ttk, _filedialog, _messagebox
+
+# 全局日志记录器，GUI 控件与报告目录下的日志文件都挂在它上面
+logger = logging.getLogger("shop_toolkit")
+logger.setLevel(logging.DEBUG)
+
+# 当前线程所属的转换服务请求的日志记录器；模块内函数写到 logger 的日志在请求线程中改写到它，
+# 并发请求的日志不会混在一起，也不会缺失在请求自己的日志文件中
+_request_log_local = threading.local()
+
+
+def current_request_log():
+    return getattr(_request_log_local, "log", None)
+
+
+@contextmanager
+def activate_request_log(log):
+    """在当前线程把 logger 的日志改写到 log"""
+    previous = current_request_log()
+    _request_log_local.log = log
+    try:
+        yield log
+    finally:
+        _request_log_local.log = previous
+
+
+def _route_request_log(record):
+    request_log = current_request_log()
+    if request_log is None:
+        return True
+    request_log.handle(record)
+    return False
+
+
+logger.addFilter(_route_request_log)
+
+# ==================== 性能统计 ====================
+
+class PerfRecorder:
+    """记录各步骤/热点函数的墙钟时间、CPU 时间、计数器（读写字节、jar 数等）和内存峰值"""
+
+    def __init__(self, trace_memory=False):
+        self.timers = {}    # {名称: {"wall": 秒, "cpu": 秒, "calls": 次数}}
+        self.counters = {}  # {名称: 数值}
+        self.trace_memory = trace_memory
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        if trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - wall_start, time.thread_time() - cpu_start)
+
+    def add_time(self, name, wall, cpu=None):
+        with self.lock:
+            timer = self.timers.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+            timer["wall"] += wall
+            timer["calls"] += 1
+            if cpu is None:
+                timer["cpu"] = None
+            elif timer["cpu"] is not None:
+                timer["cpu"] += cpu
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def memory(self):
+        """内存峰值：进程常驻内存峰值（KB），开启 trace_memory 时附带 tracemalloc 峰值"""
+        result = {}
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # macOS 返回字节，Linux 返回 KB
+            result["peak_rss_kb"] = peak // 1024 if sys.platform == "darwin" else peak
+        except ImportError:
+            pass
+        if self.trace_memory:
+            import tracemalloc
+            if tracemalloc.is_tracing():
+                result["tracemalloc_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        return result
+
+    def report(self):
+        return {
+            "tool_version": TOOL_VERSION,
+            "generated": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "total": {
+                "wall": round(time.perf_counter() - self.started, 6),
+                "cpu": round(time.process_time() - self.cpu_started, 6),
+            },
+            "timers": {
+                name: {k: (round(v, 6) if isinstance(v, float) else v) for k, v in timer.items()}
+                for name, timer in self.timers.items()
+            },
+            "counters": dict(self.counters),
+            "memory": self.memory(),
+        }
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+        return path
+
+    def close(self):
+        """停止 tracemalloc（转换失败时也要调用，否则之后的代码一直带着内存追踪的开销运行）"""
+        if self.trace_memory:
+            import tracemalloc
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+
+# 当前线程的性能记录器；热点函数在没有记录器时不做任何统计
+_perf_local = threading.local()
+
+
+def current_perf():
+    return getattr(_perf_local, "recorder", None)
+
+
+@contextmanager
+def activate_perf(recorder):
+    """在当前线程启用性能记录器"""
+    previous = current_perf()
+    _perf_local.recorder = recorder
+    try:
+        yield recorder
+    finally:
+        _perf_local.recorder = previous
+
+
+@contextmanager
+def perf_stage(name):
+    """统计一个步骤/函数的耗时（未启用记录器时为空操作）"""
+    recorder = current_perf()
+    if recorder is None:
+        yield
+    else:
+        with recorder.stage(name):
+            yield
+
+
+def perf_count(name, amount=1):
+    recorder = current_perf()
+    if recorder is not None:
+        recorder.count(name, amount)
+
+
+def perf_timed(name):
+    """装饰器：统计函数每次调用的耗时（未启用记录器时直接调用）"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            recorder = current_perf()
+            if recorder is None:
+                return func(*args, **kwargs)
+            with recorder.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
 
 # ==================== 导入原有功能 ====================
 
@@ -31,7 +243,8 @@ class NBTReader:
     }
 
     def __init__(self, data: bytes):
-        self.stream = BytesIO(data)
+        # mmap 本身支持 read / seek，直接在映射上解析，不再复制一份到 BytesIO
+        self.stream = data if isinstance(data, mmap.mmap) else BytesIO(data)
 
     def read_byte(self) -> int:
         return struct.unpack('>b', self.stream.read(1))[0]
@@ -310,6 +523,7 @@ class NBTWriter:
         else:
             raise ValueError(f"未知的标签类型: {tag_type}")
 
+    @perf_timed("NBTWriter.write_root")
     def write_root(self, name: str, data):
         if isinstance(data, dict) and "_type" in data:
             type_name = data["_type"]
@@ -317,29 +531,102 @@ class NBTWriter:
         else:
             tag_type = 10
 
+        start = self.stream.tell()  # 流可能已写入其他内容（如回填位置之前的数据），只统计本次写出的字节
         self.write_byte(tag_type)
         self.write_string(name)
         self.write_payload(tag_type, data)
+        perf_count("nbt_bytes_encoded", self.stream.tell() - start)
 
     def get_bytes(self) -> bytes:
         return self.stream.getvalue()
 
 
+class DeferredInt:
+    """写出时还不知道的 int 值，由 StreamingNBTWriter.finish() 回填"""
+
+    def __init__(self, value=0):
+        self.value = value
+
+
+class StreamingNBTWriter(NBTWriter):
+    """直接写入可 seek 的文件对象的 NBT 写入器
+
+    list 的 _value 可以是迭代器：先写占位长度，元素逐个编码写出后回填实际长度；
+    int 的 _value 可以是 DeferredInt：先写占位值，finish() 时按最终值回填；
+    bytes 值视为已编码好的载荷，原样写出。
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.deferred = []  # [(偏移, DeferredInt)]
+
+    def write_list(self, value: dict):
+        items = value.get("_value", [])
+        if isinstance(items, (list, tuple)):
+            super().write_list(value)
+            return
+
+        tag_type = self.TYPE_IDS.get(value.get("_element_type", "byte"), 1)
+        self.write_byte(tag_type)
+        length_offset = self.stream.tell()
+        self.write_int(0)
+        count = 0
+        for item in items:
+            self.write_payload(tag_type, item)
+            count += 1
+        self._patch_int(length_offset, count)
+
+    def write_payload(self, tag_type: int, value):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            self.stream.write(value)
+        elif tag_type == 3 and isinstance(value, dict) and isinstance(value.get("_value"), DeferredInt):
+            self.deferred.append((self.stream.tell(), value["_value"]))
+            self.write_int(0)
+        else:
+            super().write_payload(tag_type, value)
+
+    def finish(self):
+        """回填所有 DeferredInt"""
+        for offset, deferred in self.deferred:
+            self._patch_int(offset, deferred.value)
+        self.deferred.clear()
+
+    def _patch_int(self, offset, value):
+        end = self.stream.tell()
+        self.stream.seek(offset)
+        self.write_int(value)
+        self.stream.seek(end)
+
+
+@contextmanager
+def map_input_file(path):
+    """只读映射输入文件，产出支持切片、find 和正则的缓冲区（空文件产出 b''）
+
+    大文件不必整体读入内存，按需从页缓存读取；映射在 with 结束时关闭，
+    产出的缓冲区及其切片以外的引用不要带出 with。
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            perf_count("bytes_read", len(mapped))
+            yield mapped
+
+
 # 导入功能函数
 def nbt_to_json(input_file: str, output_file: str = None):
     """NBT 转 JSON"""
     if output_file is None:
         output_file = input_file + '.json'
 
-    with open(input_file, 'rb') as f:
-        data = f.read()
-
-    if data[:2] == b'\x1f\x8b':
-        import gzip
-        data = gzip.decompress(data)
+    with map_input_file(input_file) as data:
+        if data[:2] == b'\x1f\x8b':
+            import gzip
+            data = gzip.decompress(data)
 
-    reader = NBTReader(data)
-    result = reader.read_root()
+        reader = NBTReader(data)
+        result = reader.read_root()
 
     with open(output_file, 'w', encoding='utf-8') as f:
         json.dump(result, f, ensure_ascii=False, indent=2)
@@ -365,180 +652,958 @@ def json_to_nbt(input_file: str, output_file: str = None, compress: bool = False
     root_name = json_data.get("_root_name", "")
     root_data = json_data.get("data", json_data)
 
-    writer = NBTWriter()
-    writer.write_root(root_name, root_data)
+    # 边编码边写入临时文件，不在内存中再保留一份完整的 NBT 字节
+    temp_file = output_file + ".tmp"
+    try:
+        with open(temp_file, 'wb') as f:
+            if compress:
+                import gzip
+                with gzip.GzipFile(fileobj=f, mode='wb') as stream:
+                    StreamingNBTWriter(stream).write_root(root_name, root_data)
+            else:
+                StreamingNBTWriter(f).write_root(root_name, root_data)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    os.replace(temp_file, output_file)
+
+    return output_file
+
+
+SELL_TRADE_TYPE = "viscript_shop.data.merchant.tradeType.sell"
+BUY_TRADE_TYPE = "viscript_shop.data.merchant.tradeType.buy"
+
+
+def _snbt_string(value):
+    """SNBT 双引号字符串"""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+class SNBTShopWriter:
+    """逐个分类写出 SDM 商店 sdmshop.snbt，写出格式可被 parse_snbt_by_category 读回"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.tab_count = 0
+        self.entry_count = 0
+        self.stream.write("{\n\tshopTabs: [\n")
+
+    def write_tab(self, title, icon_id, entries):
+        """写出一个分类，entries 为 {"id", "count", "price", "is_sell"} 的可迭代对象"""
+        tab_index = self.tab_count
+        parts = ["\t\t{\n\t\t\ttabEntry: [\n"]
+        for entry_index, entry in enumerate(entries):
+            entry_uuid = uuid.uuid5(uuid.NAMESPACE_URL, f"viscript-shop/{tab_index}/{entry_index}")
+            parts.append(
+                "\t\t\t\t{\n"
+                f"\t\t\t\t\tentryUUID: \"{entry_uuid}\"\n"
+                f"\t\t\t\t\tentryType: {{ itemStack: {{ id: {_snbt_string(entry['id'])}, Count: {entry['count']}b }}, type: \"itemType\" }}\n"
+                f"\t\t\t\t\tentryPrice: {entry['price']}L\n"
+                f"\t\t\t\t\tisSell: {entry['is_sell']}b\n"
+                "\t\t\t\t}\n"
+            )
+            self.entry_count += 1
+        tab_uuid = uuid.uuid5(uuid.NAMESPACE_URL, f"viscript-shop/{tab_index}")
+        parts.append(
+            "\t\t\t]\n"
+            # 图标按多行格式写出（id 后不跟逗号），parse_snbt_by_category 才能完整读回
+            f"\t\t\ticon: {{\n\t\t\t\tid: {_snbt_string(icon_id)}\n\t\t\t\tCount: 1b\n\t\t\t}}\n"
+            f"\t\t\ttitle: {_snbt_string(title)}\n"
+            f"\t\t\tshopTabUUID: \"{tab_uuid}\"\n"
+            "\t\t}\n"
+        )
+        self.stream.write("".join(parts))
+        self.tab_count += 1
+
+    def close(self):
+        self.stream.write("\t]\n}\n")
+
+
+def _merchant_to_entry(merchant):
+    """ViScriptShop 商人条目 → SDM 条目 {"id", "count", "price", "is_sell"}；没有物品的条目返回 None"""
+    item = merchant.get("itemResult", {})
+    item_id = item.get("id", {}).get("_value")
+    if not item_id:
+        return None
+    count = item.get("count", {}).get("_value", 1)
+    return {
+        "id": item_id,
+        # SDM 的 Count 是 byte
+        "count": max(1, min(int(count), 127)),
+        "price": merchant.get("money", {}).get("_value", 0),
+        "is_sell": 1 if merchant.get("tradeType", {}).get("_value") == SELL_TRADE_TYPE else 0,
+    }
+
+
+_SHARD_NAME = re.compile(r'^(.*) \((\d+)\)$')
+
+
+def _merge_category_shards(categories):
+    """把转换时拆分出的连续子分类「名称 (1)」「名称 (2)」… 合并回一个分类，逐个生成 (名称, 图标, 商人列表)"""
+    current = None  # [名称, 图标, 商人列表, 下一个编号]
+    for category in categories:
+        name = category.get("name", {}).get("_value", "")
+        icon = category.get("iconItem", {}).get("id", {}).get("_value", "minecraft:grass_block")
+        merchants = category.get("merchants", {}).get("payload", {}).get("_value", [])
+        match = _SHARD_NAME.match(name)
+        if (current and match and match.group(1) == current[0] and int(match.group(2)) == current[3]
+                and icon == current[1]):
+            current[2].extend(merchants)
+            current[3] += 1
+            continue
+        if current:
+            yield current[0], current[1], current[2]
+        if match and match.group(2) == "1":
+            current = [match.group(1), icon, list(merchants), 2]
+        else:
+            current = None
+            yield name, icon, merchants
+    if current:
+        yield current[0], current[1], current[2]
+
+
+@perf_timed("shopproj_to_snbt")
+def shopproj_to_snbt(input_file, output_file="sdmshop.snbt", merge_shards=True):
+    """ViScriptShop .shopproj → SDM sdmshop.snbt
+
+    tradeType / money / itemResult 分别还原为 isSell / entryPrice / itemStack；
+    merge_shards=True 时把转换时拆分的「名称 (1)」「名称 (2)」… 子分类合并回原分类。
+    返回 (输出文件, 分类数, 条目数)。
+    """
+    with map_input_file(input_file) as data:
+        if data[:2] == b'\x1f\x8b':
+            import gzip
+            data = gzip.decompress(data)
+        root = NBTReader(data).read_root()
+    try:
+        categories = root["data"]["data"]["shop"]["categoryInfos"]["payload"]["_value"]
+    except (KeyError, TypeError):
+        raise ValueError(f"{input_file} 不是有效的 ViScriptShop 商店项目文件")
+
+    if merge_shards:
+        tabs = _merge_category_shards(categories)
+    else:
+        tabs = (
+            (c.get("name", {}).get("_value", ""),
+             c.get("iconItem", {}).get("id", {}).get("_value", "minecraft:grass_block"),
+             c.get("merchants", {}).get("payload", {}).get("_value", []))
+            for c in categories
+        )
+
+    with open(output_file, 'w', encoding='utf-8') as f:
+        writer = SNBTShopWriter(f)
+        for title, icon, merchants in tabs:
+            entries = (entry for entry in map(_merchant_to_entry, merchants) if entry is not None)
+            writer.write_tab(title, icon, entries)
+        writer.close()
+
+    return output_file, writer.tab_count, writer.entry_count
+
+
+# NBT 路径查询：在二进制数据上按路径定位，只解码命中的子树
+_NBT_FIXED_SIZES = {1: 1, 2: 2, 3: 4, 4: 8, 5: 4, 6: 8}
+_NBT_PATH_TOKEN = re.compile(r'\.?(?:([^.\[\]]+)|\[([^\]]*)\])')
+_NBT_FILTER = re.compile(r'^\?\s*([^=!~\s]+)\s*(==|!=|~=)\s*(.*?)\s*$')
+
+
+def parse_nbt_path(expression):
+    """解析路径表达式，返回步骤列表 [(类型, 参数)]
+
+    name / * 取复合标签的子标签，[*] 取列表全部元素，[n] 取第 n 个元素（负数从末尾数），
+    [?相对路径==值] / [?相对路径!=值] / [?相对路径~=子串] 按元素内的值过滤列表元素，
+    例如 data.shop.categoryInfos.payload[*].merchants.payload[?itemResult.id==minecraft:diamond]
+    """
+    steps = []
+    pos = 0
+    expression = expression.strip()
+    while pos < len(expression):
+        match = _NBT_PATH_TOKEN.match(expression, pos)
+        if not match or match.end() == pos:
+            raise ValueError(f"无法解析路径: {expression!r} (位置 {pos})")
+        key, bracket = match.groups()
+        if key is not None:
+            steps.append(("key", key))
+        elif bracket == "*":
+            steps.append(("all", None))
+        elif re.fullmatch(r'-?\d+', bracket):
+            steps.append(("index", int(bracket)))
+        else:
+            condition = _NBT_FILTER.match(bracket)
+            if not condition:
+                raise ValueError(f"无法解析过滤条件: [{bracket}]")
+            rel_path, op, value = condition.groups()
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+                value = value[1:-1]
+            steps.append(("filter", (parse_nbt_path(rel_path), op, value)))
+        pos = match.end()
+    return steps
+
+
+def _skip_nbt_payload(data, pos, tag_type):
+    """跳过一个标签载荷，返回其后的位置"""
+    size = _NBT_FIXED_SIZES.get(tag_type)
+    if size is not None:
+        return pos + size
+    if tag_type == 8:
+        return pos + 2 + struct.unpack_from('>H', data, pos)[0]
+    if tag_type == 10:
+        while True:
+            entry_type = data[pos]
+            if entry_type == 0:
+                return pos + 1
+            pos += 3 + struct.unpack_from('>H', data, pos + 1)[0]
+            pos = _skip_nbt_payload(data, pos, entry_type)
+    if tag_type == 9:
+        element_type = data[pos]
+        length = struct.unpack_from('>i', data, pos + 1)[0]
+        pos += 5
+        size = _NBT_FIXED_SIZES.get(element_type)
+        if size is not None:
+            return pos + size * max(length, 0)
+        for _ in range(length):
+            pos = _skip_nbt_payload(data, pos, element_type)
+        return pos
+    if tag_type in (7, 11, 12):
+        length = struct.unpack_from('>i', data, pos)[0]
+        return pos + 4 + length * {7: 1, 11: 4, 12: 8}[tag_type]
+    raise ValueError(f"未知的标签类型: {tag_type}")
+
+
+def _iter_nbt_compound(data, pos):
+    """逐个生成复合标签的 (类型, 名称, 载荷位置)；调用方处理完一项后才跳过它的载荷"""
+    while True:
+        tag_type = data[pos]
+        if tag_type == 0:
+            return
+        length = struct.unpack_from('>H', data, pos + 1)[0]
+        name = bytes(data[pos + 3:pos + 3 + length]).decode('utf-8', errors='replace')
+        payload_pos = pos + 3 + length
+        yield tag_type, name, payload_pos
+        pos = _skip_nbt_payload(data, payload_pos, tag_type)
+
+
+def _iter_nbt_list(data, pos):
+    """逐个生成列表元素的 (下标, 类型, 载荷位置)"""
+    element_type = data[pos]
+    length = struct.unpack_from('>i', data, pos + 1)[0]
+    pos += 5
+    for index in range(length):
+        yield index, element_type, pos
+        pos = _skip_nbt_payload(data, pos, element_type)
+
+
+def nbt_to_plain(value):
+    """带类型标记的 NBT 值 → 普通 JSON 值（去掉 _type 等标记）"""
+    if isinstance(value, dict):
+        if value.get("_type") == "compound":
+            return {k: nbt_to_plain(v) for k, v in value.items() if not k.startswith('_')}
+        if value.get("_type") == "list":
+            return [nbt_to_plain(v) for v in value["_value"]]
+        return value.get("_value")
+    return value
+
+
+def _match_nbt_filter(reader, data, pos, tag_type, condition):
+    steps, op, expected = condition
+    values = [str(nbt_to_plain(value)) for _, value in _walk_nbt_path(reader, data, pos, tag_type, steps, "")]
+    if op == "==":
+        return expected in values
+    if op == "!=":
+        return expected not in values
+    return any(expected in value for value in values)
+
+
+def _child_path(path, name):
+    """NBT 路径中 path 下的键 name（根下的键不带前导的 .）"""
+    return f"{path}.{name}" if path else name
+
+
+def _walk_nbt_path(reader, data, pos, tag_type, steps, path):
+    """按步骤在二进制数据上定位，只对路径末端命中的标签调用 reader 解码"""
+    if not steps:
+        reader.stream.seek(pos)
+        yield path, reader.read_payload(tag_type)
+        return
 
-    nbt_data = writer.get_bytes()
+    kind, arg = steps[0]
+    rest = steps[1:]
+    if kind == "key":
+        if tag_type != 10:
+            return
+        for entry_type, name, payload_pos in _iter_nbt_compound(data, pos):
+            if arg == "*" or name == arg:
+                yield from _walk_nbt_path(reader, data, payload_pos, entry_type, rest, _child_path(path, name))
+                if arg != "*":
+                    return
+        return
+
+    if tag_type != 9:
+        return
+    if kind == "index":
+        length = struct.unpack_from('>i', data, pos + 1)[0]
+        wanted = arg + length if arg < 0 else arg
+        if not 0 <= wanted < length:
+            return
+    for index, element_type, element_pos in _iter_nbt_list(data, pos):
+        if kind == "index" and index != wanted:
+            continue
+        if kind == "filter" and not _match_nbt_filter(reader, data, element_pos, element_type, arg):
+            continue
+        yield from _walk_nbt_path(reader, data, element_pos, element_type, rest, f"{path}[{index}]")
+        if kind == "index":
+            return
+
+
+def query_nbt(data, expression):
+    """在 NBT 数据（bytes 或其他支持切片的缓冲区）上执行路径查询，逐个生成 (实际路径, 带类型标记的值)
 
-    if compress:
+    路径从根复合标签开始，例如 data.shop.categoryInfos.payload[*].name。
+    """
+    steps = parse_nbt_path(expression)
+    if data[:2] == b'\x1f\x8b':
         import gzip
-        nbt_data = gzip.compress(nbt_data)
+        data = gzip.decompress(data)
+    root_type = data[0]
+    payload_pos = 3 + struct.unpack_from('>H', data, 1)[0]
+    reader = NBTReader(data)
+    yield from _walk_nbt_path(reader, data, payload_pos, root_type, steps, "")
 
-    with open(output_file, 'wb') as f:
-        f.write(nbt_data)
 
-    return output_file
+# shopproj 结构校验：声明式结构描述，对应 create_shopproj_item / create_category / build_shopproj 生成的布局
+# type 为标签类型；compound 的 keys 列出必需的子标签（allow_extra 允许其他子标签），list 的 items 描述元素；
+# count_of 要求 int 值等于同一复合标签中某个列表的元素数；enum / pattern / min 约束取值。
+_RESOURCE_ID_PATTERN = r'^[a-z0-9_.-]+:[a-z0-9_./-]+$'
+
+MERCHANT_SCHEMA = {
+    "type": "compound",
+    "keys": {
+        "xp": {"type": "int", "min": 0},
+        "tradeType": {"type": "string", "enum": [SELL_TRADE_TYPE, BUY_TRADE_TYPE]},
+        "command": {"type": "string"},
+        "itemResult": {
+            "type": "compound",
+            "keys": {
+                "id": {"type": "string", "pattern": _RESOURCE_ID_PATTERN},
+                "count": {"type": "int", "min": 1},
+            },
+        },
+        "itemB": {"type": "compound", "keys": {}, "allow_extra": True},
+        "itemA": {"type": "compound", "keys": {}, "allow_extra": True},
+        "stage": {"type": "int", "min": 0},
+        "money": {"type": "int", "min": 0},
+    },
+}
+
+CATEGORY_SCHEMA = {
+    "type": "compound",
+    "keys": {
+        "iconItem": {
+            "type": "compound",
+            "keys": {
+                "id": {"type": "string", "pattern": _RESOURCE_ID_PATTERN},
+                "count": {"type": "int", "min": 1},
+            },
+        },
+        "iconType": {"type": "string", "enum": ["viscript_shop.data.category.iconType.item"]},
+        "name": {"type": "string"},
+        "merchants": {
+            "type": "compound",
+            "keys": {
+                "payload": {"type": "list", "items": MERCHANT_SCHEMA},
+                "uid": {"type": "int", "count_of": "payload"},
+            },
+        },
+        "shopType": {"type": "string", "enum": ["viscript_shop.data.category.shopType.currency"]},
+        "iconTexture": {"type": "string"},
+    },
+}
+
+SHOPPROJ_SCHEMA = {
+    "type": "compound",
+    "keys": {
+        "meta": {
+            "type": "compound",
+            "keys": {
+                "version_num": {"type": "int"},
+                "suffix": {"type": "string", "enum": [".shopproj"]},
+                "version": {"type": "string"},
+                "name": {"type": "string"},
+            },
+        },
+        "data": {
+            "type": "compound",
+            "keys": {
+                "shop": {
+                    "type": "compound",
+                    "keys": {
+                        "lockedMerchantVisibility": {"type": "string"},
+                        "isQuickOpening": {"type": "byte"},
+                        "name": {"type": "string"},
+                        "stage": {"type": "int", "min": 0},
+                        "categoryInfos": {
+                            "type": "compound",
+                            "keys": {
+                                "payload": {"type": "list", "items": CATEGORY_SCHEMA},
+                                "uid": {"type": "int", "count_of": "payload"},
+                            },
+                        },
+                    },
+                },
+            },
+        },
+    },
+}
+
+
+class ShopprojValidator:
+    """按结构描述流式校验 .shopproj：边读边校验，不构建整棵树，内存占用与文件大小无关"""
+
+    def __init__(self, schema=SHOPPROJ_SCHEMA, max_errors=50):
+        self.schema = schema
+        self.max_errors = max_errors
+        self.errors = []
+        self.error_count = 0
+        self.reader = None
+
+    def error(self, path, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(f"{path or '<根>'}: {message}")
+
+    def validate_file(self, path):
+        """校验文件，返回问题列表（最多 max_errors 条，总数见 error_count）"""
+        self.errors = []
+        self.error_count = 0
+        with open(path, 'rb') as f:
+            if f.read(2) == b'\x1f\x8b':
+                import gzip
+                f.seek(0)
+                stream = gzip.GzipFile(fileobj=f)
+            else:
+                f.seek(0)
+                stream = f
+            self.reader = NBTReader(b"")
+            self.reader.stream = stream
+            try:
+                tag_type = self.reader.read_ubyte()
+                self.reader.read_string()
+                self._validate(tag_type, self.schema, "")
+                if stream.read(1):
+                    self.error("", "根标签之后还有多余数据")
+            except (struct.error, EOFError, ValueError) as e:
+                self.error("", f"文件不完整或已损坏: {e}")
+        return self.errors
+
+    def _validate(self, tag_type, schema, path):
+        """校验一个标签载荷并读过它；返回列表长度或整数值（供 count_of 使用），其他返回 None"""
+        expected = NBTWriter.TYPE_IDS[schema["type"]]
+        if tag_type != expected:
+            self.error(path, f"类型应为 {schema['type']}，实际为 {NBTReader.TYPE_NAMES.get(tag_type, tag_type)}")
+            self._skip(tag_type)
+            return None
+
+        if tag_type == 10:
+            keys = schema.get("keys", {})
+            seen = set()
+            numbers = {}
+            while True:
+                entry_type = self.reader.read_ubyte()
+                if entry_type == 0:
+                    break
+                name = self.reader.read_string()
+                child_path = _child_path(path, name)
+                if name in seen:
+                    self.error(child_path, "重复的键")
+                seen.add(name)
+                child_schema = keys.get(name)
+                if child_schema is None:
+                    if not schema.get("allow_extra"):
+                        self.error(child_path, "未知的键")
+                    self._skip(entry_type)
+                    continue
+                numbers[name] = self._validate(entry_type, child_schema, child_path)
+            for name, child_schema in keys.items():
+                if name not in seen:
+                    self.error(_child_path(path, name), "缺少必需的键")
+                elif "count_of" in child_schema:
+                    count, value = numbers.get(child_schema["count_of"]), numbers[name]
+                    if count is not None and value is not None and value != count:
+                        self.error(_child_path(path, name), f"为 {value}，但 {child_schema['count_of']} 有 {count} 个元素")
+            return None
+
+        if tag_type == 9:
+            element_type = self.reader.read_ubyte()
+            length = self.reader.read_int()
+            if length < 0:
+                self.error(path, f"列表长度为负数: {length}")
+                return None
+            item_schema = schema.get("items")
+            for index in range(length):
+                if item_schema is None:
+                    self._skip(element_type)
+                else:
+                    self._validate(element_type, item_schema, f"{path}[{index}]")
+            return length
+
+        if tag_type == 8:
+            value = self.reader.read_string()
+            if "enum" in schema and value not in schema["enum"]:
+                self.error(path, f"取值 {value!r} 不在允许范围内")
+            if "pattern" in schema and not re.match(schema["pattern"], value):
+                self.error(path, f"取值 {value!r} 格式不正确")
+            return None
+
+        value = self.reader.read_payload(tag_type)["_value"]
+        if "min" in schema and value < schema["min"]:
+            self.error(path, f"取值 {value} 小于 {schema['min']}")
+        if "enum" in schema and value not in schema["enum"]:
+            self.error(path, f"取值 {value!r} 不在允许范围内")
+        return value
+
+    def _skip(self, tag_type):
+        """读过一个不需要校验的标签载荷"""
+        reader = self.reader
+        if tag_type == 10:
+            while True:
+                entry_type = reader.read_ubyte()
+                if entry_type == 0:
+                    return
+                reader.read_string()
+                self._skip(entry_type)
+        elif tag_type == 9:
+            element_type = reader.read_ubyte()
+            for _ in range(max(reader.read_int(), 0)):
+                self._skip(element_type)
+        else:
+            reader.read_payload(tag_type)
+
 
+@perf_timed("validate_shopproj")
+def validate_shopproj(path, max_errors=50):
+    """校验 .shopproj 的结构，返回 (问题列表, 问题总数)"""
+    validator = ShopprojValidator(max_errors=max_errors)
+    errors = validator.validate_file(path)
+    return errors, validator.error_count
 
-def get_mod_info_from_jar(jar_path):
-    """从 jar 文件中读取模组信息 (mod_id, author, version, name)"""
-    mod_id = Path(jar_path).stem.split('-')[0].split('_')[0].lower()
+
+@perf_timed("query_nbt_file")
+def query_nbt_file(input_file, expression, output=None, typed=False):
+    """对 NBT 文件执行路径查询，结果按 JSON Lines 写入 output（文本流），返回命中数"""
+    output = output or sys.stdout
+    count = 0
+    with map_input_file(input_file) as data:
+        for path, value in query_nbt(data, expression):
+            record = {"path": path, "value": value if typed else nbt_to_plain(value)}
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def _mod_id_from_jar_name(jar_path):
+    """按文件名推断 mod_id（jar 中没有元数据时的兜底规则）"""
+    return Path(jar_path).stem.split('-')[0].split('_')[0].lower()
+
+
+def _parse_mods_toml(content):
+    """解析 mods.toml / neoforge.mods.toml，按声明顺序返回每个 [[mods]] 的
+    {modId, version, displayName, authors}（authors 未在 [[mods]] 中声明时取顶层的）
+
+    有 tomllib 时按 TOML 解析；没有 tomllib 或文件不是合法 TOML 时按 [[mods]] 分段用正则提取。
+    """
+    data = None
+    if tomllib is not None:
+        try:
+            data = tomllib.loads(content)
+        except tomllib.TOMLDecodeError:
+            data = None
+    if data is None:
+        data = _parse_mods_toml_fallback(content)
+
+    declared = []
+    for entry in data.get("mods") or []:
+        if not isinstance(entry, dict) or not isinstance(entry.get("modId"), str):
+            continue
+        authors = entry.get("authors", data.get("authors"))
+        if isinstance(authors, list):
+            authors = ', '.join(str(a) for a in authors)
+        declared.append({
+            "modId": entry["modId"],
+            "version": str(entry["version"]) if "version" in entry else None,
+            "displayName": entry.get("displayName"),
+            "authors": authors if isinstance(authors, str) else None,
+        })
+    return declared
+
+
+def _parse_mods_toml_fallback(content):
+    """不依赖 tomllib 的简化解析：只取 [[mods]] 表和顶层中 key = "value" 形式的字符串"""
+    def strings(text):
+        return {m.group(1): m.group(2) for m in re.finditer(r'^\s*(\w+)\s*=\s*"([^"]*)"', text, re.M)}
+
+    sections = re.split(r'^\s*(\[\[?[^\]]+\]\]?)\s*$', content, flags=re.M)
+    data = strings(sections[0])
+    data["mods"] = [strings(body) for header, body in zip(sections[1::2], sections[2::2])
+                    if header.replace(' ', '') == '[[mods]]']
+    if not data["mods"]:
+        # 没有 [[mods]] 表头时按旧规则取文件中第一个 modId
+        match = re.search(r'modId\s*=\s*"([^"]+)"', content)
+        if match:
+            data["mods"] = [dict(strings(content), modId=match.group(1))]
+    return data
+
+
+def _read_jar_manifest_version(z):
+    """读取 META-INF/MANIFEST.MF 的 Implementation-Version（用于解析 ${file.jarVersion}）"""
+    try:
+        manifest = z.read('META-INF/MANIFEST.MF').decode('utf-8', errors='replace')
+    except KeyError:
+        return None
+    for line in manifest.splitlines():
+        if line.startswith('Implementation-Version:'):
+            return line.split(':', 1)[1].strip() or None
+    return None
+
+
+def _read_mod_info(z, jar_path):
+    """从已打开的 jar（ZipFile）中读取模组信息，返回 (模组信息, 是否找到元数据文件)"""
+    mod_id = _mod_id_from_jar_name(jar_path)
     author = "未知"
     version = "未知"
     name = Path(jar_path).stem
+    mod_ids = []
+    has_metadata = False
+    id_declared = False  # mod_id 是否来自元数据（否则按文件名推断）
     
     try:
-        with zipfile.ZipFile(jar_path, 'r') as z:
-            # NeoForge / Forge mods.toml
-            if 'META-INF/neoforge.mods.toml' in z.namelist():
-                content = z.read('META-INF/neoforge.mods.toml').decode('utf-8')
-                match = re.search(r'modId\s*=\s*"([^"]+)"', content)
-                if match:
-                    mod_id = match.group(1).lower()
-                # 尝试获取作者
-                author_match = re.search(r'authors\s*=\s*"([^"]+)"', content)
-                if author_match:
-                    author = author_match.group(1)
-                # 尝试获取版本
-                version_match = re.search(r'version\s*=\s*"([^"]+)"', content)
-                if version_match:
-                    version = version_match.group(1)
-                # 尝试获取显示名称
-                display_match = re.search(r'displayName\s*=\s*"([^"]+)"', content)
-                if display_match:
-                    name = display_match.group(1)
-            
-            elif 'META-INF/mods.toml' in z.namelist():
-                content = z.read('META-INF/mods.toml').decode('utf-8')
-                match = re.search(r'modId\s*=\s*"([^"]+)"', content)
-                if match:
-                    mod_id = match.group(1).lower()
-                author_match = re.search(r'authors\s*=\s*"([^"]+)"', content)
-                if author_match:
-                    author = author_match.group(1)
-                version_match = re.search(r'version\s*=\s*"([^"]+)"', content)
-                if version_match:
-                    version = version_match.group(1)
-                display_match = re.search(r'displayName\s*=\s*"([^"]+)"', content)
-                if display_match:
-                    name = display_match.group(1)
-            
-            # Fabric
-            elif 'fabric.mod.json' in z.namelist():
-                content = z.read('fabric.mod.json').decode('utf-8')
-                data = json.loads(content)
-                if 'id' in data:
-                    mod_id = data['id'].lower()
-                if 'authors' in data:
-                    if isinstance(data['authors'], list):
-                        author = ', '.join(str(a) for a in data['authors'])
-                    else:
-                        author = str(data['authors'])
-                if 'version' in data:
-                    version = data['version']
-                if 'name' in data:
-                    name = data['name']
+        # NeoForge / Forge mods.toml：一个 jar 可以用多个 [[mods]] 声明多个模组
+        toml_name = next((n for n in ('META-INF/neoforge.mods.toml', 'META-INF/mods.toml') if n in z.namelist()), None)
+        if toml_name:
+            has_metadata = True
+            declared = _parse_mods_toml(z.read(toml_name).decode('utf-8'))
+            if declared:
+                first = declared[0]
+                mod_id = first["modId"].lower()
+                id_declared = True
+                mod_ids = [entry["modId"].lower() for entry in declared]
+                author = first.get("authors") or author
+                version = first.get("version") or version
+                name = first.get("displayName") or name
+                if "${file.jarVersion}" in version:
+                    jar_version = _read_jar_manifest_version(z)
+                    if jar_version:
+                        version = version.replace("${file.jarVersion}", jar_version)
+        
+        # Fabric
+        elif 'fabric.mod.json' in z.namelist():
+            has_metadata = True
+            content = z.read('fabric.mod.json').decode('utf-8')
+            data = json.loads(content)
+            if isinstance(data.get('id'), str):
+                mod_id = data['id'].lower()
+                id_declared = True
+            if 'authors' in data:
+                if isinstance(data['authors'], list):
+                    author = ', '.join(str(a) for a in data['authors'])
+                else:
+                    author = str(data['authors'])
+            if 'version' in data:
+                version = str(data['version'])
+            if 'name' in data:
+                name = str(data['name'])
+        
+        # 旧版 mcmod.info
+        elif 'mcmod.info' in z.namelist():
+            has_metadata = True
+            content = z.read('mcmod.info').decode('utf-8')
+            data = json.loads(content)
+            mod_info = None
+            if isinstance(data, list) and len(data) > 0:
+                mod_info = data[0]
+            elif isinstance(data, dict) and 'modList' in data:
+                if len(data['modList']) > 0:
+                    mod_info = data['modList'][0]
             
-            # 旧版 mcmod.info
-            elif 'mcmod.info' in z.namelist():
-                content = z.read('mcmod.info').decode('utf-8')
-                data = json.loads(content)
-                mod_info = None
-                if isinstance(data, list) and len(data) > 0:
-                    mod_info = data[0]
-                elif isinstance(data, dict) and 'modList' in data:
-                    if len(data['modList']) > 0:
-                        mod_info = data['modList'][0]
-                
-                if mod_info:
-                    if 'modid' in mod_info:
-                        mod_id = mod_info['modid'].lower()
-                    if 'authorList' in mod_info:
-                        author = ', '.join(mod_info['authorList'])
-                    elif 'authors' in mod_info:
-                        author = mod_info['authors']
-                    if 'version' in mod_info:
-                        version = mod_info['version']
-                    if 'name' in mod_info:
-                        name = mod_info['name']
-    except:
+            if isinstance(mod_info, dict):
+                if isinstance(mod_info.get('modid'), str):
+                    mod_id = mod_info['modid'].lower()
+                    id_declared = True
+                if isinstance(mod_info.get('authorList'), list):
+                    author = ', '.join(str(a) for a in mod_info['authorList'])
+                elif 'authors' in mod_info:
+                    author = str(mod_info['authors'])
+                if 'version' in mod_info:
+                    version = str(mod_info['version'])
+                if 'name' in mod_info:
+                    name = str(mod_info['name'])
+    except (KeyError, ValueError, TypeError, AttributeError, NotImplementedError,
+            zipfile.BadZipFile, zlib.error, UnicodeDecodeError):
+        # 元数据缺项、类型不对或无法解压/解析时沿用按文件名推断的信息
         pass
     
-    return {
+    mod_info = {
         "mod_id": mod_id,
         "author": author,
         "version": version,
         "name": name,
         "jar_name": Path(jar_path).name
     }
+    if len(mod_ids) > 1:
+        mod_info["mod_ids"] = mod_ids
+    if not id_declared:
+        mod_info["mod_id_inferred"] = True
+    return mod_info, has_metadata
+
+
+_jar_metadata_cache = {}  # {(路径, 大小, 修改时间, 是否含内嵌模组): 模组信息}，模组扫描和物品扫描共用
+
+
+@perf_timed("get_mod_info_from_jar")
+def get_mod_info_from_jar(jar_path, nested=False):
+    """从 jar 文件中读取模组信息 (mod_id, author, version, name)
+
+    mods.toml 声明了多个模组时全部 mod_id 列在 mod_ids 中（第一个即 mod_id）；
+    nested=True 时还要解压内嵌 jar，把其中带元数据的子模组（META-INF/jarjar/、META-INF/jars/）列在 nested_mods 中，
+    否则只读取顶层元数据。结果按 jar 的路径、大小和修改时间缓存，jar 不变时不再重复打开。
+    """
+    try:
+        st = os.stat(jar_path)
+    except OSError:
+        st = None
+    key = (os.path.abspath(jar_path), st.st_size, st.st_mtime_ns, nested) if st else None
+    cached = _jar_metadata_cache.get(key)
+    if cached is not None:
+        perf_count("jar_metadata_cache_hits")
+        return cached
+
+    try:
+        with zipfile.ZipFile(jar_path, 'r') as z:
+            mod_info, _ = _read_mod_info(z, jar_path)
+            nested_mods = _scan_nested_jars(z)["mods"] if nested else None
+            if nested_mods:
+                mod_info["nested_mods"] = nested_mods
+        if key is not None:
+            _jar_metadata_cache[key] = mod_info
+        return mod_info
+    except Exception:
+        return {
+            "mod_id": _mod_id_from_jar_name(jar_path),
+            "author": "未知",
+            "version": "未知",
+            "name": Path(jar_path).stem,
+            "jar_name": Path(jar_path).name,
+            "mod_id_inferred": True,
+        }
+
+
+# 整合包清单，按优先顺序查找：CurseForge 启动器实例、Modrinth 整合包、CurseForge 导出
+PACK_MANIFEST_FILES = ("minecraftinstance.json", "modrinth.index.json", "manifest.json")
+
+
+def find_pack_manifest(mods_dir):
+    """在 mods 目录所在的整合包根目录（以及 mods 目录本身）查找整合包清单，返回路径或 None"""
+    mods_dir = os.path.abspath(mods_dir)
+    for root in dict.fromkeys([get_pack_root(mods_dir), mods_dir]):
+        for filename in PACK_MANIFEST_FILES:
+            path = os.path.join(root, filename)
+            if os.path.isfile(path):
+                return path
+    return None
+
+
+def read_pack_manifest(manifest_file):
+    """读取整合包清单，返回 {jar 文件名: {"name", "author", "size"}}（未记录的字段为 None）
+
+    清单只记录项目名称、作者和文件信息，不记录 mod_id 和模组版本，这些仍要从 jar 的元数据读取。
+    CurseForge 导出的 manifest.json 通常只有项目/文件编号，只有带文件名的条目可用。
+    """
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    entries = {}
+
+    def add(jar_name, name=None, author=None, size=None):
+        if not jar_name or '/' in jar_name or not jar_name.endswith(".jar"):
+            return
+        entries[jar_name] = {"name": name or None, "author": author or None, "size": size}
 
+    filename = os.path.basename(manifest_file)
+    if filename == "minecraftinstance.json":
+        for addon in data.get("installedAddons") or []:
+            installed = addon.get("installedFile") or {}
+            authors = ", ".join(a.get("name") or a.get("Name") or "" for a in addon.get("authors") or [])
+            add(installed.get("fileName"), addon.get("name"), addon.get("primaryAuthor") or authors,
+                installed.get("fileLength"))
+    elif filename == "modrinth.index.json":
+        for entry in data.get("files") or []:
+            path = entry.get("path", "")
+            if path.startswith("mods/"):
+                add(path[len("mods/"):], size=entry.get("fileSize"))
+    else:
+        for entry in data.get("files") or []:
+            add(entry.get("fileName") or entry.get("filename"), size=entry.get("fileLength"))
+    return entries
 
-def get_installed_mods(mods_dir):
-    """获取已安装模组的信息字典 {mod_id: {author, version, name, jar_name}}"""
+
+def get_installed_mods(mods_dir, use_manifest=False, nested_mods=False):
+    """获取已安装模组的信息字典 {mod_id: {author, version, name, jar_name}}
+
+    mod_id 总是取自 jar 的元数据（按 jar 的路径、大小和修改时间缓存）；jar 中没有元数据时按文件名推断，
+    并标记 mod_id_inferred=True。use_manifest=True 时 jar 元数据没有作者的模组用整合包清单中的作者补全。
+    nested_mods=True 时内嵌 jar 中的子模组也列为已安装（需要解压内嵌 jar，明显更慢）。
+    """
     installed_mods = {
         "minecraft": {"mod_id": "minecraft", "author": "Mojang", "version": "1.21.1", "name": "Minecraft", "jar_name": "minecraft.jar"}
     }
     
     if not os.path.exists(mods_dir):
         return installed_mods
+
+    manifest = {}
+    manifest_file = find_pack_manifest(mods_dir) if use_manifest else None
+    if manifest_file:
+        try:
+            manifest = read_pack_manifest(manifest_file)
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"   整合包清单 {manifest_file} 无法读取，改为逐个读取 jar: {e}")
     
     for jar_file in Path(mods_dir).glob("*.jar"):
-        mod_info = get_mod_info_from_jar(jar_file)
+        mod_info = get_mod_info_from_jar(jar_file, nested_mods)
+        listed = manifest.get(jar_file.name)
+        if listed is not None and listed["author"] and mod_info.get("author", "未知") == "未知":
+            mod_info = dict(mod_info, author=listed["author"])
+            perf_count("jar_authors_from_manifest")
         mod_id = mod_info["mod_id"]
         # 如果同一个 mod_id 已经存在，保留第一个（通常是最新的）
         if mod_id not in installed_mods:
             installed_mods[mod_id] = mod_info
+        # 同一 jar 声明的其他模组和内嵌的子模组也算已安装
+        for extra_id in mod_info.get("mod_ids", [])[1:]:
+            installed_mods.setdefault(extra_id, dict(mod_info, mod_id=extra_id))
+        for nested_info in mod_info.get("nested_mods", ()):
+            installed_mods.setdefault(nested_info["mod_id"], nested_info)
+            for extra_id in nested_info.get("mod_ids", [])[1:]:
+                installed_mods.setdefault(extra_id, dict(nested_info, mod_id=extra_id))
     
     return installed_mods
 
 
-def get_items_from_mod_jar(jar_path):
-    """从模组 jar 文件中提取所有物品 ID"""
-    items = set()
-    
-    try:
-        with zipfile.ZipFile(jar_path, 'r') as z:
-            # 扫描所有可能的物品定义位置
-            for name in z.namelist():
-                # NeoForge/Forge/Fabric 1.21+ 格式
-                if name.startswith('data/') and name.endswith('/item/'):
-                    # 提取物品 ID
-                    parts = name.split('/')
-                    if len(parts) >= 4:
-                        namespace = parts[1]
-                        item_name = Path(name).stem
-                        items.add(f"{namespace}:{item_name}")
-                
-                # 旧版 Forge 格式 (assets/namespace/models/item/)
-                elif 'models/item/' in name and name.endswith('.json'):
-                    parts = name.split('/')
-                    if len(parts) >= 4:
-                        namespace = parts[1]
-                        item_name = Path(name).stem
-                        items.add(f"{namespace}:{item_name}")
-                
-                # 数据包格式
-                elif name.startswith('assets/') and '/models/item/' in name and name.endswith('.json'):
-                    parts = name.split('/')
-                    if len(parts) >= 5:
-                        namespace = parts[1]
-                        item_name = Path(name).stem
-                        items.add(f"{namespace}:{item_name}")
-            
-            # 尝试读取注册表文件
-            if 'data/forge/registry.json' in z.namelist():
-                try:
-                    content = z.read('data/forge/registry.json').decode('utf-8')
-                    data = json.loads(content)
-                    if 'items' in data:
-                        for item_id in data['items']:
-                            items.add(item_id.lower())
-                except:
-                    pass
-    except:
-        pass
+def _read_jar_items(z):
+    """从已打开的 jar（ZipFile）的条目中提取物品 ID"""
+    names = z.namelist()
+    items = _item_ids_from_names(names)
     
-    return items
+    # 尝试读取注册表文件
+    if 'data/forge/registry.json' in names:
+        try:
+            content = z.read('data/forge/registry.json').decode('utf-8')
+            data = json.loads(content)
+            if 'items' in data:
+                for item_id in data['items']:
+                    items.add(item_id.lower())
+        except:
+            pass
+    return items
+
+
+def _item_ids_from_names(names):
+    """按条目路径（jar / 资源包内的相对路径，目录以 / 结尾）提取物品 ID"""
+    items = set()
+    # 扫描所有可能的物品定义位置
+    for name in names:
+        # NeoForge/Forge/Fabric 1.21+ 格式
+        if name.startswith('data/') and name.endswith('/item/'):
+            # 提取物品 ID
+            parts = name.split('/')
+            if len(parts) >= 4:
+                namespace = parts[1]
+                item_name = Path(name).stem
+                items.add(f"{namespace}:{item_name}")
+        
+        # 旧版 Forge 格式 (assets/namespace/models/item/)
+        elif 'models/item/' in name and name.endswith('.json'):
+            parts = name.split('/')
+            if len(parts) >= 4:
+                namespace = parts[1]
+                item_name = Path(name).stem
+                items.add(f"{namespace}:{item_name}")
+        
+        # 数据包格式
+        elif name.startswith('assets/') and '/models/item/' in name and name.endswith('.json'):
+            parts = name.split('/')
+            if len(parts) >= 5:
+                namespace = parts[1]
+                item_name = Path(name).stem
+                items.add(f"{namespace}:{item_name}")
+    return items
+
+
+# 内嵌 jar（jar-in-jar）：NeoForge 的 META-INF/jarjar/、Fabric 的 META-INF/jars/
+NESTED_JAR_DIRS = ("META-INF/jarjar/", "META-INF/jars/")
+NESTED_JAR_MAX_DEPTH = 3                    # 最多展开的内嵌层数
+NESTED_JAR_BYTE_BUDGET = 64 * 1024 * 1024   # 每个 jar 最多读入内存的内嵌 jar 字节数（解压后）
+_nested_jar_cache = {}  # {(CRC, 大小): {"mods": [...], "items": frozenset}}，多个模组共用的库只分析一次
+
+
+def _scan_nested_jars(z, depth=1, budget=None):
+    """递归扫描已打开的 jar 中的内嵌 jar，在内存中打开，不解压到磁盘
+
+    返回 {"mods": [带元数据的内嵌模组信息], "items": set(物品 ID), "complete": 是否没有因预算或深度跳过}；
+    完整扫描的内嵌 jar 按 CRC 和大小缓存。
+    """
+    result = {"mods": [], "items": set(), "complete": True}
+    budget = budget if budget is not None else [NESTED_JAR_BYTE_BUDGET]
+    for info in z.infolist():
+        if not info.filename.endswith(".jar") or not info.filename.startswith(NESTED_JAR_DIRS):
+            continue
+        key = (info.CRC, info.file_size)
+        cached = _nested_jar_cache.get(key)
+        if cached is not None:
+            perf_count("nested_jar_cache_hits")
+        elif depth > NESTED_JAR_MAX_DEPTH or info.file_size > budget[0]:
+            logger.debug("   内嵌 jar 超出%s，跳过: %s",
+                         "深度" if depth > NESTED_JAR_MAX_DEPTH else "读取预算", info.filename)
+            result["complete"] = False
+            continue
+        else:
+            budget[0] -= info.file_size
+            perf_count("nested_jars_scanned")
+            perf_count("bytes_read", info.file_size)
+            try:
+                with zipfile.ZipFile(BytesIO(z.read(info)), 'r') as nested:
+                    mod_info, has_metadata = _read_mod_info(nested, info.filename)
+                    inner = _scan_nested_jars(nested, depth + 1, budget)
+                    items = _read_jar_items(nested) | inner["items"]
+            except (zipfile.BadZipFile, zlib.error, OSError, ValueError, TypeError, AttributeError,
+                    NotImplementedError, EOFError):
+                # 单个损坏的内嵌 jar 只跳过它本身，不影响外层 jar 和其他内嵌 jar 的结果
+                continue
+            cached = {"mods": ([mod_info] if has_metadata else []) + inner["mods"], "items": frozenset(items)}
+            if inner["complete"]:
+                _nested_jar_cache[key] = cached
+            else:
+                result["complete"] = False
+        result["mods"].extend(cached["mods"])
+        result["items"].update(cached["items"])
+    return result
+
+
+@perf_timed("get_items_from_mod_jar")
+def get_items_from_mod_jar(jar_path):
+    """从模组 jar 文件中提取所有物品 ID（包括内嵌 jar 中的物品）"""
+    items = set()
+    
+    try:
+        with zipfile.ZipFile(jar_path, 'r') as z:
+            perf_count("jars_scanned")
+            perf_count("jar_entries", len(z.namelist()))
+            perf_count("bytes_read", os.path.getsize(jar_path))
+            items = _read_jar_items(z)
+            items |= _scan_nested_jars(z)["items"]
+    except:
+        pass
+    
+    return items
 
 
 def scan_all_items_from_mods(mods_dir, target_mods):
@@ -1023,7 +2088,7 @@ def scan_all_items_from_mods(mods_dir, target_mods):
         mod_id = mod_info["mod_id"]
         
         # 只扫描目标模组中存在的模组
-        if mod_id in target_mods:
+        if mod_id in target_mods or any(extra_id in target_mods for extra_id in mod_info.get("mod_ids", ())):
             items = get_items_from_mod_jar(jar_file)
             if items:
                 mod_items_map[mod_id] = items
@@ -1032,6 +2097,145 @@ def scan_all_items_from_mods(mods_dir, target_mods):
     return all_items, mod_items_map
 
 
+# 整合包目录中除 mods 外还可能提供物品的位置：KubeJS 脚本与资源、数据包、全局数据包、资源包
+INSTANCE_PACK_DIRS = ("datapacks", "global_packs", "resourcepacks")
+_KUBEJS_ITEM_REGISTRY = re.compile(
+    r"""StartupEvents\.registry\(\s*['"](?:minecraft:)?(?:item|block)['"]|onEvent\(\s*['"](?:item|block)\.registry['"]""")
+_KUBEJS_CREATE = re.compile(r"""\.create\(\s*['"]([a-z0-9_.:/-]+)['"]""")
+_instance_dir_cache = {}   # {目录: (修改时间, [子目录], [文件])}
+_instance_file_cache = {}  # {文件: (大小, 修改时间, 物品集合)}
+
+
+def get_pack_root(mods_dir):
+    """mods 目录所在的整合包根目录（传入的不是 mods 目录时即其本身）"""
+    mods_dir = os.path.abspath(mods_dir)
+    return os.path.dirname(mods_dir) if os.path.basename(mods_dir) == "mods" else mods_dir
+
+
+def _list_dir_cached(path):
+    """列出目录的 (子目录, 文件)；目录修改时间未变时直接使用上次的结果"""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return [], []
+    cached = _instance_dir_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        perf_count("instance_dirs_cached")
+        return cached[1], cached[2]
+    dirs, files = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            (dirs if entry.is_dir() else files).append(entry.name)
+    _instance_dir_cache[path] = (mtime, dirs, files)
+    perf_count("instance_dirs_listed")
+    return dirs, files
+
+
+def _walk_names_cached(root):
+    """遍历目录树，生成相对 root 的路径（/ 分隔，目录以 / 结尾），与 jar 的条目名格式相同"""
+    stack = [""]
+    while stack:
+        rel = stack.pop()
+        dirs, files = _list_dir_cached(os.path.join(root, rel) if rel else root)
+        for name in files:
+            yield rel + name
+        for name in dirs:
+            yield rel + name + "/"
+            stack.append(rel + name + "/")
+
+
+def _cached_file_items(path, reader):
+    """按 (大小, 修改时间) 缓存单个文件的解析结果，文件未变时不再读取"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return set()
+    cached = _instance_file_cache.get(path)
+    if cached is not None and cached[:2] == (st.st_size, st.st_mtime_ns):
+        perf_count("instance_files_cached")
+        return cached[2]
+    try:
+        items = frozenset(reader(path))
+    except (OSError, zipfile.BadZipFile, UnicodeDecodeError):
+        items = frozenset()
+    _instance_file_cache[path] = (st.st_size, st.st_mtime_ns, items)
+    perf_count("instance_files_read")
+    return items
+
+
+def _read_zip_pack_items(path):
+    with zipfile.ZipFile(path, 'r') as z:
+        return _read_jar_items(z)
+
+
+def _read_kubejs_script_items(path):
+    """KubeJS 启动脚本中 item / block 注册事件里 .create('id') 的物品（方块也有同名物品），默认命名空间 kubejs"""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        script = f.read()
+    if not _KUBEJS_ITEM_REGISTRY.search(script):
+        return set()
+    return {item_id if ':' in item_id else f"kubejs:{item_id}" for item_id in _KUBEJS_CREATE.findall(script)}
+
+
+def _scan_kubejs(kubejs_dir):
+    names = list(_walk_names_cached(kubejs_dir))
+    # kubejs/assets、kubejs/data 与资源包 / 数据包的布局相同
+    items = _item_ids_from_names(names)
+    for name in names:
+        if name.startswith("startup_scripts/") and name.endswith(".js"):
+            items |= _cached_file_items(os.path.join(kubejs_dir, name), _read_kubejs_script_items)
+    return items
+
+
+def _iter_instance_packs(root, depth=2):
+    """生成 root 下的数据包 / 资源包（zip 文件或带 pack.mcmeta 的目录），最多向下找 depth 层"""
+    dirs, files = _list_dir_cached(root)
+    for name in files:
+        if name.endswith(".zip"):
+            yield os.path.join(root, name)
+    for name in dirs:
+        path = os.path.join(root, name)
+        if "pack.mcmeta" in _list_dir_cached(path)[1]:
+            yield path
+        elif depth > 1:
+            yield from _iter_instance_packs(path, depth - 1)
+
+
+def _scan_instance_pack(path):
+    if os.path.isdir(path):
+        return _item_ids_from_names(_walk_names_cached(path))
+    return _cached_file_items(path, _read_zip_pack_items)
+
+
+@perf_timed("discover_instance_items")
+def discover_instance_items(pack_root, max_workers=None):
+    """并发扫描整合包目录中 kubejs/、datapacks/、global_packs/、resourcepacks/ 提供的物品，返回物品集合
+
+    目录列表按目录修改时间缓存，脚本和 zip 包按 (大小, 修改时间) 缓存，未变化的部分不会再次遍历或读取。
+    """
+    tasks = []
+    kubejs_dir = os.path.join(pack_root, "kubejs")
+    if os.path.isdir(kubejs_dir):
+        tasks.append((_scan_kubejs, kubejs_dir))
+    for dirname in INSTANCE_PACK_DIRS:
+        root = os.path.join(pack_root, dirname)
+        if os.path.isdir(root):
+            tasks.extend((_scan_instance_pack, path) for path in _iter_instance_packs(root))
+    items = set()
+    if not tasks:
+        return items
+    recorder = current_perf()
+
+    def run(task):
+        with activate_perf(recorder):
+            return task[0](task[1])
+
+    with ThreadPoolExecutor(max_workers=max_workers or min(8, len(tasks))) as executor:
+        for found in executor.map(run, tasks):
+            items |= found
+    return items
+
+
 def check_items_existence(mod_items, available_items):
     """检查物品是否存在于目标模组中"""
     existing_items = {}
@@ -1054,182 +2258,277 @@ def check_items_existence(mod_items, available_items):
 
 def parse_snbt_by_mod(filepath):
     """解析 SNBT，按模组分类所有物品（兼容旧版）"""
-    with open(filepath, 'r', encoding='utf-8') as f:
-        content = f.read()
-
-    entries = re.split(r'\{\s*entryUUID:', content)
     mod_items = {}
+    with map_input_file(filepath) as content:
+        for entry in _iter_snbt_entry_texts(content):
+            _collect_snbt_mod_entry(entry, mod_items)
+    return mod_items
+
+
+_SNBT_ENTRY_START = re.compile(rb'\{\s*entryUUID:')
+
+
+def _iter_snbt_entry_texts(content):
+    """在映射的 snbt 字节上按 `{ entryUUID:` 切分条目，逐段解码为文本（同 re.split 去掉第一段）"""
+    start = None
+    for match in _SNBT_ENTRY_START.finditer(content):
+        if start is not None:
+            yield _decode_snbt_slice(content[start:match.start()])
+        start = match.end()
+    if start is not None:
+        yield _decode_snbt_slice(content[start:])
+
+
+def _decode_snbt_slice(raw):
+    """把 snbt 字节切片解码为文本，换行按文本模式读取时的规则统一为 \\n"""
+    text = raw.decode('utf-8')
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+def _collect_snbt_mod_entry(entry, mod_items):
+    """解析一个条目文本，按模组归入 mod_items"""
+    item_match = re.search(r'id:\s*"([a-z_]+):([a-z_]+)"', entry)
+    if not item_match:
+        return
     
-    for entry in entries[1:]:
-        item_match = re.search(r'id:\s*"([a-z_]+):([a-z_]+)"', entry)
-        if not item_match:
-            continue
-        
-        mod_id = item_match.group(1)
-        item_id = item_match.group(2)
-        full_id = f"{mod_id}:{item_id}"
-        
-        if full_id == "minecraft:barrier":
-            continue
-        
-        count_match = re.search(r'Count:\s*(\d+)b', entry)
-        count = int(count_match.group(1)) if count_match else 1
-        
-        price_match = re.search(r'entryPrice:\s*(\d+)L', entry)
-        price = int(price_match.group(1)) if price_match else 1
-        
-        is_sell_match = re.search(r'isSell:\s*(\d+)b', entry)
-        is_sell = int(is_sell_match.group(1)) if is_sell_match else 0
-        
-        item_data = {
-            "id": full_id,
-            "count": count,
-            "price": price,
-            "is_sell": is_sell
-        }
-        
-        if mod_id not in mod_items:
-            mod_items[mod_id] = []
-        mod_items[mod_id].append(item_data)
+    mod_id = item_match.group(1)
+    item_id = item_match.group(2)
+    full_id = f"{mod_id}:{item_id}"
     
-    return mod_items
+    if full_id == "minecraft:barrier":
+        return
+    
+    count_match = re.search(r'Count:\s*(\d+)b', entry)
+    count = int(count_match.group(1)) if count_match else 1
+    
+    price_match = re.search(r'entryPrice:\s*(\d+)L', entry)
+    price = int(price_match.group(1)) if price_match else 1
+    
+    is_sell_match = re.search(r'isSell:\s*(\d+)b', entry)
+    is_sell = int(is_sell_match.group(1)) if is_sell_match else 0
+    
+    item_data = {
+        "id": full_id,
+        "count": count,
+        "price": price,
+        "is_sell": is_sell
+    }
+    
+    if mod_id not in mod_items:
+        mod_items[mod_id] = []
+    mod_items[mod_id].append(item_data)
 
 
-def parse_snbt_by_category(filepath):
-    """解析 SNBT，按原有分类提取数据"""
-    with open(filepath, 'r', encoding='utf-8') as f:
-        content = f.read()
+_SNBT_BRACES = re.compile(r'[{}]')
+_SNBT_BRACE_BYTES = re.compile(rb'[{}]')
+
+
+def _parse_snbt_category_block(block_content):
+    """解析一个分类块，返回 {'title', 'icon', 'items'}；找不到 title 时返回 None"""
+    # 提取 title（SNBT 字符串中的 \" 与 \\ 是转义，SNBTShopWriter 写出的标题会带上它们）
+    title_match = re.search(r'title:\s*"((?:[^"\\]|\\.)+)"', block_content)
+    if not title_match:
+        return None
     
-    categories = []
+    title = re.sub(r'\\(.)', r'\1', title_match.group(1))
     
-    # 找到所有 tabEntry 块（每个分类）
-    pos = 0
-    while True:
-        # 找到下一个 tabEntry
-        tab_entry_pos = content.find('tabEntry:', pos)
-        if tab_entry_pos == -1:
-            break
-        
-        # 找到这个分类块的开始（从上一个 { 开始）
-        block_start = content.rfind('{', 0, tab_entry_pos)
-        if block_start == -1:
-            pos = tab_entry_pos + 1
-            continue
-        
-        # 找到这个分类块的结束（匹配的 }）
-        brace_count = 1
-        block_end = block_start + 1
-        while brace_count > 0 and block_end < len(content):
-            if content[block_end] == '{':
-                brace_count += 1
-            elif content[block_end] == '}':
-                brace_count -= 1
-            block_end += 1
-        
-        block_content = content[block_start:block_end]
-        
-        # 提取 title
-        title_match = re.search(r'title:\s*"([^"]+)"', block_content)
-        if not title_match:
-            pos = tab_entry_pos + 1
-            continue
-        
-        title = title_match.group(1)
-        
-        # 提取 icon（支持多行格式，id 值可能有引号也可能没有）
-        # 匹配分类级别的 icon（在 tabEntry 之后，与 title 同级）
-        # 使用正则表达式确保找到的是分类级别的 icon，而不是条目级别的 icon
-        # 查找 tabEntry 块之后的 icon
-        icon_match = re.search(r'tabEntry:\s*\[[\s\S]*?\]\s*icon:\s*\{[\s\S]*?id:\s*([^\s]+)[\s\S]*?\}', block_content)
-        if icon_match:
-            icon = icon_match.group(1)
-            # 移除可能的引号
-            if icon.startswith('"') or icon.startswith("'"):
-                icon = icon[1:-1]
-        else:
-            # 如果找不到，使用默认图标
-            icon = "minecraft:grass_block"
-        
-        # 提取 tabEntry 中的物品
-        items = []
+    # 提取 icon（支持多行格式，id 值可能有引号也可能没有）
+    # 匹配分类级别的 icon（在 tabEntry 之后，与 title 同级）
+    # 使用正则表达式确保找到的是分类级别的 icon，而不是条目级别的 icon
+    # 查找 tabEntry 块之后的 icon
+    # 单行格式 icon: { id: "x", Count: 1b } 中 id 后紧跟逗号，引号内外分别匹配，不把 ", 带进 ID
+    icon_match = re.search(r'tabEntry:\s*\[[\s\S]*?\]\s*icon:\s*\{[\s\S]*?id:\s*'
+                           r'(?:"([^"]+)"|\'([^\']+)\'|([^\s,}]+))[\s\S]*?\}', block_content)
+    if icon_match:
+        icon = next(group for group in icon_match.groups() if group is not None)
+    else:
+        # 如果找不到，使用默认图标
+        icon = "minecraft:grass_block"
+    
+    # 提取 tabEntry 中的物品
+    items = []
+    
+    # 找到 tabEntry: [ ... ]
+    tab_entry_match = re.search(r'tabEntry:\s*\[([\s\S]*?)\]\s*(?:icon|title|description|tabCondition|shopTabUUID)', block_content)
+    if tab_entry_match:
+        tab_entry_content = tab_entry_match.group(1)
         
-        # 找到 tabEntry: [ ... ]
-        tab_entry_match = re.search(r'tabEntry:\s*\[([\s\S]*?)\]\s*(?:icon|title|description|tabCondition|shopTabUUID)', block_content)
-        if tab_entry_match:
-            tab_entry_content = tab_entry_match.group(1)
+        # 找到每个条目 { ... }
+        entry_pos = 0
+        while entry_pos < len(tab_entry_content):
+            entry_start = tab_entry_content.find('{', entry_pos)
+            if entry_start == -1:
+                break
             
-            # 找到每个条目 { ... }
-            entry_pos = 0
-            while entry_pos < len(tab_entry_content):
-                entry_start = tab_entry_content.find('{', entry_pos)
-                if entry_start == -1:
-                    break
-                
-                # 找到匹配的 }
-                brace_count = 1
-                entry_end = entry_start + 1
-                while brace_count > 0 and entry_end < len(tab_entry_content):
-                    if tab_entry_content[entry_end] == '{':
-                        brace_count += 1
-                    elif tab_entry_content[entry_end] == '}':
-                        brace_count -= 1
-                    entry_end += 1
-                
-                entry_content = tab_entry_content[entry_start:entry_end]
-                
-                # 提取物品信息
-                id_match = re.search(r'entryType:\s*\{[^}]*itemStack:\s*\{[^}]*id:\s*"([^"]+)"', entry_content)
+            # 找到匹配的 }
+            entry_end = _match_brace(tab_entry_content, entry_start + 1)[0]
+            
+            entry_content = tab_entry_content[entry_start:entry_end]
+            
+            # 提取物品信息
+            id_match = re.search(r'entryType:\s*\{[^}]*itemStack:\s*\{[^}]*id:\s*"([^"]+)"', entry_content)
+            if id_match:
+                full_id = id_match.group(1)
+            else:
+                id_match = re.search(r'id:\s*"([^"]+)"', entry_content)
                 if id_match:
                     full_id = id_match.group(1)
                 else:
-                    id_match = re.search(r'id:\s*"([^"]+)"', entry_content)
-                    if id_match:
-                        full_id = id_match.group(1)
-                    else:
-                        entry_pos = entry_end
-                        continue
-                
-                if full_id == "minecraft:barrier":
                     entry_pos = entry_end
                     continue
-                
-                # 提取 Count
-                count_match = re.search(r'Count:\s*(\d+)b', entry_content)
-                count = int(count_match.group(1)) if count_match else 1
-                
-                # 提取 entryPrice
-                price_match = re.search(r'entryPrice:\s*(\d+)L?', entry_content)
-                price = int(price_match.group(1)) if price_match else 1
-                
-                # 提取 isSell
-                is_sell_match = re.search(r'isSell:\s*(\d+)b', entry_content)
-                is_sell = int(is_sell_match.group(1)) if is_sell_match else 0
-                
-                item_data = {
-                    "id": full_id,
-                    "count": count,
-                    "price": price,
-                    "is_sell": is_sell
-                }
-                items.append(item_data)
+            
+            if full_id == "minecraft:barrier":
                 entry_pos = entry_end
-        
-        if items:
-            categories.append({
-                'title': title,
-                'icon': icon,
-                'items': items
-            })
-        
-        pos = block_end
+                continue
+            
+            # 提取 Count
+            count_match = re.search(r'Count:\s*(\d+)b', entry_content)
+            count = int(count_match.group(1)) if count_match else 1
+            
+            # 提取 entryPrice
+            price_match = re.search(r'entryPrice:\s*(\d+)L?', entry_content)
+            price = int(price_match.group(1)) if price_match else 1
+            
+            # 提取 isSell
+            is_sell_match = re.search(r'isSell:\s*(\d+)b', entry_content)
+            is_sell = int(is_sell_match.group(1)) if is_sell_match else 0
+            
+            item_data = {
+                "id": full_id,
+                "count": count,
+                "price": price,
+                "is_sell": is_sell
+            }
+            items.append(item_data)
+            entry_pos = entry_end
     
-    return categories
+    return {
+        'title': title,
+        'icon': icon,
+        'items': items
+    }
 
 
-def save_mod_comparison(source_mods, target_mods, source_dir, target_dir):
-    """保存模组对比结果到文件，并检测同名不同作者的情况"""
-    filename = os.path.join("3.报告", "模组对比.txt")
-    
+def _match_brace(text, start, depth=1):
+    """从 start 开始找与之前的 { 匹配的 }，返回 (结束位置, 剩余深度)
+
+    text 可以是文本或字节缓冲区（如 mmap）；剩余深度为 0 时结束位置是匹配的 } 之后，
+    没有匹配时返回 (len(text), 剩余深度)。
+    """
+    pattern = _SNBT_BRACES if isinstance(text, str) else _SNBT_BRACE_BYTES
+    for match in pattern.finditer(text, start):
+        depth += 1 if match.group() in ('{', b'{') else -1
+        if depth == 0:
+            return match.end(), 0
+    return len(text), depth
+
+
+def iter_snbt_categories(filepath, digests=False):
+    """逐个生成 snbt 中的分类 {'title', 'icon', 'items'}（跳过没有物品的分类）
+
+    在文件的只读映射上按字节查找分类块边界，只把当前分类块解码为文本；
+    大文件不会整体读入内存。digests=True 时生成 (分类, 分类块原始字节的 sha1)，供增量写出判断分类是否变化。
+    """
+    with map_input_file(filepath) as content:
+        pos = 0
+        while True:
+            # 找到下一个 tabEntry
+            tab_entry_pos = content.find(b'tabEntry:', pos)
+            if tab_entry_pos == -1:
+                return
+            
+            # 找到这个分类块的开始（从上一个 { 开始）
+            block_start = content.rfind(b'{', 0, tab_entry_pos)
+            if block_start == -1:
+                pos = tab_entry_pos + 1
+                continue
+            
+            # 找到这个分类块的结束（匹配的 }）
+            block_end = _match_brace(content, block_start + 1)[0]
+            
+            category = _parse_snbt_category_block(_decode_snbt_slice(content[block_start:block_end]))
+            if category is None:
+                pos = tab_entry_pos + 1
+                continue
+            
+            if category['items']:
+                perf_count("snbt_categories")
+                perf_count("snbt_entries", len(category['items']))
+                if digests:
+                    yield category, hashlib.sha1(content[block_start:block_end]).hexdigest()
+                else:
+                    yield category
+            
+            pos = block_end
+
+
+@perf_timed("parse_snbt_by_category")
+def parse_snbt_by_category(filepath):
+    """解析 SNBT，按原有分类提取数据"""
+    return list(iter_snbt_categories(filepath))
+
+
+# 多个 snbt 文件中同名分类的处理方式
+SNBT_MERGE_MODES = ("merge", "first", "last", "rename")
+
+
+def resolve_snbt_files(patterns):
+    """把 snbt 文件路径 / 通配符列表展开为文件列表（按给出的顺序，通配符的匹配按文件名排序，重复的只保留一次）"""
+    files = {}
+    for pattern in patterns:
+        for path in (sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]):
+            files.setdefault(os.path.normpath(path), None)
+    return list(files)
+
+
+@perf_timed("merge_snbt_categories")
+def merge_snbt_categories(category_lists, merge_mode="merge"):
+    """按标题合并多个 snbt 的分类，一遍完成
+
+    同名分类的处理方式：
+    - merge：商人追加到先出现的同名分类（图标取先出现的）
+    - first：只保留先出现的同名分类
+    - last：后出现的同名分类替换先出现的（位置不变）
+    - rename：都保留，后出现的标题加上 (2)、(3)...
+    每个分类内重复的商人按 (id, count, price, is_sell) 去重。
+    返回 (分类列表, {"conflicts": 同名分类数, "duplicates": 去掉的重复商人数})
+    """
+    if merge_mode not in SNBT_MERGE_MODES:
+        raise ValueError(f"未知的分类合并方式: {merge_mode}")
+    merged = {}  # {标题: 分类}，保持先出现的顺序
+    seen = {}    # {标题: {(id, count, price, is_sell)}}
+    stats = {"conflicts": 0, "duplicates": 0}
+    for categories in category_lists:
+        for cat in categories:
+            title = cat['title']
+            if title in merged:
+                stats["conflicts"] += 1
+                if merge_mode == "first":
+                    continue
+                if merge_mode == "rename":
+                    number = 2
+                    while f"{title} ({number})" in merged:
+                        number += 1
+                    title = f"{title} ({number})"
+            if title not in merged or merge_mode == "last":
+                merged[title] = {'title': title, 'icon': cat['icon'], 'items': []}
+                seen[title] = set()
+            items, keys = merged[title]['items'], seen[title]
+            for item in cat['items']:
+                key = (item['id'], item['count'], item['price'], item['is_sell'])
+                if key in keys:
+                    stats["duplicates"] += 1
+                    continue
+                keys.add(key)
+                items.append(item)
+    perf_count("snbt_merge_duplicates", stats["duplicates"])
+    return list(merged.values()), stats
+
+
+def compare_mods(source_mods, target_mods):
+    """对比两个整合包的模组，返回 (共通, 只在原包, 只在目标包, 同名不同作者列表)"""
     # 获取 mod_id 集合
     source_ids = set(source_mods.keys())
     target_ids = set(target_mods.keys())
@@ -1258,6 +2557,14 @@ def save_mod_comparison(source_mods, target_mods, source_dir, target_dir):
                 "target_name": target_mods[mod_id].get("name", mod_id)
             })
     
+    return both_have_ids, only_source_ids, only_target_ids, author_mismatches
+
+
+def save_mod_comparison(source_mods, target_mods, source_dir, target_dir, report_dir="3.报告"):
+    """保存模组对比结果到文件，并检测同名不同作者的情况"""
+    filename = os.path.join(report_dir, "模组对比.txt")
+    both_have_ids, only_source_ids, only_target_ids, author_mismatches = compare_mods(source_mods, target_mods)
+    
     with open(filename, 'w', encoding='utf-8') as f:
         f.write("模组对比\n")
         f.write("-"*50 + "\n")
@@ -1287,6 +2594,16 @@ def save_mod_comparison(source_mods, target_mods, source_dir, target_dir):
                 f.write(f"   目标作者: {mismatch['target_author']}\n")
                 f.write(f"   版本: {mismatch['source_version']} → {mismatch['target_version']}\n\n")
             f.write("\n")
+
+        # jar 中没有元数据时 mod_id 是按文件名推断的，不一定是真实的 mod_id
+        inferred = sorted({(mod_id, info.get("jar_name", "")) for mods in (source_mods, target_mods)
+                           for mod_id, info in mods.items() if info.get("mod_id_inferred")})
+        if inferred:
+            f.write("【按文件名推断的 mod_id】\n")
+            f.write("-"*50 + "\n")
+            for mod_id, jar_name in inferred:
+                f.write(f"{mod_id}（推断自 {jar_name}）\n")
+            f.write("\n")
         
         # 总结
         f.write("【总结】\n")
@@ -1299,9 +2616,128 @@ def save_mod_comparison(source_mods, target_mods, source_dir, target_dir):
     return filename, both_have_ids, only_source_ids, only_target_ids, author_mismatches
 
 
-def save_missing_items(missing_items_by_category, total_missing):
-    """保存缺失的物品信息到单独的文件"""
-    filename = os.path.join("3.报告", "缺失物品.txt")
+# 商店缺失物品的原因
+CAUSE_MOD_ABSENT = "模组缺失"
+CAUSE_ITEM_REMOVED = "物品已移除"
+CAUSE_NAMESPACE_CHANGED = "命名空间变更"
+CAUSE_NOT_IN_SOURCE = "原整合包中也不存在"
+MISSING_CAUSES = (CAUSE_MOD_ABSENT, CAUSE_ITEM_REMOVED, CAUSE_NAMESPACE_CHANGED, CAUSE_NOT_IN_SOURCE)
+
+
+def diff_pack_items(shop_item_ids, source_items, target_items, source_mods, target_mods, remaps=None):
+    """物品级对比两个整合包，并对商店中在目标整合包缺失的物品逐个归因
+
+    - 模组缺失：目标整合包没有该命名空间
+    - 物品已移除：目标整合包有该模组，但新版本中没有这个物品（原整合包中有）
+    - 命名空间变更：命名空间不在目标整合包中，但同名物品出现在目标整合包新增的命名空间下
+    - 原整合包中也不存在：原整合包中也找不到该物品（商店中的 ID 本身有误）
+    返回 {"source_count", "target_count", "common", "only_source", "only_target", "missing"}，
+    only_* 为 {命名空间: 物品数}，missing 为 {原因: [(物品 ID, 说明)]}。
+    """
+    remaps = ITEM_ID_REMAPS if remaps is None else remaps
+
+    def namespaces(items, mods):
+        return {item_id.split(':')[0] for item_id in items} | set(mods)
+
+    source_namespaces = namespaces(source_items, source_mods)
+    target_namespaces = namespaces(target_items, target_mods)
+    # 只为目标整合包新增的命名空间建立 物品名 → 命名空间 索引
+    new_namespace_paths = {}
+    for item_id in target_items:
+        namespace, _, path = item_id.partition(':')
+        if namespace not in source_namespaces:
+            new_namespace_paths.setdefault(path, []).append(namespace)
+
+    only_source, only_target = {}, {}
+    for item_id in source_items - target_items:
+        namespace = item_id.split(':')[0]
+        only_source[namespace] = only_source.get(namespace, 0) + 1
+    for item_id in target_items - source_items:
+        namespace = item_id.split(':')[0]
+        only_target[namespace] = only_target.get(namespace, 0) + 1
+
+    missing = {cause: [] for cause in MISSING_CAUSES}
+    for item_id in sorted(shop_item_ids):
+        namespace, _, path = item_id.partition(':')
+        new_id = remaps.get(item_id)
+        if (namespace == 'minecraft' or item_id in target_items
+                or (new_id is not None and (new_id.split(':')[0] == 'minecraft' or new_id in target_items))):
+            continue
+        if namespace in target_namespaces:
+            if item_id in source_items:
+                source_version = (source_mods.get(namespace) or {}).get("version", "未知")
+                target_version = (target_mods.get(namespace) or {}).get("version", "未知")
+                missing[CAUSE_ITEM_REMOVED].append((item_id, f"版本 {source_version} → {target_version}"))
+            else:
+                missing[CAUSE_NOT_IN_SOURCE].append((item_id, ""))
+        elif path in new_namespace_paths:
+            candidates = ", ".join(f"{ns}:{path}" for ns in sorted(new_namespace_paths[path]))
+            missing[CAUSE_NAMESPACE_CHANGED].append((item_id, f"可能改为 {candidates}"))
+        elif namespace in source_namespaces:
+            missing[CAUSE_MOD_ABSENT].append((item_id, ""))
+        else:
+            missing[CAUSE_NOT_IN_SOURCE].append((item_id, ""))
+
+    return {
+        "source_count": len(source_items),
+        "target_count": len(target_items),
+        "common": len(source_items & target_items),
+        "only_source": only_source,
+        "only_target": only_target,
+        "missing": missing,
+    }
+
+
+def save_item_diff(diff, source_dir, target_dir, report_dir="3.报告"):
+    """保存物品级对比与商店缺失物品的归因"""
+    filename = os.path.join(report_dir, "物品差异.txt")
+    missing = diff["missing"]
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write("物品差异\n")
+        f.write("-"*50 + "\n")
+        f.write(f"生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        f.write(f"原目录: {source_dir}\n")
+        f.write(f"目标目录: {target_dir}\n")
+        f.write(f"原整合包物品: {diff['source_count']} 个, 目标整合包物品: {diff['target_count']} 个, "
+                f"共通: {diff['common']} 个\n")
+        f.write("-"*50 + "\n\n")
+
+        f.write("【商店缺失物品归因】\n")
+        for cause in MISSING_CAUSES:
+            f.write(f"{cause}: {len(missing[cause])} 个\n")
+        f.write("\n")
+
+        for cause in MISSING_CAUSES:
+            if not missing[cause]:
+                continue
+            f.write(f"【{cause}】\n")
+            f.write("-"*50 + "\n")
+            by_namespace = {}
+            for item_id, detail in missing[cause]:
+                by_namespace.setdefault(item_id.split(':')[0], []).append((item_id, detail))
+            for namespace, entries in sorted(by_namespace.items(), key=lambda x: (-len(x[1]), x[0])):
+                f.write(f"{namespace} ({len(entries)} 个)\n")
+                for item_id, detail in entries:
+                    f.write(f"   {item_id}" + (f"  {detail}" if detail else "") + "\n")
+            f.write("\n")
+
+        f.write("【整合包物品差异（按命名空间）】\n")
+        f.write("-"*50 + "\n")
+        for title, counts in (("目标缺少", diff["only_source"]), ("目标新增", diff["only_target"])):
+            f.write(f"{title}: {sum(counts.values())} 个\n")
+            for namespace, count in sorted(counts.items(), key=lambda x: (-x[1], x[0])):
+                f.write(f"   {namespace}: {count} 个\n")
+        f.write("-"*50 + "\n")
+
+    return filename
+
+
+def save_missing_items(missing_items_by_category, total_missing, report_dir="3.报告", missing_by_namespace=None):
+    """保存缺失的物品信息到单独的文件
+
+    missing_by_namespace: {命名空间: 缺失数}，提供时在总结中按模组列出缺失数量
+    """
+    filename = os.path.join(report_dir, "缺失物品.txt")
     
     with open(filename, 'w', encoding='utf-8') as f:
         f.write("缺失物品\n")
@@ -1337,6 +2773,10 @@ def save_missing_items(missing_items_by_category, total_missing):
         f.write("-"*50 + "\n")
         f.write(f"缺失物品分类数: {len([c for c in missing_items_by_category.values() if c])}\n")
         f.write(f"总缺失物品数: {total_missing}\n")
+        if missing_by_namespace:
+            f.write("按模组统计:\n")
+            for namespace, count in missing_by_namespace.items():
+                f.write(f"  {namespace}: {count}个\n")
         f.write("\n")
         f.write("这些物品在目标模组中不存在，已被排除在提取结果之外。\n")
         f.write("-"*50 + "\n")
@@ -1391,65 +2831,2130 @@ def create_category(name, icon_id, merchants_list):
     }
 
 
-def get_process_dir():
-    """获取过程文件夹的路径"""
-    # 创建1.过程文件夹
-    process_dir = "1.过程"
-    os.makedirs(process_dir, exist_ok=True)
-    
-    return process_dir
+def _nbt_tag_header(tag_type, name):
+    """命名标签的头部：类型 + 名称"""
+    encoded = name.encode('utf-8')
+    return struct.pack('>bH', tag_type, len(encoded)) + encoded
 
 
-def ensure_directories():
-    """确保必要的文件夹结构存在"""
-    # 创建1.过程文件夹
-    os.makedirs("1.过程", exist_ok=True)
-    # 创建2.输出文件夹
-    os.makedirs("2.输出", exist_ok=True)
-    # 创建3.报告文件夹
-    os.makedirs("3.报告", exist_ok=True)
+def _nbt_string_tag(name, value):
+    encoded = value.encode('utf-8')
+    return _nbt_tag_header(8, name) + struct.pack('>H', len(encoded)) + encoded
 
 
-# ==================== GUI 界面 ====================
+class ShopprojTemplateEncoder:
+    """商人 / 分类的预编译 NBT 模板
 
-class ViScriptShopToolkitGUI:
-    """ViScript Shop 工具箱 GUI 界面"""
-    
-    def __init__(self, root):
-        self.root = root
-        self.root.title("SDM 商店转 ViScriptShop 工具")
-        self.root.geometry("800x600")
-        self.root.resizable(True, True)
-        
-        # 确保文件夹结构存在
-        ensure_directories()
-        
-        # 全局缓存变量
-        self.DIR_CACHE = {}
-        self.MODS_CACHE = {}  # {dir_path: (mods_dict, timestamp)}
-        self.ITEMS_CACHE = {}  # {dir_path: (available_items, mod_items_map, timestamp)}
-        
-        # 创建主框架
-        self.main_frame = ttk.Frame(self.root, padding="10")
-        self.main_frame.pack(fill=tk.BOTH, expand=True)
-        
-        # 创建 SDM 转 ViScriptShop 界面
-        self.create_sdm_interface()
-        
-    def create_sdm_interface(self):
-        """创建 SDM 商店转 ViScriptShop 界面"""
-        # 创建原模组目录选择
-        source_frame = ttk.LabelFrame(self.main_frame, text="原整合包目录", padding="10")
-        source_frame.pack(fill=tk.X, pady=5)
-        
-        self.source_dir_var = tk.StringVar()
-        source_entry = ttk.Entry(source_frame, textvariable=self.source_dir_var, width=60)
-        source_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
-        
-        source_button = ttk.Button(source_frame, text="浏览", command=self.browse_source_dir)
-        source_button.pack(side=tk.RIGHT, padx=5)
-        
-        # 创建目标模组目录选择
+    create_shopproj_item / create_category 生成的结构里只有少数字段会变化：商人的 id、count、money、tradeType，
+    分类的图标 id、名称、商人列表和 uid。其余部分（标签头、键名、空的 itemA/itemB、xp/stage 等）
+    在这里预先编码成字节片段，编码时按总长度一次分配缓冲区，复制片段并用 struct.pack_into 填入变化的字段。
+    结果与 NBTWriter 逐字段编码完全相同；结构不是由上面两个函数生成的分类返回 None，由调用方改用 NBTWriter。
+    """
+
+    MERCHANT_KEYS = tuple(create_shopproj_item({"id": "", "count": 0, "price": 0, "is_sell": 0}))
+    CATEGORY_KEYS = tuple(create_category("", "", []))
+
+    def __init__(self):
+        # 商人：头部（到 itemResult.id 的长度之前，按 tradeType 两种）+ id + 中段（到 money 的值之前）+ money + 结束
+        command = _nbt_string_tag("command", "")
+        item_id = _nbt_tag_header(10, "itemResult") + _nbt_tag_header(8, "id")
+        self.merchant_heads = {
+            trade_type: (_nbt_tag_header(3, "xp") + struct.pack('>i', 0) + _nbt_string_tag("tradeType", trade_type)
+                         + command + item_id)
+            for trade_type in (SELL_TRADE_TYPE, BUY_TRADE_TYPE)
+        }
+        self.count_header = _nbt_tag_header(3, "count")
+        self.merchant_middle = (b'\x00' + _nbt_tag_header(10, "itemB") + b'\x00' + _nbt_tag_header(10, "itemA") + b'\x00'
+                                + _nbt_tag_header(3, "stage") + struct.pack('>i', 0) + _nbt_tag_header(3, "money"))
+        # id 之后的固定长度：ushort 长度 + count 头 + int + 中段 + int + 结束
+        self.merchant_tail_size = 2 + len(self.count_header) + 4 + len(self.merchant_middle) + 4 + 1
+
+        # 分类：头部 + 图标 id + 中段（到名称之前）+ 名称 + 商人列表头 + 商人 + uid + 结束
+        self.category_head = _nbt_tag_header(10, "iconItem") + _nbt_tag_header(8, "id")
+        self.category_middle = (_nbt_tag_header(3, "count") + struct.pack('>i', 1) + b'\x00'
+                                + _nbt_string_tag("iconType", "viscript_shop.data.category.iconType.item")
+                                + _nbt_tag_header(8, "name"))
+        self.merchants_header = _nbt_tag_header(10, "merchants") + _nbt_tag_header(9, "payload") + b'\x0a'
+        self.uid_header = _nbt_tag_header(3, "uid")
+        self.category_tail = (b'\x00' + _nbt_string_tag("shopType", "viscript_shop.data.category.shopType.currency")
+                              + _nbt_string_tag("iconTexture", "") + b'\x00')
+
+    def merchant_size(self, merchant):
+        """商人编码后的字节数；结构不符时返回 None"""
+        if tuple(merchant) != self.MERCHANT_KEYS:
+            return None
+        head = self.merchant_heads.get(merchant["tradeType"]["_value"])
+        if head is None:
+            return None
+        return len(head) + len(merchant["itemResult"]["id"]["_value"].encode('utf-8')) + self.merchant_tail_size
+
+    def category_fields(self, category):
+        """取出分类中会变化的字段 (图标 id, 名称, uid, [(tradeType, id, count, money)])；结构不符时返回 None"""
+        if tuple(category) != self.CATEGORY_KEYS:
+            return None
+        merchants = category["merchants"]["payload"]["_value"]
+        uid = category["merchants"]["uid"]["_value"]
+        if not isinstance(merchants, list) or isinstance(uid, DeferredInt):
+            return None
+
+        rows = []
+        heads = self.merchant_heads
+        keys = self.MERCHANT_KEYS
+        for merchant in merchants:
+            trade_type = merchant["tradeType"]["_value"]
+            if tuple(merchant) != keys or trade_type not in heads:
+                return None
+            result = merchant["itemResult"]
+            rows.append((trade_type, result["id"]["_value"], int(result["count"]["_value"]),
+                         int(merchant["money"]["_value"])))
+        return category["iconItem"]["id"]["_value"], category["name"]["_value"], int(uid), rows
+
+    def encode_fields(self, fields):
+        """按 category_fields 取出的字段编码分类的 compound 载荷（不含标签头）"""
+        icon, name, uid, rows = fields
+        heads = self.merchant_heads
+        rows = [(heads[trade_type], item_id.encode('utf-8'), count, money) for trade_type, item_id, count, money in rows]
+        icon = icon.encode('utf-8')
+        name = name.encode('utf-8')
+        size = (sum(len(head) + len(encoded_id) for head, encoded_id, _, _ in rows) + len(rows) * self.merchant_tail_size
+                + len(self.category_head) + 2 + len(icon) + len(self.category_middle) + 2 + len(name)
+                + len(self.merchants_header) + 4 + len(self.uid_header) + 4 + len(self.category_tail))
+
+        buf = bytearray(size)
+        pack_into = struct.pack_into
+
+        def put(fragment, pos):
+            end = pos + len(fragment)
+            buf[pos:end] = fragment
+            return end
+
+        def put_string(encoded, pos):
+            pack_into('>H', buf, pos, len(encoded))
+            return put(encoded, pos + 2)
+
+        pos = put(self.category_head, 0)
+        pos = put_string(icon, pos)
+        pos = put(self.category_middle, pos)
+        pos = put_string(name, pos)
+        pos = put(self.merchants_header, pos)
+        pack_into('>i', buf, pos, len(rows))
+        pos += 4
+        count_header, middle = self.count_header, self.merchant_middle
+        for head, encoded_id, count, money in rows:
+            pos = put(head, pos)
+            pos = put_string(encoded_id, pos)
+            pos = put(count_header, pos)
+            pack_into('>i', buf, pos, count)
+            pos = put(middle, pos + 4)
+            pack_into('>i', buf, pos, money)
+            pos += 5  # money + 商人 compound 结束（缓冲区已是 0）
+        pos = put(self.uid_header, pos)
+        pack_into('>i', buf, pos, uid)
+        put(self.category_tail, pos + 4)
+        return buf
+
+    def encode_category(self, category):
+        """把一个分类编码为 compound 载荷（不含标签头）；结构不符时返回 None"""
+        fields = self.category_fields(category)
+        if fields is None:
+            return None
+        perf_count("merchants_template_encoded", len(fields[3]))
+        return self.encode_fields(fields)
+
+
+_TEMPLATE_ENCODER = None
+
+
+def get_template_encoder():
+    global _TEMPLATE_ENCODER
+    if _TEMPLATE_ENCODER is None:
+        _TEMPLATE_ENCODER = ShopprojTemplateEncoder()
+    return _TEMPLATE_ENCODER
+
+
+def encode_category_payload(category):
+    """把分类编码为 NBT compound 载荷：优先使用预编译模板，结构不符时用 NBTWriter"""
+    encoded = get_template_encoder().encode_category(category)
+    if encoded is None:
+        writer = NBTWriter()
+        writer.write_payload(NBTWriter.TYPE_IDS["compound"], category)
+        encoded = writer.get_bytes()
+    return encoded
+
+
+# 估计的编码大小达到 PARALLEL_ENCODE_MIN_BYTES 时分类改为在多个进程中编码，每个进程至少分到 PARALLEL_ENCODE_BYTES_PER_WORKER
+PARALLEL_ENCODE_MIN_BYTES = 32 * 1024 * 1024
+PARALLEL_ENCODE_BYTES_PER_WORKER = 8 * 1024 * 1024
+TYPICAL_ITEM_ID_BYTES = 24
+
+
+def estimate_encoded_size(categories):
+    """不编码，按模板估计分类列表编码后的字节数"""
+    encoder = get_template_encoder()
+    per_merchant = len(encoder.merchant_heads[SELL_TRADE_TYPE]) + encoder.merchant_tail_size + TYPICAL_ITEM_ID_BYTES
+    per_category = (len(encoder.category_head) + len(encoder.category_middle) + len(encoder.merchants_header)
+                    + len(encoder.uid_header) + len(encoder.category_tail) + 12 + 2 * TYPICAL_ITEM_ID_BYTES)
+    merchants = sum(len(category["merchants"]["payload"]["_value"]) for category in categories
+                    if tuple(category) == encoder.CATEGORY_KEYS)
+    return merchants * per_merchant + len(categories) * per_category
+
+
+def plan_encode_workers(estimated_bytes):
+    """按估计的编码字节数决定编码进程数，返回 0 表示在当前进程中编码（进程启动和传输的开销大于收益）"""
+    cpus = os.cpu_count() or 1
+    if cpus < 2 or estimated_bytes < PARALLEL_ENCODE_MIN_BYTES:
+        return 0
+    return max(2, min(cpus, estimated_bytes // PARALLEL_ENCODE_BYTES_PER_WORKER))
+
+
+def _encode_category_fields(fields):
+    """子进程中编码一个分类（只收到 category_fields 取出的字段）"""
+    return bytes(get_template_encoder().encode_fields(fields))
+
+
+def encode_categories(categories, parallel=True):
+    """编码分类列表，按原顺序返回各分类的 compound 载荷
+
+    parallel 时按估计的编码大小决定是否改用进程池及进程数，见 plan_encode_workers；
+    子进程只收到模板需要的字段而不是嵌套的 dict，结果按原顺序拼回，与逐个编码完全相同。
+    """
+    workers = plan_encode_workers(estimate_encoded_size(categories)) if parallel else 0
+    if not workers:
+        return [encode_category_payload(category) for category in categories]
+
+    encoder = get_template_encoder()
+    fields = [encoder.category_fields(category) for category in categories]
+    jobs = [f for f in fields if f is not None]
+    # 转换可能运行在 GUI、监视或服务的工作线程中，fork 会复制其他线程持有的锁；子进程改用 spawn 启动
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        encoded = list(pool.map(_encode_category_fields, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    perf_count("nbt_encode_workers", workers)
+    perf_count("merchants_template_encoded", sum(len(f[3]) for f in jobs))
+    encoded = iter(encoded)
+    return [next(encoded) if f is not None else encode_category_payload(category)
+            for f, category in zip(fields, categories)]
+
+
+# 分类商人数量的处理方式：shard 超出上限时拆分为编号子分类 / truncate 只保留前 N 个 / none 不限制
+CATEGORY_MODES = ("shard", "truncate", "none")
+
+
+def merchant_encoded_size(merchant):
+    """商人条目编码为 NBT 后的字节数"""
+    size = get_template_encoder().merchant_size(merchant)
+    if size is not None:
+        return size
+    writer = NBTWriter()
+    writer.write_payload(NBTWriter.TYPE_IDS["compound"], merchant)
+    return writer.stream.tell()
+
+
+def _split_merchants(merchants, max_merchants, max_bytes):
+    """按商人数量 / 编码字节数上限把商人逐段切分，上限为 0 表示不限制"""
+    shard, shard_bytes = [], 0
+    for merchant in merchants:
+        size = merchant_encoded_size(merchant) if max_bytes else 0
+        if shard and ((max_merchants and len(shard) >= max_merchants)
+                      or (max_bytes and shard_bytes + size > max_bytes)):
+            yield shard
+            shard, shard_bytes = [], 0
+        shard.append(merchant)
+        shard_bytes += size
+    if shard:
+        yield shard
+
+
+def shard_category(name, icon_id, merchants, mode="shard", max_merchants=30, max_bytes=0):
+    """按 mode 处理一个分类的商人，逐个生成 (分类名, 图标, 商人列表)
+
+    merchants 可以是生成器，子分类在迭代时才切分出来；拆分后的子分类依次命名为「名称 (1)」「名称 (2)」…，
+    都沿用原分类的图标，不需要拆分时保持原名。
+    """
+    if mode == "none":
+        yield name, icon_id, list(merchants)
+        return
+    if mode == "truncate":
+        yield name, icon_id, list(itertools.islice(merchants, max_merchants or None))
+        return
+    if mode != "shard":
+        raise ValueError(f"未知的分类模式: {mode}")
+
+    shards = _split_merchants(merchants, max_merchants, max_bytes)
+    first = next(shards, None)
+    if first is None:
+        return
+    second = next(shards, None)
+    if second is None:
+        yield name, icon_id, first
+        return
+    yield f"{name} (1)", icon_id, first
+    yield f"{name} (2)", icon_id, second
+    for number, shard in enumerate(shards, 3):
+        yield f"{name} ({number})", icon_id, shard
+
+
+def build_shopproj(categories, uid=None):
+    """按 ViScriptShop 项目结构包装分类列表
+
+    流式写出时 categories 可以是迭代器，此时 uid 传入 DeferredInt（分类总数）。
+    """
+    return {
+        "_root_name": "",
+        "_root_type": "compound",
+        "data": {
+            "_type": "compound",
+            "meta": {
+                "_type": "compound",
+                "version_num": {"_type": "int", "_value": 1},
+                "suffix": {"_type": "string", "_value": ".shopproj"},
+                "version": {"_type": "string", "_value": "1.0"},
+                "name": {"_type": "string", "_value": "商店项目"}
+            },
+            "data": {
+                "_type": "compound",
+                "shop": {
+                    "_type": "compound",
+                    "lockedMerchantVisibility": {"_type": "string", "_value": "viscript_shop.data.shop.lockedItemVisibility.show_with_lock"},
+                    "isQuickOpening": {"_type": "byte", "_value": 0},
+                    "name": {"_type": "string", "_value": ""},
+                    "stage": {"_type": "int", "_value": 0},
+                    "categoryInfos": {
+                        "_type": "compound",
+                        "payload": {
+                            "_type": "list",
+                            "_element_type": "compound",
+                            "_value": categories
+                        },
+                        "uid": {"_type": "int", "_value": len(categories) if uid is None else uid}
+                    }
+                }
+            }
+        }
+    }
+
+
+def get_process_dir(base_dir="."):
+    """获取过程文件夹的路径"""
+    # 创建1.过程文件夹
+    process_dir = os.path.join(base_dir, "1.过程")
+    os.makedirs(process_dir, exist_ok=True)
+    
+    return process_dir
+
+
+def ensure_directories(base_dir="."):
+    """确保必要的文件夹结构存在"""
+    # 创建1.过程文件夹
+    os.makedirs(os.path.join(base_dir, "1.过程"), exist_ok=True)
+    # 创建2.输出文件夹
+    os.makedirs(os.path.join(base_dir, "2.输出"), exist_ok=True)
+    # 创建3.报告文件夹
+    os.makedirs(os.path.join(base_dir, "3.报告"), exist_ok=True)
+
+
+def find_mods_folder(base_dir):
+    """自动寻找整合包目录下的 mods 文件夹"""
+    mods_path = os.path.join(base_dir, "mods")
+    if os.path.exists(mods_path) and os.path.isdir(mods_path):
+        return mods_path
+    return base_dir
+
+
+# ==================== 日志 ====================
+
+class LogFileFormatter(logging.Formatter):
+    """日志文件格式：消息开头的空行保留在时间戳之前"""
+
+    def format(self, record):
+        message = record.getMessage()
+        stripped = message.lstrip("\n")
+        prefix = "\n" * (len(message) - len(stripped))
+        record = logging.makeLogRecord(dict(record.__dict__, msg=stripped, args=None))
+        return prefix + super().format(record)
+
+
+def setup_file_logging(report_dir="3.报告", max_bytes=5 * 1024 * 1024, backup_count=3):
+    """把完整日志写入报告目录下的滚动日志文件，返回文件处理器"""
+    os.makedirs(report_dir, exist_ok=True)
+    log_file = os.path.abspath(os.path.join(report_dir, "转换日志.log"))
+
+    # 同一个文件只挂一个处理器
+    for handler in logger.handlers:
+        if isinstance(handler, RotatingFileHandler) and handler.baseFilename == log_file:
+            return handler
+
+    handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    handler.setFormatter(LogFileFormatter("%(asctime)s [%(levelname)s] %(message)s"))
+    logger.addHandler(handler)
+    return handler
+
+
+def set_log_level(verbose):
+    """切换日志级别，verbose=False 时跳过逐分类/逐物品的详细输出"""
+    logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+
+
+# ==================== 检查点 ====================
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """计算文件内容的 sha256"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def fingerprint_mods_dir(mods_dir, manifest_file=None):
+    """整合包指纹：所有 jar 的 (文件名, 大小, 修改时间)，只读取目录信息不打开 jar
+
+    提供 manifest_file 时清单内容也计入指纹。
+    """
+    h = hashlib.sha256()
+    if manifest_file:
+        h.update(f"{os.path.basename(manifest_file)}\0{hash_file(manifest_file)}\n".encode('utf-8'))
+    if os.path.isdir(mods_dir):
+        for entry in sorted(os.scandir(mods_dir), key=lambda e: e.name):
+            if entry.name.endswith(".jar") and entry.is_file():
+                st = entry.stat()
+                h.update(f"{entry.name}\0{st.st_size}\0{st.st_mtime_ns}\n".encode('utf-8'))
+    return h.hexdigest()
+
+
+def write_if_changed(path, data):
+    """写入文件；内容与现有文件完全相同时不重写，返回是否写入"""
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, 'rb') as f:
+                if f.read() == data:
+                    return False
+    except OSError:
+        pass
+    with open(path, 'wb') as f:
+        f.write(data)
+    return True
+
+
+def replace_if_changed(temp_path, path):
+    """用 temp_path 替换 path；内容相同时删除 temp_path 并返回 False"""
+    if os.path.exists(path) and os.path.getsize(path) == os.path.getsize(temp_path):
+        if filecmp.cmp(temp_path, path, shallow=False):
+            os.remove(temp_path)
+            return False
+    os.replace(temp_path, path)
+    return True
+
+
+class StageCheckpointStore:
+    """按输入内容寻址的阶段检查点
+
+    每个阶段的输出保存为 <目录>/<阶段>-<键>.json，键由阶段名、工具版本、阶段逻辑版本和输入哈希计算，
+    输入不变时直接读取检查点跳过该阶段；每个阶段只保留最近 keep 个检查点。
+    """
+
+    # 阶段逻辑版本：改变阶段的输出（扫描规则、解析规则、结果结构）时递增，旧检查点随之失效
+    STAGE_VERSIONS = {
+        "mods": 5,   # 2: 嵌套 jar（META-INF/jarjar、META-INF/jars）中的模组；3: mods.toml 中声明的全部 mod_id；
+                     # 4: 元数据字段类型不对或内嵌 jar 损坏时不再丢掉外层 jar 的信息；
+                     # 5: 使用清单时 mod_id 也取自 jar 元数据，推断的 mod_id 带 mod_id_inferred 标记
+        "items": 4,  # 2: 嵌套 jar 中的物品；3: 按 jar 声明的任一 mod_id 匹配；4: 同 mods 4
+        "categories": 3,  # 2: 单行格式的分类图标不再带上引号；3: 标题中的转义字符（\" 与 \\）
+        "shop": 2,  # 2: 图标物品可用时即使其模组不在模组列表中也保留图标
+        "comparison": 1,
+        "item_diff": 1,
+    }
+    # 由其他阶段的结果派生的阶段，键中同时包含上游阶段的版本
+    STAGE_DEPENDENCIES = {
+        "shop": ("categories", "items"),
+        "comparison": ("mods",),
+        "item_diff": ("mods", "items", "categories"),
+    }
+
+    # 需要特殊序列化的阶段: {阶段: (编码, 解码)}
+    CODECS = {
+        "items": (
+            lambda value: {"items": sorted(value[0]), "mod_items": {m: sorted(i) for m, i in value[1].items()}},
+            lambda data: (set(data["items"]), {m: set(i) for m, i in data["mod_items"].items()}),
+        ),
+    }
+
+    def __init__(self, directory, keep=8):
+        self.directory = directory
+        self.keep = keep
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(stage, *inputs):
+        versions = StageCheckpointStore.STAGE_VERSIONS
+        logic = ",".join(f"{name}={versions.get(name, 1)}"
+                         for name in (stage, *StageCheckpointStore.STAGE_DEPENDENCIES.get(stage, ())))
+        h = hashlib.sha256(f"{stage}\0{TOOL_VERSION}\0{logic}".encode('utf-8'))
+        for value in inputs:
+            h.update(b"\0" + str(value).encode('utf-8'))
+        return h.hexdigest()[:32]
+
+    def path(self, stage, key):
+        return os.path.join(self.directory, f"{stage}-{key}.json")
+
+    def load(self, stage, key):
+        """读取检查点，不存在或已损坏时返回 None"""
+        try:
+            with open(self.path(stage, key), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        decode = self.CODECS.get(stage, (None, None))[1]
+        return decode(data) if decode else data
+
+    def save(self, stage, key, value):
+        encode = self.CODECS.get(stage, (None, None))[0]
+        path = self.path(stage, key)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(encode(value) if encode else value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._prune(stage)
+
+    def _prune(self, stage):
+        """删除同一阶段较旧的检查点"""
+        prefix = f"{stage}-"
+        entries = [e for e in os.scandir(self.directory) if e.name.startswith(prefix) and e.name.endswith(".json")]
+        entries.sort(key=lambda e: e.stat().st_mtime_ns, reverse=True)
+        for entry in entries[self.keep:]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+# ==================== 转换流程 ====================
+
+class StageScheduler:
+    """按依赖关系并发执行流水线阶段
+
+    每个阶段调用 func(*args, *依赖阶段的结果)，互不依赖的阶段同时运行；
+    run() 等待所有阶段完成并返回 {阶段名: 结果}，任一阶段出错时抛出其异常。
+    mode: "thread" 线程池 / "process" 进程池（阶段函数需可 pickle）/ "off" 顺序执行
+    调用线程启用了性能记录器时，各阶段的耗时以 label（默认为阶段名）记入同一记录器；
+    调用线程属于某个转换服务请求时，各阶段写到 logger 的日志也改写到该请求的日志。
+    """
+
+    def __init__(self, mode="thread", max_workers=None):
+        self.mode = mode
+        self.max_workers = max_workers
+        self.stages = {}   # {name: (func, args, deps)}
+        self.labels = {}   # {name: 性能报告中的名称}
+        self.timings = {}  # {name: 耗时秒数}
+        self.wall_time = 0.0
+
+    def add(self, name, func, *args, deps=(), label=None):
+        self.stages[name] = (func, args, tuple(deps))
+        self.labels[name] = label or name
+
+    def run(self):
+        recorder = current_perf()
+        request_log = current_request_log()
+        results = {}
+        pending = dict(self.stages)
+        run_start = time.perf_counter()
+
+        if self.mode == "off" or len(pending) <= 1:
+            while pending:
+                name = self._next_ready(pending, results)
+                func, args, deps = pending.pop(name)
+                started = time.perf_counter()
+                results[name] = _run_stage(recorder, self.labels[name], func, (*args, *(results[d] for d in deps)),
+                                           request_log)
+                self.timings[name] = time.perf_counter() - started
+            self.wall_time = time.perf_counter() - run_start
+            return results
+
+        executor_class = ProcessPoolExecutor if self.mode == "process" else ThreadPoolExecutor
+        running = {}
+        with executor_class(max_workers=self.max_workers or len(pending)) as executor:
+            while pending or running:
+                for name in [n for n, (_, _, deps) in pending.items() if all(d in results for d in deps)]:
+                    func, args, deps = pending.pop(name)
+                    stage_args = (*args, *(results[d] for d in deps))
+                    if self.mode == "process":
+                        # 子进程中的计数器无法汇总，只记录阶段墙钟时间
+                        future = executor.submit(func, *stage_args)
+                    else:
+                        future = executor.submit(_run_stage, recorder, self.labels[name], func, stage_args,
+                                                 request_log)
+                    running[future] = (name, time.perf_counter())
+                if not running:
+                    raise ValueError(f"阶段依赖无法满足: {', '.join(pending)}")
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, started = running.pop(future)
+                    results[name] = future.result()
+                    self.timings[name] = time.perf_counter() - started
+                    if self.mode == "process" and recorder is not None:
+                        recorder.add_time(self.labels[name], self.timings[name])
+
+        self.wall_time = time.perf_counter() - run_start
+        return results
+
+    @staticmethod
+    def _next_ready(pending, results):
+        for name, (_, _, deps) in pending.items():
+            if all(d in results for d in deps):
+                return name
+        raise ValueError(f"阶段依赖无法满足: {', '.join(pending)}")
+
+
+class ScanCache:
+    """模组/物品扫描结果的内存缓存，可在多次转换之间共享"""
+
+    def __init__(self):
+        self.mods = {}   # {dir_path: (mods_dict, timestamp)}
+        self.items = {}  # {dir_path: (available_items, mod_items_map, timestamp)}
+        self.categories = {}  # {snbt 路径: (内容哈希, 解析结果)}
+
+    def clear(self):
+        self.mods.clear()
+        self.items.clear()
+        self.categories.clear()
+        _nested_jar_cache.clear()
+        _jar_metadata_cache.clear()
+        _instance_dir_cache.clear()
+        _instance_file_cache.clear()
+
+
+def _run_stage(recorder, label, func, args, request_log=None):
+    """在工作线程中执行一个阶段，并把统计记到同一个性能记录器上、日志写到同一个请求日志中"""
+    with activate_perf(recorder), activate_request_log(request_log), perf_stage(label):
+        return func(*args)
+
+
+@dataclass
+class ConversionOptions:
+    """一次 SDM → ViScriptShop 转换的输入参数"""
+    source_dir: str
+    target_dir: str
+    snbt_file: str = "sdmshop.snbt"
+    snbt_files: list = field(default_factory=list)  # 多个 snbt 文件或通配符，非空时代替 snbt_file，合并后转换
+    merge_mode: str = "merge"        # 多个 snbt 中同名分类的处理方式: merge / first / last / rename
+    output_dir: str = "."
+    parallel_stages: str = "thread"  # 扫描/解析阶段的并发方式: thread / process / off
+    checkpoints: bool = True         # 输入未变化的阶段直接使用 1.过程/检查点 中的结果
+    perf_report: bool = True         # 写出 3.报告/性能.json（各步骤耗时、计数器、内存峰值）
+    profile: bool = False            # 额外保存 cProfile 数据到 3.报告/性能.prof（阶段改为顺序执行）
+    trace_memory: bool = False       # 用 tracemalloc 统计 Python 内存峰值（明显变慢）
+    category_mode: str = "shard"     # 超大分类的处理方式: shard / truncate / none，见 shard_category
+    max_merchants: int = 30          # 每个（子）分类的商人数上限，0 表示不限制
+    max_category_bytes: int = 0      # 每个子分类商人编码后的字节数上限，0 表示不限制（仅 shard 模式）
+    streaming: bool = False          # 流式转换：逐个分类直接写入 NBT，不生成 JSON，内存取决于最大的分类
+    incremental: bool = False        # 增量写出：只重新编码与上次输出相比有变化的分类（按流式路径处理，不生成 JSON）
+    parallel_encode: bool = True     # 大商店（按估计的编码大小）的分类在多个进程中编码，见 plan_encode_workers
+    validate: bool = True            # 转换后按结构描述校验生成的 .shopproj
+    use_manifest: bool = False       # jar 元数据没有作者时用整合包清单中的作者补全
+    nested_mods: bool = False        # 模组列表包含内嵌 jar 中的子模组（需要解压内嵌 jar，明显更慢）
+    scan_instance: bool = True       # 目标整合包的 kubejs / 数据包 / 资源包提供的物品也视为存在
+    item_diff: bool = False          # 同时扫描原整合包的物品，写出 3.报告/物品差异.txt（缺失物品归因）
+
+
+@dataclass
+class ConversionResult:
+    """转换结果：输出文件路径与统计数据"""
+    json_file: str = None
+    nbt_file: str = None
+    comparison_file: str = None
+    missing_file: str = None
+    item_diff_file: str = None
+    category_count: int = 0
+    item_count: int = 0
+    total_existing: int = 0
+    total_missing: int = 0
+    total_remapped: int = 0
+    both_have: set = field(default_factory=set)
+    only_source: set = field(default_factory=set)
+    only_target: set = field(default_factory=set)
+    author_mismatches: list = field(default_factory=list)
+    elapsed: float = 0.0
+    validation_errors: list = field(default_factory=list)
+    perf_file: str = None
+    profile_file: str = None
+
+
+def run_sdm_conversion(options, cache=None, log=None):
+    """执行 SDM 商店转 ViScriptShop 转换（不依赖 GUI）
+
+    输出写入 options.output_dir 下的 1.过程 / 2.输出 / 3.报告，
+    返回 ConversionResult；找不到输入文件时抛出 FileNotFoundError。
+    """
+    log = log or logger
+    recorder = PerfRecorder(options.trace_memory) if options.perf_report else None
+    profiler = None
+    if options.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        try:
+            with activate_perf(recorder):
+                result = _run_conversion(options, cache, log)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+
+        report_dir = os.path.join(options.output_dir, "3.报告")
+        if recorder is not None:
+            result.perf_file = recorder.save(os.path.join(report_dir, "性能.json"))
+            log.info(f"性能报告: {result.perf_file}")
+    finally:
+        if recorder is not None:
+            recorder.close()
+    if profiler is not None:
+        result.profile_file = os.path.join(report_dir, "性能.prof")
+        profiler.dump_stats(result.profile_file)
+        log.info(f"cProfile 数据: {result.profile_file}（可用 python -m pstats 查看）")
+    return result
+
+
+def _run_conversion(options, cache, log):
+    """转换主体，由 run_sdm_conversion 包上性能统计后调用"""
+    cache = cache if cache is not None else ScanCache()
+    start_time = time.perf_counter()
+    result = ConversionResult()
+
+    if not options.source_dir:
+        raise ValueError("请选择原整合包目录")
+    if not options.target_dir:
+        raise ValueError("请选择目标整合包目录")
+
+    # 确保 sdmshop.snbt 文件存在
+    snbt_files = resolve_snbt_files(options.snbt_files) if options.snbt_files else [options.snbt_file]
+    if not snbt_files:
+        raise FileNotFoundError(f"没有与 {' '.join(options.snbt_files)} 匹配的 snbt 文件")
+    for snbt_file in snbt_files:
+        if not os.path.exists(snbt_file):
+            raise FileNotFoundError(f"找不到 {snbt_file} 文件，请确保该文件存在")
+    snbt_file = snbt_files[0]
+    # 多个文件时每个文件是一个解析阶段（各自的检查点），解析完再合并
+    category_stages = ["categories"] if len(snbt_files) == 1 else [f"categories:{i}" for i in range(len(snbt_files))]
+
+    # 自动寻找 mods 文件夹
+    source_dir = find_mods_folder(options.source_dir)
+    target_dir = find_mods_folder(options.target_dir)
+
+    ensure_directories(options.output_dir)
+    process_dir = get_process_dir(options.output_dir)
+    output_dir = os.path.join(options.output_dir, "2.输出")
+    report_dir = os.path.join(options.output_dir, "3.报告")
+
+    # 开始转换过程
+    log.info("开始执行 SDM 商店转 ViScriptShop 转换...")
+    log.info(f"原模组目录: {source_dir}")
+    log.info(f"目标模组目录: {target_dir}\n")
+    
+    # 输入指纹：检查点的键由输入内容和工具版本决定
+    with perf_stage("输入指纹"):
+        same_pack = target_dir == source_dir
+        source_manifest = find_pack_manifest(source_dir) if options.use_manifest else None
+        target_manifest = find_pack_manifest(target_dir) if options.use_manifest else None
+        source_fp = fingerprint_mods_dir(source_dir, source_manifest)
+        target_fp = source_fp if same_pack else fingerprint_mods_dir(target_dir, target_manifest)
+        snbt_hashes = [hash_file(path) for path in snbt_files]
+        snbt_hash = (snbt_hashes[0] if len(snbt_files) == 1
+                     else StageCheckpointStore.make_key("snbt", options.merge_mode, *snbt_hashes))
+    store = StageCheckpointStore(os.path.join(process_dir, "检查点")) if options.checkpoints else None
+    stage_kinds = {"source_mods": "mods", "target_mods": "mods", "target_items": "items", "source_items": "items"}
+    stage_keys = {
+        "source_mods": StageCheckpointStore.make_key("mods", source_fp, options.nested_mods),
+        "target_mods": StageCheckpointStore.make_key("mods", target_fp, options.nested_mods),
+        "target_items": StageCheckpointStore.make_key("items", target_fp),
+        "source_items": StageCheckpointStore.make_key("items", source_fp),
+    }
+    for stage, file_hash in zip(category_stages, snbt_hashes):
+        stage_kinds[stage] = "categories"
+        stage_keys[stage] = StageCheckpointStore.make_key("categories", file_hash)
+
+    # 先从内存缓存和检查点取结果，取不到的阶段才需要重新计算
+    memory = {
+        "source_mods": cache.mods[source_dir][0] if source_dir in cache.mods else None,
+        "target_mods": cache.mods[target_dir][0] if target_dir in cache.mods else None,
+        "target_items": cache.items[target_dir][:2] if target_dir in cache.items else None,
+        "source_items": cache.items[source_dir][:2] if source_dir in cache.items else None,
+    }
+    stage_results = {}
+    reused = {}  # {阶段: "缓存" / "检查点"}
+    # 增量写出按流式路径处理：不写出 JSON，分类指纹直接取 snbt 分类块的原始字节
+    streaming = options.streaming or options.incremental
+    if streaming and len(snbt_files) == 1:
+        # 流式模式下 snbt 与步骤 6-10 一起逐个分类处理，不预先解析（多个文件需要先解析再合并）
+        del stage_kinds["categories"]
+    if not options.item_diff or same_pack:
+        # 同一个整合包时原物品就是目标物品，不重复扫描
+        del stage_kinds["source_items"]
+    for stage, path, file_hash in zip(category_stages, snbt_files, snbt_hashes):
+        cached = cache.categories.get(path)
+        if cached is not None and cached[0] == file_hash:
+            memory[stage] = cached[1]
+    for stage, kind in stage_kinds.items():
+        if memory.get(stage) is not None:
+            stage_results[stage], reused[stage] = memory[stage], "缓存"
+        elif store is not None:
+            value = store.load(kind, stage_keys[stage])
+            if value is not None:
+                stage_results[stage], reused[stage] = value, "检查点"
+
+    # 1/2/4/5 互不依赖（4 只需要 2 的模组列表），并发执行，全部完成后再按顺序输出日志
+    # cProfile 只能看到当前线程，开启时改为顺序执行
+    scheduler = StageScheduler("off" if options.profile else options.parallel_stages)
+    if "source_mods" not in stage_results:
+        scheduler.add("source_mods", get_installed_mods, source_dir, options.use_manifest, options.nested_mods,
+                      label="1.扫描原模组目录")
+    if "target_mods" not in stage_results and not same_pack:
+        scheduler.add("target_mods", get_installed_mods, target_dir, options.use_manifest, options.nested_mods,
+                      label="2.扫描目标模组目录")
+    if "target_items" not in stage_results:
+        if "target_mods" in stage_results:
+            scheduler.add("target_items", scan_all_items_from_mods, target_dir, stage_results["target_mods"],
+                          label="4.扫描目标模组中的物品")
+        else:
+            scheduler.add("target_items", scan_all_items_from_mods, target_dir,
+                          deps=["source_mods" if same_pack else "target_mods"], label="4.扫描目标模组中的物品")
+    if "source_items" in stage_kinds and "source_items" not in stage_results:
+        # 与目标物品扫描并发执行，共用嵌套 jar / 元数据缓存
+        if "source_mods" in stage_results:
+            scheduler.add("source_items", scan_all_items_from_mods, source_dir, stage_results["source_mods"],
+                          label="12.扫描原模组中的物品")
+        else:
+            scheduler.add("source_items", scan_all_items_from_mods, source_dir,
+                          deps=["source_mods"], label="12.扫描原模组中的物品")
+    for stage, path in zip(category_stages, snbt_files):
+        if stage in stage_kinds and stage not in stage_results:
+            scheduler.add(stage, parse_snbt_by_category, path, label="5.解析SNBT")
+    if options.scan_instance:
+        # 不写检查点：目录列表和文件解析结果按修改时间缓存，重复扫描很快
+        scheduler.add("instance_items", discover_instance_items, get_pack_root(target_dir),
+                      label="4.扫描整合包中的脚本与数据包")
+        if "source_items" in stage_kinds:
+            scheduler.add("source_instance_items", discover_instance_items, get_pack_root(source_dir),
+                          label="12.扫描原整合包中的脚本与数据包")
+    computed = scheduler.run()
+    if same_pack and "source_mods" in computed and "target_mods" not in stage_results:
+        computed["target_mods"] = computed["source_mods"]
+    instance_items = computed.pop("instance_items", set())
+    source_instance_items = computed.pop("source_instance_items", set())
+    if store is not None:
+        for stage, value in computed.items():
+            store.save(stage_kinds[stage], stage_keys[stage], value)
+    stage_results.update(computed)
+
+    source_mods = stage_results["source_mods"]
+    target_mods = stage_results["target_mods"]
+    available_items, mod_items_map = stage_results["target_items"]
+    categories_data = stage_results.get("categories")
+    merge_stats = None
+    if len(snbt_files) > 1:
+        categories_data, merge_stats = merge_snbt_categories([stage_results[stage] for stage in category_stages],
+                                                             options.merge_mode)
+    cache.mods[source_dir] = (source_mods, time.time())
+    cache.mods[target_dir] = (target_mods, time.time())
+    cache.items[target_dir] = (available_items, mod_items_map, time.time())
+    if "source_items" in stage_results:
+        cache.items[source_dir] = (*stage_results["source_items"], time.time())
+    for stage, path, file_hash in zip(category_stages, snbt_files, snbt_hashes):
+        if stage in stage_results:
+            cache.categories[path] = (file_hash, stage_results[stage])
+
+    # 1. 扫描原模组目录
+    log.info("1. 扫描原模组目录...")
+    if "source_mods" in reused:
+        log.info(f"   使用{reused['source_mods']}的扫描结果: {len(source_mods)} 个模组/库")
+    else:
+        log.info(f"   原模组目录发现 {len(source_mods)} 个模组/库")
+    if source_manifest:
+        log.info(f"   使用整合包清单: {source_manifest}")
+    
+    # 2. 扫描目标模组目录
+    log.info("\n2. 扫描目标模组目录...")
+    if "target_mods" in reused:
+        log.info(f"   使用{reused['target_mods']}的扫描结果: {len(target_mods)} 个模组/库")
+    else:
+        log.info(f"   目标目录发现 {len(target_mods)} 个模组/库")
+    if target_manifest:
+        log.info(f"   使用整合包清单: {target_manifest}")
+    
+    # 3. 对比模组目录
+    log.info("\n3. 对比模组目录...")
+    with perf_stage("3.对比模组目录"):
+        comparison_file = os.path.join(report_dir, "模组对比.txt")
+        comparison_key = StageCheckpointStore.make_key("comparison", source_fp, target_fp, source_dir, target_dir)
+        if store is not None and os.path.exists(comparison_file) and store.load("comparison", comparison_key):
+            both_have, only_source, only_target, author_mismatches = compare_mods(source_mods, target_mods)
+            log.info(f"   模组对比未变化，保留: {comparison_file}")
+        else:
+            comparison_file, both_have, only_source, only_target, author_mismatches = save_mod_comparison(
+                source_mods, target_mods, source_dir, target_dir, report_dir
+            )
+            if store is not None:
+                store.save("comparison", comparison_key, True)
+            log.info(f"   模组对比已保存: {comparison_file}")
+    result.comparison_file = comparison_file
+    result.both_have, result.only_source, result.only_target = both_have, only_source, only_target
+    result.author_mismatches = author_mismatches
+    log.info(f"   ✅ 两边都有: {len(both_have)} 个")
+    log.info(f"   ⚠️  只有原模组有: {len(only_source)} 个")
+    log.info(f"   ❓ 只有目标有: {len(only_target)} 个")
+    
+    # 4. 扫描目标模组中的物品
+    log.info("\n4. 扫描目标模组中的物品...")
+    if "target_items" in reused:
+        log.info(f"   使用{reused['target_items']}的扫描结果: {len(available_items)} 个可用物品")
+    else:
+        log.info(f"   扫描到 {len(available_items)} 个可用物品")
+    extra_items = instance_items - available_items
+    if extra_items:
+        available_items = available_items | extra_items
+        log.info(f"   KubeJS / 数据包 / 资源包中另有 {len(extra_items)} 个物品")
+    
+    # 5. 解析 sdmshop.snbt
+    if merge_stats is not None:
+        log.info(f"\n5. 解析并合并 {len(snbt_files)} 个 snbt 文件...")
+        reused_count = sum(stage in reused for stage in category_stages)
+        if reused_count:
+            log.info(f"   其中 {reused_count} 个文件使用缓存或检查点的解析结果")
+        log.info(f"   合并后 {len(categories_data)} 个分类（同名分类 {merge_stats['conflicts']} 个，"
+                 f"按 {options.merge_mode} 处理；去掉重复商人 {merge_stats['duplicates']} 个）")
+    else:
+        log.info(f"\n5. 解析 {os.path.basename(snbt_file)}...")
+        if streaming:
+            log.info("   流式模式：与步骤 6-10 一起逐个分类处理")
+        else:
+            if "categories" in reused:
+                log.info(f"   使用{reused['categories']}的解析结果")
+            log.info(f"   发现 {len(categories_data)} 个原有分类")
+    if scheduler.timings and log.isEnabledFor(logging.DEBUG):
+        log.debug("   并发阶段耗时: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in scheduler.timings.items())
+                  + f" (合计墙钟 {scheduler.wall_time:.2f}s)")
+
+    # 6-10. 过滤物品并生成商店文件；snbt 与目标整合包都未变化且输出文件仍在时整段跳过
+    extra_digest = hashlib.sha1("\n".join(sorted(extra_items)).encode('utf-8')).hexdigest()
+    shop_key = StageCheckpointStore.make_key("shop", snbt_hash, target_fp, extra_digest, options.category_mode,
+                                             options.max_merchants, options.max_category_bytes, streaming)
+    shop = store.load("shop", shop_key) if store is not None else None
+    if shop is not None and all(os.path.exists(path) for path in shop["files"]):
+        log.info("\n6-10. 输入未变化，跳过物品检查与商店生成（使用检查点）")
+    else:
+        index_file = (os.path.join(process_dir, "extracted_shop_by_category.shopproj.index.json")
+                      if options.incremental else None)
+        if streaming:
+            snbt_source = categories_data if merge_stats is not None else snbt_file
+            index_context = StageCheckpointStore.make_key("shop", target_fp, extra_digest, options.category_mode,
+                                                          options.max_merchants, options.max_category_bytes)
+            shop = stream_shop_outputs(snbt_source, available_items, target_mods, output_dir, report_dir, log,
+                                       options.category_mode, options.max_merchants, options.max_category_bytes,
+                                       index_file, index_context)
+        else:
+            shop = build_shop_outputs(categories_data, available_items, target_mods,
+                                      process_dir, output_dir, report_dir, log,
+                                      options.category_mode, options.max_merchants, options.max_category_bytes,
+                                      index_file, options.parallel_encode and not options.profile)
+        if options.validate and shop["nbt_file"]:
+            result.validation_errors = check_shopproj_output(shop["nbt_file"], log)
+        if store is not None and shop["nbt_file"] and not result.validation_errors:
+            store.save("shop", shop_key, shop)
+
+    # 12. 物品级对比两个整合包，并对缺失物品归因
+    if options.item_diff:
+        log.info("\n12. 对比两个整合包的物品...")
+        with perf_stage("12.物品差异"):
+            item_diff_file = os.path.join(report_dir, "物品差异.txt")
+            source_extra = source_instance_items - stage_results["source_items"][0] if not same_pack else set()
+            item_diff_key = StageCheckpointStore.make_key(
+                "item_diff", source_fp, target_fp, snbt_hash, extra_digest,
+                hashlib.sha1("\n".join(sorted(source_extra)).encode('utf-8')).hexdigest())
+            if store is not None and os.path.exists(item_diff_file) and store.load("item_diff", item_diff_key):
+                log.info(f"   物品差异未变化，保留: {item_diff_file}")
+            else:
+                source_items = available_items if same_pack else stage_results["source_items"][0] | source_extra
+                categories = categories_data if categories_data is not None else iter_snbt_categories(snbt_file)
+                shop_item_ids = {item['id'] for cat in categories for item in cat['items']}
+                diff = diff_pack_items(shop_item_ids, source_items, available_items, source_mods, target_mods)
+                item_diff_file = save_item_diff(diff, source_dir, target_dir, report_dir)
+                if store is not None:
+                    store.save("item_diff", item_diff_key, True)
+                log.info("   " + ", ".join(f"{cause} {len(entries)} 个" for cause, entries in diff["missing"].items()))
+                log.info(f"   物品差异已保存: {item_diff_file}")
+        result.item_diff_file = item_diff_file
+
+    # 完成提示
+    log.info("\n" + "="*70)
+    log.info("✅ 完成！")
+    if shop["json_file"]:
+        log.info(f"   JSON 文件: {shop['json_file']}")
+    if shop["nbt_file"]:
+        log.info(f"   NBT 文件: {shop['nbt_file']}")
+    log.info(f"   分类数: {shop['category_count']}")
+    log.info(f"   总物品数: {shop['item_count']}")
+    log.info(f"   模组对比: {comparison_file}")
+    if result.item_diff_file:
+        log.info(f"   物品差异: {result.item_diff_file}")
+    if shop["total_missing"] > 0:
+        log.info(f"   缺失物品: {shop['missing_file']}")
+    log.info("="*70)
+
+    result.json_file = shop["json_file"]
+    result.nbt_file = shop["nbt_file"]
+    result.missing_file = shop["missing_file"]
+    result.category_count = shop["category_count"]
+    result.item_count = shop["item_count"]
+    result.total_existing = shop["total_existing"]
+    result.total_missing = shop["total_missing"]
+    result.total_remapped = shop.get("total_remapped", 0)
+    result.elapsed = time.perf_counter() - start_time
+    return result
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _mods_dir_signature(mods_dir):
+    """mods 目录中 jar 的 (文件名, 大小, 修改时间)，只 stat 不打开文件"""
+    try:
+        with os.scandir(mods_dir) as entries:
+            return tuple(sorted((entry.name, _file_signature(entry.path))
+                                for entry in entries if entry.name.endswith('.jar')))
+    except OSError:
+        return None
+
+
+def _tree_signature(root):
+    """目录树的 (文件数, 总大小, 文件与目录的最新修改时间)，只 stat 不读取文件；目录不存在时为 None
+
+    修改、新增文件会更新最新修改时间，删除和改名会更新所在目录的修改时间，都能被察觉。
+    """
+    try:
+        latest = os.stat(root).st_mtime_ns
+    except OSError:
+        return None
+    count = size = 0
+    stack = [root]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    latest = max(latest, st.st_mtime_ns)
+                    if entry.is_dir():
+                        stack.append(entry.path)
+                    else:
+                        count += 1
+                        size += st.st_size
+        except OSError:
+            continue
+    return count, size, latest
+
+
+def instance_watch_dirs(pack_root):
+    """整合包目录中提供物品、需要监视的目录：kubejs/ 与数据包 / 资源包目录"""
+    return [os.path.join(pack_root, name) for name in ("kubejs", *INSTANCE_PACK_DIRS)]
+
+
+class InputWatcher:
+    """轮询转换输入的变化：snbt 文件（通配符每次重新展开）、原/目标 mods 目录与其他目录树，只比较大小和修改时间"""
+
+    def __init__(self, snbt_patterns, mods_dirs, trees=()):
+        self.snbt_patterns = snbt_patterns
+        self.mods_dirs = list(dict.fromkeys(mods_dirs))
+        self.trees = list(dict.fromkeys(trees))
+
+    def snapshot(self):
+        snapshot = {path: _file_signature(path) for path in resolve_snbt_files(self.snbt_patterns)}
+        snapshot.update((mods_dir, _mods_dir_signature(mods_dir)) for mods_dir in self.mods_dirs)
+        snapshot.update((tree, _tree_signature(tree)) for tree in self.trees)
+        return snapshot
+
+    @staticmethod
+    def changed(previous, current):
+        """两次快照之间变化（含新增、删除）的路径"""
+        return sorted(path for path in previous.keys() | current.keys() if previous.get(path) != current.get(path))
+
+
+def watch_conversion(options, cache=None, log=None, interval=0.5, debounce=0.3, stop_event=None, on_result=None):
+    """监视模式：先转换一次，之后输入变化时自动重新转换，直到 stop_event 被设置
+
+    连续的变化（编辑器保存时常见的多次写入、复制 jar）等到 debounce 秒内不再变化才处理；
+    mods 目录变化时只丢弃该目录的内存缓存，snbt 变化时只重新解析变化的文件，其余阶段沿用内存中的结果。
+    scan_instance 时也监视整合包的 kubejs/ 与数据包 / 资源包目录（原整合包的只在 item_diff 时）。
+    每次转换后调用 on_result(结果或异常)；返回完成的转换次数。
+    """
+    log = log or logger
+    cache = cache if cache is not None else ScanCache()
+    stop_event = stop_event or threading.Event()
+    source_dir = find_mods_folder(options.source_dir)
+    target_dir = find_mods_folder(options.target_dir)
+    trees = []
+    if options.scan_instance:
+        trees += instance_watch_dirs(get_pack_root(target_dir))
+        if options.item_diff:
+            trees += instance_watch_dirs(get_pack_root(source_dir))
+    watcher = InputWatcher(options.snbt_files or [options.snbt_file], [source_dir, target_dir], trees)
+    watched = "snbt、mods 目录与整合包的 kubejs/数据包/资源包目录" if trees else "snbt 与 mods 目录"
+    runs = 0
+
+    def convert():
+        nonlocal runs
+        try:
+            outcome = run_sdm_conversion(options, cache, log)
+            log.info(f"总耗时: {outcome.elapsed:.2f} 秒")
+            runs += 1
+        except (ValueError, OSError) as e:
+            log.error(f"转换失败: {e}")
+            outcome = e
+        except Exception as e:
+            # 输入编辑到一半时解析可能抛出任意异常；记录堆栈后继续监视，等下一次保存再转换
+            log.exception(f"转换出错: {e}")
+            outcome = e
+        if on_result is not None:
+            on_result(outcome)
+
+    previous = watcher.snapshot()
+    convert()
+    log.info(f"\n监视中（每 {interval:g} 秒检查一次{watched}）...")
+    while not stop_event.wait(interval):
+        current = watcher.snapshot()
+        if current == previous:
+            continue
+        while not stop_event.wait(debounce):
+            settled = watcher.snapshot()
+            if settled == current:
+                break
+            current = settled
+        else:
+            break
+
+        changed = InputWatcher.changed(previous, current)
+        previous = current
+        for mods_dir in (source_dir, target_dir):
+            if mods_dir in changed:
+                cache.mods.pop(mods_dir, None)
+                cache.items.pop(mods_dir, None)
+        log.info("\n" + "="*70)
+        log.info(f"检测到变化: {', '.join(changed)}，重新转换...")
+        convert()
+        log.info(f"\n监视中（每 {interval:g} 秒检查一次{watched}）...")
+    return runs
+
+
+# 旧版物品 ID → 目标版本物品 ID，步骤 6 分类时直接替换
+ITEM_ID_REMAPS = {
+    "minecraft:scute": "minecraft:turtle_scute",
+}
+
+
+class ItemClassification:
+    """步骤 6 的单遍分类结果：每个物品归为 存在 / 缺失 / 替换 ID（替换后存在）
+
+    物品按分类连续存放成行，状态和命名空间编号各是一列 array；
+    按分类、按命名空间的计数也按列存放：category_counts[状态][分类下标]、namespace_counts[状态][命名空间下标]。
+    """
+
+    EXISTING, MISSING, REMAPPED = 0, 1, 2
+
+    def __init__(self):
+        self.titles = []                  # 分类标题（原顺序）
+        self.icons = []                   # 分类图标（模组不存在时已换成屏障方块）
+        self.category_start = array('I')  # 每个分类第一行的下标
+        self.items = []                   # 每行的物品，替换 ID 的行是替换后的副本
+        self.status = array('B')
+        self.namespace_index = array('I')
+        self.namespaces = []
+        self.category_counts = (array('I'), array('I'), array('I'))
+        self.namespace_counts = (array('I'), array('I'), array('I'))
+        self.remapped_counts = {}         # {旧 ID: 替换次数}，包括分类图标
+
+    @property
+    def total_existing(self):
+        """存在的物品数（含替换 ID 后存在的）"""
+        return sum(self.category_counts[self.EXISTING]) + sum(self.category_counts[self.REMAPPED])
+
+    @property
+    def total_missing(self):
+        return sum(self.category_counts[self.MISSING])
+
+    @property
+    def total_remapped(self):
+        return sum(self.category_counts[self.REMAPPED])
+
+    def rows(self, index):
+        end = self.category_start[index + 1] if index + 1 < len(self.titles) else len(self.items)
+        return range(self.category_start[index], end)
+
+    def filtered_categories(self):
+        """逐个生成至少有一个可用物品的分类 {'title', 'icon', 'items'}"""
+        items, status, missing = self.items, self.status, self.MISSING
+        for index, title in enumerate(self.titles):
+            existing = [items[row] for row in self.rows(index) if status[row] != missing]
+            if existing:
+                yield {'title': title, 'icon': self.icons[index], 'items': existing}
+
+    def missing_by_category(self):
+        """{分类标题: [缺失物品]}，供缺失物品报告使用"""
+        items, status, missing = self.items, self.status, self.MISSING
+        return {
+            title: [items[row] for row in self.rows(index) if status[row] == missing]
+            for index, title in enumerate(self.titles)
+        }
+
+    def missing_by_namespace(self):
+        """{命名空间: 缺失物品数}，按缺失数从多到少排列"""
+        counts = self.namespace_counts[self.MISSING]
+        pairs = [(self.namespaces[i], counts[i]) for i in range(len(self.namespaces)) if counts[i]]
+        return dict(sorted(pairs, key=lambda pair: -pair[1]))
+
+
+def classify_items(categories_data, available_items, available_mods, remaps=ITEM_ID_REMAPS):
+    """一次遍历所有分类的物品，划分为存在 / 缺失 / 替换 ID，返回 ItemClassification
+
+    原版（minecraft 命名空间）物品总是视为存在；分类图标的模组不存在且图标物品也不可用时换成屏障方块
+    （内嵌 jar 中的子模组默认不在模组列表中，但其物品在可用物品中）。
+    """
+    result = ItemClassification()
+    EXISTING, MISSING, REMAPPED = result.EXISTING, result.MISSING, result.REMAPPED
+    category_counts, namespace_counts = result.category_counts, result.namespace_counts
+    namespace_ids = {}
+
+    for cat in categories_data:
+        icon = cat['icon']
+        if icon.split(':')[0] not in available_mods and icon not in available_items:
+            icon = "minecraft:barrier"
+        elif icon in remaps:
+            result.remapped_counts[icon] = result.remapped_counts.get(icon, 0) + 1
+            icon = remaps[icon]
+        category = len(result.titles)
+        result.titles.append(cat['title'])
+        result.icons.append(icon)
+        result.category_start.append(len(result.items))
+        for counts in category_counts:
+            counts.append(0)
+
+        for item in cat['items']:
+            item_id = item['id']
+            namespace = item_id.split(':')[0]
+            ns = namespace_ids.get(namespace)
+            if ns is None:
+                ns = namespace_ids[namespace] = len(result.namespaces)
+                result.namespaces.append(namespace)
+                for counts in namespace_counts:
+                    counts.append(0)
+
+            new_id = remaps.get(item_id)
+            if new_id is not None and (new_id.split(':')[0] == 'minecraft' or new_id in available_items):
+                status = REMAPPED
+                result.remapped_counts[item_id] = result.remapped_counts.get(item_id, 0) + 1
+                item = dict(item, id=new_id)
+            elif namespace == 'minecraft' or item_id in available_items:
+                status = EXISTING
+            else:
+                status = MISSING
+
+            result.items.append(item)
+            result.status.append(status)
+            result.namespace_index.append(ns)
+            category_counts[status][category] += 1
+            namespace_counts[status][ns] += 1
+
+    return result
+
+
+def category_fingerprint(category):
+    """分类内容的指纹，用于增量写出时判断分类是否变化
+
+    流式转换时由 stream_shop_outputs 按 snbt 分类块的原始字节预先算好，放在 category["_fingerprint"]，
+    这里只在没有预先算好时才序列化整个分类。
+    """
+    fingerprint = category.pop("_fingerprint", None)
+    if fingerprint is not None:
+        return fingerprint
+    encoded = json.dumps(category, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()
+
+
+def load_shopproj_index(index_file, nbt_file):
+    """读取上次输出的分类索引 {指纹: (偏移, 长度)}；索引与现有输出文件不匹配时返回 {}"""
+    try:
+        with open(index_file, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        stat = os.stat(nbt_file)
+    except (OSError, ValueError):
+        return {}
+    if (index.get("tool_version") != TOOL_VERSION or index.get("size") != stat.st_size
+            or index.get("mtime_ns") != stat.st_mtime_ns):
+        return {}
+    return {fingerprint: (offset, length) for fingerprint, offset, length in index["categories"]}
+
+
+def save_shopproj_index(index_file, nbt_file, spans):
+    """保存输出文件的分类索引，spans 为 [(指纹, 偏移, 长度)]"""
+    stat = os.stat(nbt_file)
+    index = {
+        "tool_version": TOOL_VERSION,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "categories": spans,
+    }
+    with open(index_file, 'w', encoding='utf-8') as f:
+        json.dump(index, f, separators=(',', ':'))
+
+
+def write_shopproj_file(categories, nbt_file, uid=None, index_file=None, log=None, parallel=False):
+    """把分类编码为 shopproj NBT 写入 nbt_file（先写临时文件，内容未变化时不替换），返回是否写入
+
+    categories 可以是迭代器，此时 uid 传 DeferredInt。提供 index_file 时增量写出：
+    与上次输出中指纹相同的分类直接复制上次文件中的字节，只重新编码有变化的分类，并更新索引。
+    parallel 且 categories 是列表时，需要编码的分类先交给 encode_categories（按大小自动决定是否多进程）。
+    """
+    log = log or logger
+    if uid is None:
+        uid = len(categories)
+    previous = load_shopproj_index(index_file, nbt_file) if index_file else {}
+    spans = []
+    reused = encoded = 0
+    fingerprints = pre_encoded = None
+    if parallel and isinstance(categories, list):
+        fingerprints = [category_fingerprint(category) if index_file else None for category in categories]
+        pre_encoded = iter(encode_categories([category for category, fingerprint in zip(categories, fingerprints)
+                                              if fingerprint not in previous]))
+    temp_file = nbt_file + ".tmp"
+    old_file = open(nbt_file, 'rb') if previous else None
+    try:
+        with open(temp_file, 'wb') as f:
+            def payload():
+                nonlocal reused, encoded
+                for position, category in enumerate(categories):
+                    if fingerprints is not None:
+                        fingerprint = fingerprints[position]
+                    else:
+                        fingerprint = category_fingerprint(category) if index_file else None
+                    span = previous.get(fingerprint)
+                    start = f.tell()
+                    if span:
+                        old_file.seek(span[0])
+                        reused += 1
+                        yield old_file.read(span[1])
+                    else:
+                        encoded += 1
+                        yield next(pre_encoded) if pre_encoded is not None else encode_category_payload(category)
+                    spans.append((fingerprint, start, f.tell() - start))
+
+            shopproj = build_shopproj(payload(), uid=uid)
+            writer = StreamingNBTWriter(f)
+            writer.write_root(shopproj["_root_name"], shopproj["data"])
+            writer.finish()
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    finally:
+        if old_file is not None:
+            old_file.close()
+
+    changed = replace_if_changed(temp_file, nbt_file)
+    if changed:
+        perf_count("bytes_written", os.path.getsize(nbt_file))
+        log.info(f"   ✓ NBT 文件已生成: {nbt_file}")
+    else:
+        log.info(f"   ✓ NBT 文件内容未变化，未重写: {nbt_file}")
+    if index_file:
+        save_shopproj_index(index_file, nbt_file, spans)
+        log.info(f"   增量写出: 复用 {reused} 个分类，重新编码 {encoded} 个")
+    perf_count("categories_reused", reused)
+    perf_count("categories_encoded", encoded)
+    return changed
+
+
+def check_shopproj_output(nbt_file, log=None):
+    """11. 校验生成的 .shopproj，返回问题列表"""
+    log = log or logger
+    with perf_stage("11.校验输出文件"):
+        log.info("\n11. 校验输出文件结构...")
+        errors, error_count = validate_shopproj(nbt_file)
+    if errors:
+        log.warning(f"   ✗ 发现 {error_count} 个结构问题:")
+        for message in errors:
+            log.warning(f"      {message}")
+        if error_count > len(errors):
+            log.warning(f"      …… 另有 {error_count - len(errors)} 个问题未列出")
+    else:
+        log.info("   ✓ 结构校验通过")
+    return errors
+
+
+def build_category_shards(cat, category_mode, max_merchants, max_category_bytes, log):
+    """步骤 7：把一个过滤后的分类逐个构建为 shopproj 分类（超出上限时按 category_mode 拆分或截断）"""
+    items = cat['items']
+    merchants = (create_shopproj_item(item) for item in items)
+    shard_count = 0
+    for title, icon, shard in shard_category(cat['title'], cat['icon'], merchants,
+                                             category_mode, max_merchants, max_category_bytes):
+        shard_count += 1
+        log.debug("   ✓ 添加 %s 分类 (%d 个物品)", title, len(shard))
+        yield create_category(title, icon, shard)
+    if category_mode == "truncate" and 0 < max_merchants < len(items):
+        log.info(f"   ⚠️  {cat['title']}: 只保留前 {max_merchants} 个物品，截断 {len(items) - max_merchants} 个")
+    elif shard_count > 1:
+        log.info(f"   ✂ {cat['title']}: {len(items)} 个物品拆分为 {shard_count} 个子分类")
+
+
+def build_shop_outputs(categories_data, available_items, target_mods, process_dir, output_dir, report_dir, log=None,
+                       category_mode="shard", max_merchants=30, max_category_bytes=0, index_file=None,
+                       parallel_encode=False):
+    """步骤 6-10：检查物品存在性、构建商店并写出 JSON / NBT / 缺失物品报告
+
+    category_mode / max_merchants / max_category_bytes 控制超大分类的处理，见 shard_category；
+    提供 index_file 时增量写出 NBT，parallel_encode 时大商店的分类在多个进程中编码，见 write_shopproj_file。
+    返回输出文件路径与统计数据；内容与已有文件完全相同的输出不会重写。
+    """
+    log = log or logger
+
+    # 6. 检查物品存在性（单遍分类：存在 / 缺失 / 替换 ID）
+    with perf_stage("6.检查物品存在性"):
+        log.info("\n6. 检查物品存在性...")
+        classification = classify_items(categories_data, available_items, set(target_mods.keys()))
+        total_existing = classification.total_existing
+        total_missing = classification.total_missing
+
+        # 显示分类状态
+        log.debug("   分类状态:")
+        existing_counts = classification.category_counts[ItemClassification.EXISTING]
+        remapped_counts = classification.category_counts[ItemClassification.REMAPPED]
+        missing_counts = classification.category_counts[ItemClassification.MISSING]
+        shown = 0
+        for index, title in enumerate(classification.titles):
+            existing_count = existing_counts[index] + remapped_counts[index]
+            if existing_count:
+                shown += 1
+                log.debug("      %d. %s: %d个可用, %d个缺失 (图标: %s)",
+                          shown, title, existing_count, missing_counts[index], classification.icons[index])
+
+        log.info(f"   ✅ 存在的物品: {total_existing} 个")
+        if total_missing > 0:
+            log.info(f"   ⚠️  排除缺失物品: {total_missing} 个 (这些物品在目标模组中不存在)")
+    
+    # 7. 构建商店
+    with perf_stage("7.构建商店"):
+        log.info("\n7. 构建商店...")
+        categories = []
+    
+        for cat in classification.filtered_categories():
+            categories.extend(build_category_shards(cat, category_mode, max_merchants, max_category_bytes, log))
+    
+    # 8. 生成配置文件
+    with perf_stage("8.生成配置文件"):
+        log.info("\n8. 生成配置文件...")
+        shopproj = build_shopproj(categories)
+    
+    # 9. 旧版物品 ID（如 minecraft:scute → minecraft:turtle_scute）已在步骤 6 分类时替换，这里只汇总
+    with perf_stage("9.替换物品ID"):
+        log.info("\n9. 检测并替换物品 ID...")
+        for old_id, new_id in ITEM_ID_REMAPS.items():
+            count = classification.remapped_counts.get(old_id, 0)
+            if count:
+                log.debug("   ✓ 替换 %s 为 %s (%d 处)", old_id, new_id, count)
+        log.info("   ✓ 物品 ID 替换完成")
+    
+    # 使用默认文件名，保存到过程文件夹
+    with perf_stage("9.写出JSON"):
+        json_file = os.path.join(process_dir, "extracted_shop_by_category.shopproj.json")
+        json_bytes = json.dumps(shopproj, ensure_ascii=False, indent=2).encode('utf-8')
+        if write_if_changed(json_file, json_bytes):
+            perf_count("bytes_written", len(json_bytes))
+            log.info(f"   ✓ JSON 文件已保存: {json_file}")
+        else:
+            log.info(f"   ✓ JSON 文件内容未变化，未重写: {json_file}")
+    
+    # 10. 转换为 NBT（直接由内存中的结构编码，结果与 json_to_nbt 相同）
+    with perf_stage("10.转换为NBT"):
+        log.info("\n10. 转换为 NBT 格式...")
+        nbt_file = os.path.join(output_dir, "extracted_shop_by_category.shopproj")
+        try:
+            write_shopproj_file(categories, nbt_file, index_file=index_file, log=log, parallel=parallel_encode)
+        except Exception as e:
+            log.error(f"   ✗ 转换 NBT 失败: {e}")
+            nbt_file = None
+    
+    # 保存缺失物品
+    missing_file = None
+    if total_missing > 0:
+        missing_file = save_missing_items(classification.missing_by_category(), total_missing, report_dir,
+                                          classification.missing_by_namespace())
+        log.info(f"   📄 缺失物品已保存: {missing_file}")
+    
+    return {
+        "json_file": json_file,
+        "nbt_file": nbt_file,
+        "missing_file": missing_file,
+        "files": [path for path in (json_file, nbt_file, missing_file) if path],
+        "category_count": len(categories),
+        "item_count": sum(len(c['merchants']['payload']['_value']) for c in categories),
+        "total_existing": total_existing,
+        "total_missing": total_missing,
+        "total_remapped": classification.total_remapped,
+    }
+
+
+
+def stream_shop_outputs(snbt_file, available_items, target_mods, output_dir, report_dir, log=None,
+                        category_mode="shard", max_merchants=30, max_category_bytes=0, index_file=None,
+                        index_context=""):
+    """流式执行步骤 5-10：逐个分类读取 snbt → 检查物品存在性 → 拆分 → 直接写入 NBT 文件
+
+    分类列表边生成边写出，最后回填列表长度和 uid；不生成 JSON 文件，
+    内存占用取决于最大的分类而不是整个商店。返回值与 build_shop_outputs 相同。
+    snbt_file 也可以是已解析（合并）好的分类列表。
+    提供 index_file 且读取 snbt 文件时，每个输出分类的指纹由分类块原始字节的哈希、index_context
+    （目标物品与拆分参数等决定输出的其他输入）和子分类序号组成，不必再序列化分类。
+    """
+    log = log or logger
+    available_mods = set(target_mods.keys())
+    totals = {"existing": 0, "missing": 0, "remapped": 0, "items": 0}
+    missing_items_by_category = {}
+    missing_by_namespace = {}
+    remapped_counts = {}
+    category_count = DeferredInt()
+
+    def categories():
+        shown = 0
+        if isinstance(snbt_file, str):
+            source = iter_snbt_categories(snbt_file, digests=bool(index_file))
+        else:
+            source = snbt_file
+        for cat in source:
+            digest = None
+            if isinstance(cat, tuple):
+                cat, digest = cat
+            classification = classify_items([cat], available_items, available_mods)
+            totals["existing"] += classification.total_existing
+            totals["missing"] += classification.total_missing
+            totals["remapped"] += classification.total_remapped
+            missing_items_by_category.update(classification.missing_by_category())
+            for namespace, count in classification.missing_by_namespace().items():
+                missing_by_namespace[namespace] = missing_by_namespace.get(namespace, 0) + count
+            for old_id, count in classification.remapped_counts.items():
+                remapped_counts[old_id] = remapped_counts.get(old_id, 0) + count
+
+            for filtered in classification.filtered_categories():
+                shown += 1
+                log.debug("   %d. %s: %d个可用, %d个缺失 (图标: %s)", shown, filtered['title'],
+                          len(filtered['items']), classification.total_missing, filtered['icon'])
+                shards = build_category_shards(filtered, category_mode, max_merchants, max_category_bytes, log)
+                for number, category in enumerate(shards):
+                    category_count.value += 1
+                    totals["items"] += len(category['merchants']['payload']['_value'])
+                    if digest is not None:
+                        category["_fingerprint"] = hashlib.sha1(
+                            f"{digest}\0{index_context}\0{number}".encode('utf-8')).hexdigest()
+                    yield category
+
+    log.info("\n6-10. 流式检查物品、构建商店并写出 NBT...")
+    nbt_file = os.path.join(output_dir, "extracted_shop_by_category.shopproj")
+    with perf_stage("5-10.流式转换"):
+        try:
+            write_shopproj_file(categories(), nbt_file, uid=category_count, index_file=index_file, log=log)
+        except Exception as e:
+            log.error(f"   ✗ 流式转换失败: {e}")
+            nbt_file = None
+
+    log.info(f"   ✅ 存在的物品: {totals['existing']} 个")
+    if totals["missing"] > 0:
+        log.info(f"   ⚠️  排除缺失物品: {totals['missing']} 个 (这些物品在目标模组中不存在)")
+    for old_id, count in remapped_counts.items():
+        log.debug("   ✓ 替换 %s 为 %s (%d 处)", old_id, ITEM_ID_REMAPS.get(old_id, old_id), count)
+
+    missing_file = None
+    if totals["missing"] > 0:
+        missing_by_namespace = dict(sorted(missing_by_namespace.items(), key=lambda pair: -pair[1]))
+        missing_file = save_missing_items(missing_items_by_category, totals["missing"], report_dir, missing_by_namespace)
+        log.info(f"   📄 缺失物品已保存: {missing_file}")
+
+    return {
+        "json_file": None,
+        "nbt_file": nbt_file,
+        "missing_file": missing_file,
+        "files": [path for path in (nbt_file, missing_file) if path],
+        "category_count": category_count.value,
+        "item_count": totals["items"],
+        "total_existing": totals["existing"],
+        "total_missing": totals["missing"],
+        "total_remapped": totals["remapped"],
+    }
+
+# ==================== 多整合包对比 ====================
+
+def _bitset(numbers):
+    """由编号构造位集（Python int）：先在 bytearray 中置位，再一次性转换"""
+    numbers = list(numbers)
+    buf = bytearray((max(numbers, default=-1) + 8) // 8)
+    for number in numbers:
+        buf[number >> 3] |= 1 << (number & 7)
+    return int.from_bytes(buf, 'little')
+
+
+def _bit_count(bits):
+    """位集中的元素数"""
+    return bits.bit_count() if hasattr(bits, "bit_count") else bin(bits).count("1")
+
+
+def _iter_bits(bits):
+    """按编号从小到大生成位集中的元素"""
+    for offset, byte in enumerate(bits.to_bytes((bits.bit_length() + 7) // 8, 'little')):
+        while byte:
+            low = byte & -byte
+            yield offset * 8 + low.bit_length() - 1
+            byte ^= low
+
+
+class PackMatrix:
+    """多个整合包的模组 / 物品成员关系
+
+    每个模组、物品分配一个稠密整数编号，每个整合包的模组和物品各用一个 Python int 位集表示，
+    任意两个整合包的交集、差集都只是一次位运算。商店物品按 ID 去重后登记在同一套物品编号中。
+    """
+
+    def __init__(self):
+        self.packs = []        # [(名称, 目录)]
+        self.mod_index = {}    # {mod_id: 编号}
+        self.mods = []         # 编号 → mod_id
+        self.item_index = {}   # {物品 ID: 编号}
+        self.items = []        # 编号 → 物品 ID
+        self.mod_bits = []     # 每个整合包的模组位集
+        self.item_bits = []    # 每个整合包的物品位集（含可按 ITEM_ID_REMAPS 替换的旧 ID）
+        self.categories = []   # [(分类标题, 物品位集)]
+        self.shop_bits = 0     # 商店用到的全部物品
+        self.vanilla_bits = 0  # 其中的原版物品，总视为存在
+
+    @staticmethod
+    def _intern(index, names, key):
+        number = index.get(key)
+        if number is None:
+            number = index[key] = len(names)
+            names.append(key)
+        return number
+
+    def item_number(self, item_id):
+        return self._intern(self.item_index, self.items, item_id)
+
+    def add_shop(self, categories_data):
+        """登记商店的分类及其物品"""
+        for cat in categories_data:
+            numbers = [self.item_number(item['id']) for item in cat['items']]
+            bits = _bitset(numbers)
+            self.categories.append((cat['title'], bits))
+            self.shop_bits |= bits
+            self.vanilla_bits |= _bitset(n for n in numbers if self.items[n].split(':')[0] == 'minecraft')
+
+    def add_pack(self, name, directory, mods, items, remaps=ITEM_ID_REMAPS):
+        """登记一个整合包：mods 为 get_installed_mods 的结果，items 为可用物品集合"""
+        numbers = [self.item_number(item_id) for item_id in items]
+        # 与 classify_items 一致：旧 ID 能替换为存在的物品时也算存在
+        for old_id, new_id in remaps.items():
+            if new_id.split(':')[0] == 'minecraft' or new_id in items:
+                numbers.append(self.item_number(old_id))
+        self.packs.append((name, directory))
+        self.mod_bits.append(_bitset(self._intern(self.mod_index, self.mods, mod_id) for mod_id in mods))
+        self.item_bits.append(_bitset(numbers))
+
+    def survival(self, pack):
+        """商店物品在第 pack 个整合包中仍存在的位集"""
+        return (self.item_bits[pack] | self.vanilla_bits) & self.shop_bits
+
+    def names(self, bits, table):
+        return [table[number] for number in _iter_bits(bits)]
+
+    def pair_stats(self):
+        """所有整合包两两对比，返回 [{...}]；lost_* 为商店物品换包后缺失的物品 ID"""
+        alive = [self.survival(pack) for pack in range(len(self.packs))]
+        pairs = []
+        for a, b in itertools.combinations(range(len(self.packs)), 2):
+            mods_a, mods_b = self.mod_bits[a], self.mod_bits[b]
+            items_a, items_b = self.item_bits[a], self.item_bits[b]
+            pairs.append({
+                "a": self.packs[a][0],
+                "b": self.packs[b][0],
+                "common_mods": _bit_count(mods_a & mods_b),
+                "only_a_mods": _bit_count(mods_a & ~mods_b),
+                "only_b_mods": _bit_count(mods_b & ~mods_a),
+                "common_items": _bit_count(items_a & items_b),
+                "only_a_items": _bit_count(items_a & ~items_b),
+                "only_b_items": _bit_count(items_b & ~items_a),
+                "shop_common": _bit_count(alive[a] & alive[b]),
+                "lost_a_to_b": self.names(alive[a] & ~alive[b], self.items),
+                "lost_b_to_a": self.names(alive[b] & ~alive[a], self.items),
+            })
+        return pairs
+
+    def category_survival(self):
+        """各分类在各整合包中的存活率，返回 [(标题, 物品数, [存活数, ...])]"""
+        alive = [self.survival(pack) for pack in range(len(self.packs))]
+        return [(title, _bit_count(bits), [_bit_count(bits & pack_alive) for pack_alive in alive])
+                for title, bits in self.categories]
+
+
+def _rate(part, total):
+    return f"{part / total * 100:.1f}%" if total else "-"
+
+
+def build_pack_matrix(pack_dirs, snbt_file=None, cache=None, parallel_stages="thread", log=None, use_manifest=False,
+                      scan_instance=True):
+    """扫描多个整合包（并发），返回 PackMatrix；提供 snbt_file 时同时登记商店物品"""
+    log = log or logger
+    cache = cache if cache is not None else ScanCache()
+    mods_dirs = [find_mods_folder(pack_dir) for pack_dir in pack_dirs]
+
+    scheduler = StageScheduler(parallel_stages)
+    stage_ids = {}
+    for mods_dir in mods_dirs:
+        if mods_dir in stage_ids or (mods_dir in cache.mods and mods_dir in cache.items):
+            continue
+        stage = stage_ids[mods_dir] = len(stage_ids)
+        scheduler.add(f"mods{stage}", get_installed_mods, mods_dir, use_manifest, label="扫描模组目录")
+        scheduler.add(f"items{stage}", scan_all_items_from_mods, mods_dir, deps=[f"mods{stage}"],
+                      label="扫描模组中的物品")
+    if snbt_file:
+        scheduler.add("categories", parse_snbt_by_category, snbt_file, label="解析SNBT")
+    if scan_instance:
+        for mods_dir in dict.fromkeys(mods_dirs):
+            scheduler.add(f"instance:{mods_dir}", discover_instance_items, get_pack_root(mods_dir),
+                          label="扫描整合包中的脚本与数据包")
+    log.info(f"扫描 {len(pack_dirs)} 个整合包...")
+    computed = scheduler.run()
+    for mods_dir, stage in stage_ids.items():
+        cache.mods[mods_dir] = (computed[f"mods{stage}"], time.time())
+        cache.items[mods_dir] = (*computed[f"items{stage}"], time.time())
+
+    matrix = PackMatrix()
+    if snbt_file:
+        matrix.add_shop(computed["categories"])
+    used_names = set()
+    for pack_dir, mods_dir in zip(pack_dirs, mods_dirs):
+        name = os.path.basename(os.path.normpath(pack_dir)) or pack_dir
+        if name in used_names:
+            name = pack_dir
+        used_names.add(name)
+        mods = cache.mods[mods_dir][0]
+        available_items = cache.items[mods_dir][0] | computed.get(f"instance:{mods_dir}", set())
+        matrix.add_pack(name, mods_dir, mods, available_items)
+        log.info(f"   {name}: {len(mods)} 个模组/库, {len(available_items)} 个物品")
+    return matrix
+
+
+def save_pack_matrix(matrix, report_dir="3.报告"):
+    """保存多整合包对比结果：整合包矩阵.txt 供阅读，整合包矩阵.json 含缺失物品明细"""
+    pairs = matrix.pair_stats()
+    categories = matrix.category_survival()
+    shop_total = _bit_count(matrix.shop_bits)
+    survived = [_bit_count(matrix.survival(pack)) for pack in range(len(matrix.packs))]
+
+    text_file = os.path.join(report_dir, "整合包矩阵.txt")
+    with open(text_file, 'w', encoding='utf-8') as f:
+        f.write("整合包对比矩阵\n")
+        f.write("-"*50 + "\n")
+        f.write(f"生成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        f.write(f"整合包: {len(matrix.packs)} 个, 模组 {len(matrix.mods)} 种, 物品 {len(matrix.items)} 种\n")
+        if matrix.categories:
+            f.write(f"商店: {len(matrix.categories)} 个分类, {shop_total} 种物品\n")
+        f.write("-"*50 + "\n\n")
+
+        f.write("【整合包】\n")
+        for pack, (name, directory) in enumerate(matrix.packs):
+            f.write(f"[{pack + 1}] {name}: {_bit_count(matrix.mod_bits[pack])} 个模组/库, "
+                    f"{_bit_count(matrix.item_bits[pack])} 个物品")
+            if matrix.categories:
+                f.write(f", 商店物品存活 {survived[pack]}/{shop_total} ({_rate(survived[pack], shop_total)})")
+            f.write(f"\n    {directory}\n")
+        f.write("\n")
+
+        f.write("【两两对比】\n")
+        f.write("-"*50 + "\n")
+        for pair in pairs:
+            f.write(f"{pair['a']} ↔ {pair['b']}\n")
+            f.write(f"   模组: 共通 {pair['common_mods']}, 只在前者 {pair['only_a_mods']}, "
+                    f"只在后者 {pair['only_b_mods']}\n")
+            f.write(f"   物品: 共通 {pair['common_items']}, 只在前者 {pair['only_a_items']}, "
+                    f"只在后者 {pair['only_b_items']}\n")
+            if matrix.categories:
+                f.write(f"   商店物品: 两边都存在 {pair['shop_common']}, "
+                        f"换到后者缺失 {len(pair['lost_a_to_b'])}, 换到前者缺失 {len(pair['lost_b_to_a'])}\n")
+            f.write("\n")
+
+        if categories:
+            f.write("【各分类存活率】\n")
+            f.write("-"*50 + "\n")
+            f.write("分类\t物品数\t" + "\t".join(f"[{pack + 1}]" for pack in range(len(matrix.packs))) + "\n")
+            for title, total, counts in categories:
+                f.write(f"{title}\t{total}\t" + "\t".join(_rate(count, total) for count in counts) + "\n")
+
+    json_file = os.path.join(report_dir, "整合包矩阵.json")
+    with open(json_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            "packs": [{"name": name, "mods_dir": directory,
+                       "mods": _bit_count(matrix.mod_bits[pack]), "items": _bit_count(matrix.item_bits[pack]),
+                       "shop_survived": survived[pack], "shop_total": shop_total}
+                      for pack, (name, directory) in enumerate(matrix.packs)],
+            "pairs": pairs,
+            "categories": [{"title": title, "items": total, "survived": counts}
+                           for title, total, counts in categories],
+        }, f, ensure_ascii=False, indent=2)
+
+    return text_file, json_file
+
+
+# ==================== 转换服务 ====================
+
+class ConversionService:
+    """转换服务的共享状态：已登记的整合包、所有请求共用的扫描缓存、有界的转换线程池
+
+    排队中和执行中的请求总数达到 workers + queue_size 时，新请求直接被拒绝（准入控制）。
+    整合包的 mods 目录在每次转换前按 jar 的大小与修改时间核对，变化时才丢弃该目录的缓存。
+    """
+
+    def __init__(self, packs, workers=2, queue_size=8):
+        self.packs = packs  # {整合包 ID: 整合包目录}
+        self.cache = ScanCache()
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="convert")
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.signatures = {}  # {mods 目录: 上次核对时的 jar 签名}
+        self.stats = {"accepted": 0, "rejected": 0, "completed": 0, "failed": 0}
+        self.request_ids = itertools.count(1)
+
+    def try_admit(self):
+        """为一个请求占一个名额；排队已满时返回 False"""
+        with self.lock:
+            if self.pending >= self.capacity:
+                self.stats["rejected"] += 1
+                return False
+            self.pending += 1
+            self.stats["accepted"] += 1
+            return True
+
+    def submit(self, snbt_bytes, target, source=None):
+        """提交一次转换（调用前须 try_admit 成功），返回 Future，结果为 (zip 字节, ConversionResult)"""
+        try:
+            future = self.pool.submit(self._convert, next(self.request_ids), snbt_bytes,
+                                      self.packs[target], self.packs[source or target])
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def release_slot(self):
+        """归还 try_admit 占用但没有提交转换的名额"""
+        self._release(None)
+
+    def _release(self, future):
+        with self.lock:
+            self.pending -= 1
+            if future is not None:
+                self.stats["failed" if future.exception() else "completed"] += 1
+
+    def status(self):
+        with self.lock:
+            return {"packs": sorted(self.packs), "workers": self.workers, "capacity": self.capacity,
+                    "pending": self.pending, **self.stats}
+
+    def refresh_pack(self, pack_dir):
+        """jar 有增删或修改时丢弃该整合包的扫描缓存"""
+        mods_dir = find_mods_folder(pack_dir)
+        signature = _mods_dir_signature(mods_dir)
+        with self.lock:
+            if self.signatures.get(mods_dir) != signature:
+                self.cache.mods.pop(mods_dir, None)
+                self.cache.items.pop(mods_dir, None)
+                self.signatures[mods_dir] = signature
+
+    def _convert(self, request_id, snbt_bytes, target_dir, source_dir):
+        """工作线程：在临时目录中转换一次，返回打包好的输出与报告"""
+        workdir = tempfile.mkdtemp(prefix="shop_toolkit_serve_")
+        output_dir = os.path.join(workdir, "out")
+        snbt_file = os.path.join(workdir, "sdmshop.snbt")
+        # 每个请求的日志单独写入它自己的 3.报告/转换日志.log，不混入服务的控制台输出
+        log = logging.Logger(f"{logger.name}.请求{request_id}", logger.getEffectiveLevel())
+        ensure_directories(output_dir)
+        handler = logging.FileHandler(os.path.join(output_dir, "3.报告", "转换日志.log"), encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        handler.setLevel(log.level)  # 从 logger 改写过来的记录不再经过 log 的级别判断
+        log.addHandler(handler)
+        try:
+            with open(snbt_file, 'wb') as f:
+                f.write(snbt_bytes)
+            for pack_dir in {source_dir, target_dir}:
+                self.refresh_pack(pack_dir)
+            options = ConversionOptions(source_dir=source_dir, target_dir=target_dir, snbt_file=snbt_file,
+                                        output_dir=output_dir, checkpoints=False, parallel_encode=False)
+            with activate_request_log(log):
+                result = run_sdm_conversion(options, self.cache, log)
+            log.info(f"请求 {request_id}: {result.category_count} 个分类, {result.item_count} 个物品, "
+                     f"耗时 {result.elapsed:.2f} 秒")
+            handler.flush()
+            return pack_conversion_outputs(output_dir), result
+        finally:
+            handler.close()
+            self.cache.categories.pop(snbt_file, None)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+
+def pack_conversion_outputs(output_dir):
+    """把 2.输出 与 3.报告 打包为 zip 字节，条目路径相对于输出目录"""
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as z:
+        for folder in ("2.输出", "3.报告"):
+            for root, _, files in os.walk(os.path.join(output_dir, folder)):
+                for name in sorted(files):
+                    path = os.path.join(root, name)
+                    z.write(path, os.path.relpath(path, output_dir).replace(os.sep, "/"))
+    return buffer.getvalue()
+
+
+def make_conversion_server(service, host="127.0.0.1", port=8765, max_upload=64 * 1024 * 1024, max_connections=None):
+    """创建转换服务的 HTTP 服务器（标准库 http.server，每个连接一个线程，转换在 service 的线程池中执行）
+
+    同时处理的连接数不超过 max_connections（默认为排队上限加 4），只有占到转换名额的请求才读入上传内容。
+
+    POST /convert?pack=<整合包 ID>[&source=<整合包 ID>]  请求体为 sdmshop.snbt，返回包含 .shopproj 与报告的 zip
+    GET /packs   已登记的整合包
+    GET /status  排队与完成情况
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlsplit
+
+    class ConversionRequestHandler(BaseHTTPRequestHandler):
+        server_version = f"ShopToolkit/{TOOL_VERSION}"
+        timeout = 60  # 读写超时，慢速上传不会一直占着连接
+
+        def do_GET(self):
+            path = urlsplit(self.path).path
+            if path == "/packs":
+                self._send_json(200, {"packs": sorted(service.packs)})
+            elif path == "/status":
+                self._send_json(200, service.status())
+            else:
+                self._send_json(404, {"error": f"未知的路径: {path}"})
+
+        def do_POST(self):
+            url = urlsplit(self.path)
+            if url.path != "/convert":
+                self._send_json(404, {"error": f"未知的路径: {url.path}"})
+                return
+            query = parse_qs(url.query)
+            target = query.get("pack", [None])[0]
+            source = query.get("source", [target])[0]
+            unknown = [pack for pack in (target, source) if pack not in service.packs]
+            if unknown:
+                self._send_json(404, {"error": f"未登记的整合包: {unknown[0]}", "packs": sorted(service.packs)})
+                return
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+            except ValueError:
+                length = 0
+            if length <= 0:
+                self._send_json(400, {"error": "请求体应为 sdmshop.snbt 的内容"})
+                return
+            if length > max_upload:
+                self._send_json(413, {"error": f"上传的文件超过 {max_upload} 字节"})
+                return
+            # 先占名额再读请求体：排队已满时不读入上传内容，被拒绝的请求不占内存
+            if not service.try_admit():
+                self.close_connection = True
+                self._send_json(503, {"error": "转换队列已满，请稍后重试"}, {"Retry-After": "5"})
+                return
+            try:
+                body = self.rfile.read(length)
+            except OSError:
+                body = b''
+            if len(body) < length:
+                service.release_slot()
+                self.close_connection = True
+                self._send_json(400, {"error": "请求体不完整"})
+                return
+            try:
+                archive, result = service.submit(body, target, source).result()
+            except (ValueError, OSError) as e:
+                self._send_json(422, {"error": f"转换失败: {e}"})
+                return
+            except Exception as e:
+                logger.exception("转换服务出错")
+                self._send_json(500, {"error": f"转换服务出错: {e}"})
+                return
+            self._send(200, archive, "application/zip", {
+                "Content-Disposition": 'attachment; filename="shopproj.zip"',
+                "X-Category-Count": str(result.category_count),
+                "X-Item-Count": str(result.item_count),
+                "X-Missing-Items": str(result.total_missing),
+                "X-Validation-Errors": str(len(result.validation_errors)),
+            })
+
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self._send(status, body, "application/json; charset=utf-8", headers)
+
+        def _send(self, status, body, content_type, headers=None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("%s %s", self.address_string(), format % args)
+
+    class ConversionHTTPServer(ThreadingHTTPServer):
+        """每个连接一个线程，同时处理的连接数有上限；超出的连接留在监听队列中等待"""
+
+        def __init__(self, address, handler_class, max_connections):
+            super().__init__(address, handler_class)
+            self.connection_slots = threading.BoundedSemaphore(max_connections)
+
+        def process_request(self, request, client_address):
+            self.connection_slots.acquire()
+            try:
+                super().process_request(request, client_address)
+            except BaseException:
+                self.connection_slots.release()
+                raise
+
+        def process_request_thread(self, request, client_address):
+            try:
+                super().process_request_thread(request, client_address)
+            finally:
+                self.connection_slots.release()
+
+    # 排队和执行中的请求各占一个连接，另留几个给 /status 查询和 503 回复
+    max_connections = max_connections or service.capacity + 4
+    return ConversionHTTPServer((host, port), ConversionRequestHandler, max_connections)
+
+
+# ==================== GUI 界面 ====================
+
+class TextLogHandler(logging.Handler):
+    """批量刷新到 Text 控件的日志处理器
+
+    日志行先进入队列，按固定帧率合并成一次 insert/see，
+    控件中只保留最后 max_lines 行，完整日志由文件处理器保存。
+    """
+
+    def __init__(self, root, text_widget, max_lines=2000, fps=20):
+        super().__init__()
+        self.root = root
+        self.text_widget = text_widget
+        self.max_lines = max_lines
+        self.interval = 1.0 / fps
+        self.pending = deque()
+        self.last_flush = 0.0
+        self.main_thread = threading.get_ident()
+
+    def emit(self, record):
+        try:
+            self.pending.append(record.getMessage())
+        except Exception:
+            self.handleError(record)
+            return
+
+        # 在主线程中同步转换时，按帧率刷新一次并让界面响应
+        if threading.get_ident() == self.main_thread:
+            now = time.monotonic()
+            if now - self.last_flush >= self.interval:
+                self.flush_pending()
+                self.root.update()
+
+    def flush_pending(self):
+        """把队列中的日志一次性写入控件，并裁剪到最后 max_lines 行"""
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+
+        lines = []
+        while self.pending:
+            lines.append(self.pending.popleft())
+
+        self.text_widget.insert(tk.END, "\n".join(lines) + "\n")
+        line_count = int(self.text_widget.index("end-1c").split(".")[0]) - 1
+        if line_count > self.max_lines:
+            self.text_widget.delete("1.0", f"{line_count - self.max_lines + 1}.0")
+        self.text_widget.see(tk.END)
+
+    def start(self):
+        """定时刷新队列（供后台线程写日志时使用）"""
+        self.flush_pending()
+        self.root.after(int(self.interval * 1000), self.start)
+
+    def clear(self):
+        self.pending.clear()
+        self.text_widget.delete(1.0, tk.END)
+
+
+class ViScriptShopToolkitGUI:
+    """ViScript Shop 工具箱 GUI 界面"""
+    
+    def __init__(self, root):
+        _import_tkinter()
+        self.root = root
+        self.root.title("SDM 商店转 ViScriptShop 工具")
+        self.root.geometry("800x600")
+        self.root.resizable(True, True)
+        
+        # 确保文件夹结构存在
+        ensure_directories()
+        
+        # 全局缓存变量
+        self.DIR_CACHE = {}
+        self.scan_cache = ScanCache()
+        
+        # 后台转换线程
+        self.worker = None
+        self.worker_outcome = None
+        self.watch_stop = None  # 监视模式运行时为停止事件
+        
+        # 创建主框架
+        self.main_frame = ttk.Frame(self.root, padding="10")
+        self.main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        # 创建 SDM 转 ViScriptShop 界面
+        self.create_sdm_interface()
+        
+        # 日志：控件只显示最后若干行，完整日志写入 3.报告/转换日志.log
+        self.log_handler = TextLogHandler(self.root, self.sdm_log_text)
+        logger.addHandler(self.log_handler)
+        setup_file_logging()
+        set_log_level(self.verbose_log_var.get())
+        self.log_handler.start()
+        
+    def create_sdm_interface(self):
+        """创建 SDM 商店转 ViScriptShop 界面"""
+        # 创建原模组目录选择
+        source_frame = ttk.LabelFrame(self.main_frame, text="原整合包目录", padding="10")
+        source_frame.pack(fill=tk.X, pady=5)
+        
+        self.source_dir_var = tk.StringVar()
+        source_entry = ttk.Entry(source_frame, textvariable=self.source_dir_var, width=60)
+        source_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        
+        source_button = ttk.Button(source_frame, text="浏览", command=self.browse_source_dir)
+        source_button.pack(side=tk.RIGHT, padx=5)
+        
+        # 创建目标模组目录选择
         target_frame = ttk.LabelFrame(self.main_frame, text="目标整合包目录", padding="10")
         target_frame.pack(fill=tk.X, pady=5)
         
@@ -1464,8 +4969,18 @@ class ViScriptShopToolkitGUI:
         button_frame = ttk.Frame(self.main_frame)
         button_frame.pack(fill=tk.X, pady=10)
         
-        execute_button = ttk.Button(button_frame, text="开始转换", command=self.execute_sdm_conversion)
-        execute_button.pack(side=tk.LEFT, padx=5)
+        self.execute_button = ttk.Button(button_frame, text="开始转换", command=self.execute_sdm_conversion)
+        self.execute_button.pack(side=tk.LEFT, padx=5)
+        
+        self.watch_button = ttk.Button(button_frame, text="开始监视", command=self.toggle_watch)
+        self.watch_button.pack(side=tk.LEFT, padx=5)
+        
+        self.verbose_log_var = tk.BooleanVar(value=True)
+        verbose_check = ttk.Checkbutton(
+            button_frame, text="详细日志", variable=self.verbose_log_var,
+            command=lambda: set_log_level(self.verbose_log_var.get())
+        )
+        verbose_check.pack(side=tk.LEFT, padx=5)
         
         # 创建日志文本框
         log_frame = ttk.LabelFrame(self.main_frame, text="转换日志", padding="10")
@@ -1494,383 +5009,398 @@ class ViScriptShopToolkitGUI:
         if dir_path:
             self.target_dir_var.set(dir_path)
     
-    def execute_sdm_conversion(self):
-        """执行 SDM 商店转 ViScriptShop 转换"""
-        import time
-        
+    def _conversion_options(self):
+        """检查界面输入，返回 ConversionOptions；输入有误时弹出提示并返回 None"""
         # 获取目录路径
         source_base_dir = self.source_dir_var.get()
         target_base_dir = self.target_dir_var.get()
         
         if not source_base_dir:
             messagebox.showerror("错误", "请选择原整合包目录")
-            return
+            return None
         
         if not target_base_dir:
             messagebox.showerror("错误", "请选择目标整合包目录")
+            return None
+        
+        # 确保 sdmshop.snbt 文件存在
+        snbt_file = "sdmshop.snbt"
+        if not os.path.exists(snbt_file):
+            messagebox.showerror("错误", f"找不到 sdmshop.snbt 文件，请确保该文件在当前目录")
+            return None
+        
+        # 保存到缓存
+        self.DIR_CACHE['source_dir'] = find_mods_folder(source_base_dir)
+        self.DIR_CACHE['target_dir'] = find_mods_folder(target_base_dir)
+        
+        return ConversionOptions(source_dir=source_base_dir, target_dir=target_base_dir, snbt_file=snbt_file)
+    
+    def execute_sdm_conversion(self):
+        """执行 SDM 商店转 ViScriptShop 转换（在后台线程中运行，界面保持响应）"""
+        if self.worker is not None and self.worker.is_alive():
+            messagebox.showinfo("提示", "转换正在进行中，请稍候")
             return
         
-        # 自动寻找 mods 文件夹
-        def find_mods_folder(base_dir):
-            mods_path = os.path.join(base_dir, "mods")
-            if os.path.exists(mods_path) and os.path.isdir(mods_path):
-                return mods_path
-            return base_dir
+        options = self._conversion_options()
+        if options is None:
+            return
         
-        source_dir = find_mods_folder(source_base_dir)
-        target_dir = find_mods_folder(target_base_dir)
+        # 清空日志
+        self.log_handler.clear()
         
-        # 保存到缓存
-        self.DIR_CACHE['source_dir'] = source_dir
-        self.DIR_CACHE['target_dir'] = target_dir
+        self.worker_outcome = None
+        self.worker = threading.Thread(target=self._conversion_worker, args=(options,), daemon=True)
+        self.execute_button.config(state=tk.DISABLED)
+        self.watch_button.config(state=tk.DISABLED)
+        self.worker.start()
+        self.root.after(100, self._poll_conversion)
+    
+    def toggle_watch(self):
+        """开始/停止监视模式：sdmshop.snbt 或 mods 目录变化时在后台自动重新转换"""
+        if self.watch_stop is not None:
+            self.watch_stop.set()
+            self.watch_button.config(text="正在停止...", state=tk.DISABLED)
+            return
+        if self.worker is not None and self.worker.is_alive():
+            messagebox.showinfo("提示", "转换正在进行中，请稍候")
+            return
+        
+        options = self._conversion_options()
+        if options is None:
+            return
         
+        self.log_handler.clear()
+        self.watch_stop = threading.Event()
+        self.worker = threading.Thread(target=self._watch_worker, args=(options, self.watch_stop), daemon=True)
+        self.execute_button.config(state=tk.DISABLED)
+        self.watch_button.config(text="停止监视")
+        self.worker.start()
+        self.root.after(200, self._poll_watch)
+    
+    def _watch_worker(self, options, stop_event):
+        """后台线程：运行监视模式直到停止"""
         try:
-            # 清空日志
-            self.sdm_log_text.delete(1.0, tk.END)
-            
-            # 确保 sdmshop.snbt 文件存在
-            snbt_file = "sdmshop.snbt"
-            if not os.path.exists(snbt_file):
-                messagebox.showerror("错误", f"找不到 sdmshop.snbt 文件，请确保该文件在当前目录")
-                return
-            
-            # 开始转换过程
-            self.sdm_log_text.insert(tk.END, "开始执行 SDM 商店转 ViScriptShop 转换...\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            self.sdm_log_text.insert(tk.END, f"原模组目录: {source_dir}\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            self.sdm_log_text.insert(tk.END, f"目标模组目录: {target_dir}\n\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            
-            # 1. 扫描原模组目录
-            self.sdm_log_text.insert(tk.END, "1. 扫描原模组目录...\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            if source_dir in self.MODS_CACHE:
-                source_mods = self.MODS_CACHE[source_dir][0]
-                self.sdm_log_text.insert(tk.END, f"   使用缓存的扫描结果: {len(source_mods)} 个模组/库\n")
-                self.sdm_log_text.see(tk.END)
-                self.root.update()
-            else:
-                source_mods = get_installed_mods(source_dir)
-                self.MODS_CACHE[source_dir] = (source_mods, time.time())
-                self.sdm_log_text.insert(tk.END, f"   原模组目录发现 {len(source_mods)} 个模组/库\n")
-                self.sdm_log_text.see(tk.END)
-                self.root.update()
-            
-            # 2. 扫描目标模组目录
-            self.sdm_log_text.insert(tk.END, "\n2. 扫描目标模组目录...\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            if target_dir in self.MODS_CACHE:
-                target_mods = self.MODS_CACHE[target_dir][0]
-                self.sdm_log_text.insert(tk.END, f"   使用缓存的扫描结果: {len(target_mods)} 个模组/库\n")
-                self.sdm_log_text.see(tk.END)
-                self.root.update()
-            else:
-                target_mods = get_installed_mods(target_dir)
-                self.MODS_CACHE[target_dir] = (target_mods, time.time())
-                self.sdm_log_text.insert(tk.END, f"   目标目录发现 {len(target_mods)} 个模组/库\n")
-                self.sdm_log_text.see(tk.END)
-                self.root.update()
-            
-            # 3. 对比模组目录
-            self.sdm_log_text.insert(tk.END, "\n3. 对比模组目录...\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            comparison_file, both_have, only_source, only_target, author_mismatches = save_mod_comparison(
-                source_mods, target_mods, source_dir, target_dir
-            )
-            self.sdm_log_text.insert(tk.END, f"   模组对比已保存: {comparison_file}\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            self.sdm_log_text.insert(tk.END, f"   ✅ 两边都有: {len(both_have)} 个\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            self.sdm_log_text.insert(tk.END, f"   ⚠️  只有原模组有: {len(only_source)} 个\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            self.sdm_log_text.insert(tk.END, f"   ❓ 只有目标有: {len(only_target)} 个\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            
-            # 4. 扫描目标模组中的物品
-            self.sdm_log_text.insert(tk.END, "\n4. 扫描目标模组中的物品...\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            if target_dir in self.ITEMS_CACHE:
-                available_items, mod_items_map = self.ITEMS_CACHE[target_dir][0], self.ITEMS_CACHE[target_dir][1]
-                self.sdm_log_text.insert(tk.END, f"   使用缓存的扫描结果: {len(available_items)} 个可用物品\n")
-                self.sdm_log_text.see(tk.END)
-                self.root.update()
-            else:
-                available_items, mod_items_map = scan_all_items_from_mods(target_dir, target_mods)
-                self.ITEMS_CACHE[target_dir] = (available_items, mod_items_map, time.time())
-                self.sdm_log_text.insert(tk.END, f"   扫描到 {len(available_items)} 个可用物品\n")
-                self.sdm_log_text.see(tk.END)
-                self.root.update()
-            
-            # 5. 解析 sdmshop.snbt
-            self.sdm_log_text.insert(tk.END, "\n5. 解析 sdmshop.snbt...\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            categories_data = parse_snbt_by_category("sdmshop.snbt")
-            self.sdm_log_text.insert(tk.END, f"   发现 {len(categories_data)} 个原有分类\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            
-            # 6. 检查物品存在性
-            self.sdm_log_text.insert(tk.END, "\n6. 检查物品存在性...\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            filtered_categories = []
-            total_existing = 0
-            total_missing = 0
-            missing_items_by_category = {}
-            
-            # 获取可用的模组 ID 列表
-            available_mods_set = set(target_mods.keys())
-            
-            for cat in categories_data:
-                title = cat['title']
-                icon = cat['icon']
-                items = cat['items']
-                
-                # 检查图标模组是否存在
-                icon_mod_id = icon.split(':')[0]
-                if icon_mod_id not in available_mods_set:
-                    # 图标模组不存在，替换为屏障方块
-                    icon = "minecraft:barrier"
-                
-                existing_items = []
-                missing_items = []
-                
-                for item in items:
-                    # 检查是否为原版物品
-                    item_mod_id = item['id'].split(':')[0]
-                    if item_mod_id == 'minecraft' or item['id'] in available_items:
-                        existing_items.append(item)
-                        total_existing += 1
-                    else:
-                        missing_items.append(item)
-                        total_missing += 1
-                
-                # 保存缺失物品信息
-                missing_items_by_category[title] = missing_items
-                
-                if existing_items:
-                    filtered_categories.append({
-                        'title': title,
-                        'icon': icon,
-                        'items': existing_items
-                    })
-            
-            # 显示分类状态
-            self.sdm_log_text.insert(tk.END, "   分类状态:\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            for idx, cat in enumerate(filtered_categories, 1):
-                title = cat['title']
-                existing_count = len(cat['items'])
-                
-                # 找到对应的原始分类，计算缺失数量
-                original_cat = next((c for c in categories_data if c['title'] == title), None)
-                missing_count = 0
-                if original_cat:
-                    missing_count = len([item for item in original_cat['items'] if item['id'] not in available_items])
-                
-                if missing_count > 0:
-                    self.sdm_log_text.insert(tk.END, f"      {idx}. {title}: {existing_count}个可用, {missing_count}个缺失 (图标: {cat['icon']})\n")
-                    self.sdm_log_text.see(tk.END)
-                    self.root.update()
-                else:
-                    self.sdm_log_text.insert(tk.END, f"      {idx}. {title}: {existing_count}个可用, 0个缺失 (图标: {cat['icon']})\n")
-                    self.sdm_log_text.see(tk.END)
-                    self.root.update()
-            
-            self.sdm_log_text.insert(tk.END, f"   ✅ 存在的物品: {total_existing} 个\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            if total_missing > 0:
-                self.sdm_log_text.insert(tk.END, f"   ⚠️  排除缺失物品: {total_missing} 个 (这些物品在目标模组中不存在)\n")
-                self.sdm_log_text.see(tk.END)
-                self.root.update()
-            
-            # 7. 构建商店
-            self.sdm_log_text.insert(tk.END, "\n7. 构建商店...\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            categories = []
-            
-            for cat in filtered_categories:
-                title = cat['title']
-                icon = cat['icon']
-                items = cat['items'][:30]  # 每个分类最多30个物品
-                
-                merchants = [create_shopproj_item(item) for item in items]
-                
-                categories.append(create_category(title, icon, merchants))
-                self.sdm_log_text.insert(tk.END, f"   ✓ 添加 {title} 分类 ({len(merchants)} 个物品)\n")
-                self.sdm_log_text.see(tk.END)
-                self.root.update()
-            
-            # 8. 生成配置文件
-            self.sdm_log_text.insert(tk.END, "\n8. 生成配置文件...\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            shopproj = {
-                "_root_name": "",
-                "_root_type": "compound",
-                "data": {
-                    "_type": "compound",
-                    "meta": {
-                        "_type": "compound",
-                        "version_num": {"_type": "int", "_value": 1},
-                        "suffix": {"_type": "string", "_value": ".shopproj"},
-                        "version": {"_type": "string", "_value": "1.0"},
-                        "name": {"_type": "string", "_value": "商店项目"}
-                    },
-                    "data": {
-                        "_type": "compound",
-                        "shop": {
-                            "_type": "compound",
-                            "lockedMerchantVisibility": {"_type": "string", "_value": "viscript_shop.data.shop.lockedItemVisibility.show_with_lock"},
-                            "isQuickOpening": {"_type": "byte", "_value": 0},
-                            "name": {"_type": "string", "_value": ""},
-                            "stage": {"_type": "int", "_value": 0},
-                            "categoryInfos": {
-                                "_type": "compound",
-                                "payload": {
-                                    "_type": "list",
-                                    "_element_type": "compound",
-                                    "_value": categories
-                                },
-                                "uid": {"_type": "int", "_value": len(categories)}
-                            }
-                        }
-                    }
-                }
-            }
-            
-            # 使用默认文件名，保存到过程文件夹
-            process_dir = get_process_dir()
-            json_file = os.path.join(process_dir, "extracted_shop_by_category.shopproj.json")
-            with open(json_file, 'w', encoding='utf-8') as f:
-                json.dump(shopproj, f, ensure_ascii=False, indent=2)
-            
-            self.sdm_log_text.insert(tk.END, f"   ✓ JSON 文件已保存: {json_file}\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            
-            # 9. 替换 minecraft:scute 为 minecraft:turtle_scute
-            self.sdm_log_text.insert(tk.END, "\n9. 检测并替换物品 ID...\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            
-            def replace_scute(obj):
-                """递归替换 minecraft:scute 为 minecraft:turtle_scute"""
-                if isinstance(obj, dict):
-                    for key, value in obj.items():
-                        if key == "_value" and value == "minecraft:scute":
-                            obj[key] = "minecraft:turtle_scute"
-                            self.sdm_log_text.insert(tk.END, "   ✓ 替换 minecraft:scute 为 minecraft:turtle_scute\n")
-                            self.sdm_log_text.see(tk.END)
-                            self.root.update()
-                        else:
-                            replace_scute(value)
-                elif isinstance(obj, list):
-                    for item in obj:
-                        replace_scute(item)
-            
-            # 加载 JSON 文件并替换
-            with open(json_file, 'r', encoding='utf-8') as f:
-                shopproj_data = json.load(f)
-            
-            replace_scute(shopproj_data)
-            
-            # 保存修改后的 JSON 文件
-            with open(json_file, 'w', encoding='utf-8') as f:
-                json.dump(shopproj_data, f, ensure_ascii=False, indent=2)
-            
-            self.sdm_log_text.insert(tk.END, "   ✓ 物品 ID 替换完成\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            
-            # 10. 自动转换为 NBT
-            self.sdm_log_text.insert(tk.END, "\n10. 转换为 NBT 格式...\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            nbt_file = os.path.join("2.输出", "extracted_shop_by_category.shopproj")
-            try:
-                json_to_nbt(json_file, nbt_file, compress=False)
-                self.sdm_log_text.insert(tk.END, f"   ✓ NBT 文件已生成: {nbt_file}\n")
-                self.sdm_log_text.see(tk.END)
-                self.root.update()
-            except Exception as e:
-                self.sdm_log_text.insert(tk.END, f"   ✗ 转换 NBT 失败: {e}\n")
-                self.sdm_log_text.see(tk.END)
-                self.root.update()
-                nbt_file = None
-            
-            # 保存缺失物品
-            missing_file = None
-            if total_missing > 0:
-                missing_file = save_missing_items(missing_items_by_category, total_missing)
-                self.sdm_log_text.insert(tk.END, f"   📄 缺失物品已保存: {missing_file}\n")
-                self.sdm_log_text.see(tk.END)
-                self.root.update()
-            
-            # 完成提示
-            self.sdm_log_text.insert(tk.END, "\n" + "="*70 + "\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            self.sdm_log_text.insert(tk.END, "✅ 完成！\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            self.sdm_log_text.insert(tk.END, f"   JSON 文件: {json_file}\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            if nbt_file:
-                self.sdm_log_text.insert(tk.END, f"   NBT 文件: {nbt_file}\n")
-                self.sdm_log_text.see(tk.END)
-                self.root.update()
-            self.sdm_log_text.insert(tk.END, f"   分类数: {len(categories)}\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            total_items = sum(len(c['merchants']['payload']['_value']) for c in categories)
-            self.sdm_log_text.insert(tk.END, f"   总物品数: {total_items}\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            self.sdm_log_text.insert(tk.END, f"   模组对比: {comparison_file}\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            if total_missing > 0:
-                self.sdm_log_text.insert(tk.END, f"   缺失物品: {missing_file}\n")
-                self.sdm_log_text.see(tk.END)
-                self.root.update()
-            self.sdm_log_text.insert(tk.END, "="*70 + "\n")
-            self.sdm_log_text.see(tk.END)
-            self.root.update()
-            
-            messagebox.showinfo("成功", "SDM 商店转 ViScriptShop 转换完成！")
-            
+            watch_conversion(options, self.scan_cache, stop_event=stop_event)
+        except Exception as e:
+            logger.exception(f"监视模式出错: {str(e)}")
+    
+    def _poll_watch(self):
+        """主线程轮询监视线程是否结束，结束后恢复按钮"""
+        if self.worker.is_alive():
+            self.root.after(200, self._poll_watch)
+            return
+        
+        self.log_handler.flush_pending()
+        self.watch_stop = None
+        self.execute_button.config(state=tk.NORMAL)
+        self.watch_button.config(text="开始监视", state=tk.NORMAL)
+    
+    def _conversion_worker(self, options):
+        """后台线程：执行转换并记录结果"""
+        try:
+            self.worker_outcome = ("ok", run_sdm_conversion(options, self.scan_cache))
         except Exception as e:
             error_msg = f"转换失败: {str(e)}"
-            self.sdm_log_text.insert(tk.END, error_msg + "\n")
-            import traceback
-            traceback.print_exc()
-            messagebox.showerror("错误", error_msg)
+            logger.exception(error_msg)
+            self.worker_outcome = ("error", error_msg)
+    
+    def _poll_conversion(self):
+        """主线程轮询后台转换是否结束，结束后弹出提示"""
+        if self.worker.is_alive():
+            self.root.after(100, self._poll_conversion)
+            return
+        
+        self.log_handler.flush_pending()
+        self.execute_button.config(state=tk.NORMAL)
+        self.watch_button.config(state=tk.NORMAL)
+        status, payload = self.worker_outcome
+        if status == "ok" and payload.validation_errors:
+            messagebox.showwarning("完成", f"转换完成，但生成的文件有 {len(payload.validation_errors)} 个结构问题，详见日志")
+        elif status == "ok":
+            messagebox.showinfo("成功", "SDM 商店转 ViScriptShop 转换完成！")
+        else:
+            messagebox.showerror("错误", payload)
+
+
+# ==================== 命令行 ====================
+
+def cli_convert(args):
+    """命令行：执行一次转换"""
+    options = ConversionOptions(
+        source_dir=args.source,
+        target_dir=args.target,
+        snbt_files=args.snbt,
+        merge_mode=args.merge_mode,
+        output_dir=args.output,
+        parallel_stages=args.stages,
+        checkpoints=not args.no_checkpoints,
+        perf_report=not args.no_perf_report,
+        profile=args.profile,
+        trace_memory=args.trace_memory,
+        category_mode=args.category_mode,
+        max_merchants=args.max_merchants,
+        max_category_bytes=args.max_category_bytes,
+        streaming=args.streaming,
+        incremental=args.incremental,
+        parallel_encode=not args.no_parallel_encode,
+        validate=not args.no_validate,
+        use_manifest=args.use_manifest,
+        nested_mods=args.nested_mods,
+        scan_instance=not args.no_instance_scan,
+        item_diff=args.item_diff,
+    )
+    logger.debug("冷启动耗时: %.1f ms", (time.perf_counter() - _STARTUP_TIME) * 1000)
+    if args.watch:
+        try:
+            watch_conversion(options, interval=args.watch_interval, debounce=args.debounce)
+        except KeyboardInterrupt:
+            logger.info("\n已停止监视")
+        return 0
+    try:
+        result = run_sdm_conversion(options)
+    except (ValueError, FileNotFoundError) as e:
+        logger.error(f"转换失败: {e}")
+        return 1
+    logger.info(f"总耗时: {result.elapsed:.2f} 秒")
+    return 0 if result.nbt_file and not result.validation_errors else 1
+
+
+def cli_reverse(args):
+    """命令行：.shopproj 转回 sdmshop.snbt"""
+    started = time.perf_counter()
+    try:
+        output_file, tab_count, entry_count = shopproj_to_snbt(args.input, args.output_file,
+                                                               merge_shards=not args.no_merge_shards)
+    except (OSError, ValueError) as e:
+        logger.error(f"转换失败: {e}")
+        return 1
+    logger.info(f"✅ 已生成 {output_file}: {tab_count} 个分类, {entry_count} 个条目 "
+                f"({time.perf_counter() - started:.2f} 秒)")
+    return 0
+
+
+def cli_query(args):
+    """命令行：在 NBT 文件上执行路径查询，输出 JSON Lines"""
+    try:
+        if args.output_file:
+            with open(args.output_file, 'w', encoding='utf-8') as f:
+                count = query_nbt_file(args.input, args.path, f, args.typed)
+        else:
+            count = query_nbt_file(args.input, args.path, sys.stdout, args.typed)
+    except BrokenPipeError:
+        # 输出被 head 等提前关闭
+        return 0
+    except (OSError, ValueError, struct.error, IndexError) as e:
+        logger.error(f"查询失败: {e}")
+        return 1
+    logger.info(f"命中 {count} 项")
+    return 0
+
+
+def cli_validate(args):
+    """命令行：校验 .shopproj 结构"""
+    try:
+        errors, error_count = validate_shopproj(args.input, args.max_errors)
+    except OSError as e:
+        logger.error(f"校验失败: {e}")
+        return 1
+    if not errors:
+        logger.info(f"✓ {args.input} 结构校验通过")
+        return 0
+    logger.warning(f"✗ {args.input} 发现 {error_count} 个结构问题:")
+    for message in errors:
+        logger.warning(f"   {message}")
+    return 1
+
+
+def cli_matrix(args):
+    """命令行：多整合包对比矩阵"""
+    if len(args.packs) < 2:
+        logger.error("至少需要两个整合包目录")
+        return 1
+    if args.snbt and not os.path.exists(args.snbt):
+        logger.error(f"找不到 {args.snbt} 文件")
+        return 1
+    started = time.perf_counter()
+    ensure_directories(args.output)
+    matrix = build_pack_matrix(args.packs, args.snbt, parallel_stages=args.stages, use_manifest=args.use_manifest,
+                               scan_instance=not args.no_instance_scan)
+    text_file, json_file = save_pack_matrix(matrix, os.path.join(args.output, "3.报告"))
+    logger.info(f"✅ 对比矩阵: {text_file}")
+    logger.info(f"   明细: {json_file}")
+    logger.info(f"总耗时: {time.perf_counter() - started:.2f} 秒")
+    return 0
+
+
+def cli_serve(args):
+    """命令行：启动本地转换服务"""
+    packs = {}
+    for spec in args.pack:
+        pack_id, sep, pack_dir = spec.partition("=")
+        if not sep:
+            pack_id, pack_dir = os.path.basename(os.path.normpath(spec)), spec
+        if not os.path.isdir(pack_dir):
+            logger.error(f"找不到整合包目录: {pack_dir}")
+            return 1
+        packs[pack_id] = pack_dir
+
+    service = ConversionService(packs, args.workers, args.queue)
+    try:
+        server = make_conversion_server(service, args.host, args.port, args.max_upload_mb * 1024 * 1024)
+    except OSError as e:
+        logger.error(f"无法监听 {args.host}:{args.port}: {e}")
+        return 1
+    logger.info(f"转换服务已启动: http://{args.host}:{server.server_address[1]}/")
+    logger.info(f"   整合包: {', '.join(f'{pack_id}={pack_dir}' for pack_id, pack_dir in packs.items())}")
+    logger.info(f"   转换线程 {args.workers} 个，最多排队 {args.queue} 个请求")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("\n正在停止转换服务...")
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
 
 
-def main():
-    """主函数"""
+def build_arg_parser():
+    """构建命令行参数解析器"""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="shop_toolkit_gui",
+        description="SDM 商店转 ViScriptShop 工具（不带参数时启动 GUI）",
+    )
+    parser.add_argument("--version", action="version", version=f"%(prog)s {__version__}")
+    subparsers = parser.add_subparsers(dest="command")
+
+    subparsers.add_parser("gui", help="启动图形界面（默认）")
+
+    convert = subparsers.add_parser("convert", help="无界面执行 SDM → ViScriptShop 转换")
+    convert.add_argument("-s", "--source", required=True, help="原整合包目录")
+    convert.add_argument("-t", "--target", required=True, help="目标整合包目录")
+    convert.add_argument("--snbt", nargs="+", default=["sdmshop.snbt"],
+                         help="SDM 商店文件，可以给出多个文件或通配符（如 'shops/*.snbt'），按分类标题合并 (默认: sdmshop.snbt)")
+    convert.add_argument("--merge-mode", choices=SNBT_MERGE_MODES, default="merge",
+                         help="多个 snbt 中同名分类: merge 合并商人 / first 保留先出现的 / last 保留后出现的 / "
+                              "rename 都保留并编号 (默认: merge)")
+    convert.add_argument("-o", "--output", default=".", help="输出根目录，生成 1.过程/2.输出/3.报告 (默认: 当前目录)")
+    convert.add_argument("--stages", choices=["thread", "process", "off"], default="thread",
+                         help="扫描/解析阶段的并发方式 (默认: thread)")
+    convert.add_argument("--no-checkpoints", action="store_true", help="忽略检查点，所有阶段重新计算")
+    convert.add_argument("--category-mode", choices=CATEGORY_MODES, default="shard",
+                         help="超出上限的分类: shard 拆分为编号子分类 / truncate 截断 / none 不限制 (默认: shard)")
+    convert.add_argument("--max-merchants", type=int, default=30, help="每个分类的商人数上限 (默认: 30，0 表示不限制)")
+    convert.add_argument("--max-category-bytes", type=int, default=0,
+                         help="每个子分类商人编码后的字节数上限 (默认: 0 不限制)")
+    convert.add_argument("--streaming", action="store_true",
+                         help="流式转换：逐个分类直接写入 NBT，不生成 JSON（适合超大商店）")
+    convert.add_argument("--incremental", action="store_true",
+                         help="增量写出：只重新编码有变化的分类，其余直接复制上次输出的字节（隐含 --streaming）")
+    convert.add_argument("--no-parallel-encode", action="store_true",
+                         help="大商店也只在当前进程中编码 NBT（默认按估计大小自动使用多个进程）")
+    convert.add_argument("--use-manifest", action="store_true",
+                         help="jar 元数据没有作者时用整合包清单中的作者补全（mod_id 仍取自 jar 元数据）")
+    convert.add_argument("--nested-mods", action="store_true",
+                         help="模组对比中也列出内嵌 jar 中的子模组（需要解压内嵌 jar，较慢；物品扫描总会包含内嵌 jar）")
+    convert.add_argument("--no-instance-scan", action="store_true",
+                         help="不扫描目标整合包的 kubejs/、datapacks/、global_packs/、resourcepacks/")
+    convert.add_argument("--item-diff", action="store_true",
+                         help="同时扫描原整合包的物品，写出 3.报告/物品差异.txt（缺失物品归因；原整合包的 jar 也要全部读取）")
+    convert.add_argument("--no-validate", action="store_true", help="转换后不校验生成的 .shopproj 结构")
+    convert.add_argument("--watch", action="store_true",
+                         help="监视模式：snbt 或 mods 目录变化时自动重新转换（Ctrl+C 退出）")
+    convert.add_argument("--watch-interval", type=float, default=0.5, help="监视模式的检查间隔秒数 (默认: 0.5)")
+    convert.add_argument("--debounce", type=float, default=0.3,
+                         help="监视模式中变化停止多少秒后才重新转换 (默认: 0.3)")
+    convert.add_argument("--no-perf-report", action="store_true", help="不写出 3.报告/性能.json")
+    convert.add_argument("--profile", action="store_true", help="保存 cProfile 数据到 3.报告/性能.prof")
+    convert.add_argument("--trace-memory", action="store_true", help="用 tracemalloc 统计内存峰值（较慢）")
+    convert.add_argument("-v", "--verbose", action="store_true", help="输出逐分类的详细日志和冷启动耗时")
+    convert.add_argument("-q", "--quiet", action="store_true", help="只输出警告和错误")
+    convert.set_defaults(func=cli_convert)
+
+    reverse = subparsers.add_parser("reverse", help="把 ViScriptShop .shopproj 转回 SDM sdmshop.snbt")
+    reverse.add_argument("input", help="ViScriptShop 商店项目文件 (.shopproj)")
+    reverse.add_argument("-o", "--output-file", default="sdmshop.snbt", help="输出的 snbt 文件 (默认: sdmshop.snbt)")
+    reverse.add_argument("--no-merge-shards", action="store_true",
+                         help="不合并转换时拆分出的「名称 (1)」「名称 (2)」… 子分类")
+    reverse.add_argument("-v", "--verbose", action="store_true", help="输出详细日志")
+    reverse.add_argument("-q", "--quiet", action="store_true", help="只输出警告和错误")
+    reverse.set_defaults(func=cli_reverse)
+
+    query = subparsers.add_parser("query", help="按路径查询 NBT 文件（如 .shopproj），输出 JSON Lines")
+    query.add_argument("input", help="NBT 文件")
+    query.add_argument("path", help="路径表达式，如 data.shop.categoryInfos.payload[*].name")
+    query.add_argument("-o", "--output-file", help="写入文件而不是标准输出")
+    query.add_argument("--typed", action="store_true", help="输出带 _type 标记的原始结构")
+    query.add_argument("-q", "--quiet", action="store_true", help="不输出命中数")
+    query.set_defaults(func=cli_query)
+
+    validate = subparsers.add_parser("validate", help="校验 .shopproj 是否符合 ViScriptShop 商店项目结构")
+    validate.add_argument("input", help="ViScriptShop 商店项目文件 (.shopproj)")
+    validate.add_argument("--max-errors", type=int, default=50, help="最多列出的问题数 (默认: 50)")
+    validate.set_defaults(func=cli_validate)
+
+    matrix = subparsers.add_parser("matrix", help="对比多个整合包的模组/物品，并统计商店物品在各整合包中的存活率")
+    matrix.add_argument("packs", nargs="+", help="整合包目录（两个或以上）")
+    matrix.add_argument("--snbt", help="SDM 商店文件，提供时统计商店物品存活率")
+    matrix.add_argument("-o", "--output", default=".", help="输出根目录，报告写入 3.报告 (默认: 当前目录)")
+    matrix.add_argument("--stages", choices=["thread", "process", "off"], default="thread",
+                        help="各整合包扫描的并发方式 (默认: thread)")
+    matrix.add_argument("--use-manifest", action="store_true",
+                        help="jar 元数据没有作者时用整合包清单 (minecraftinstance.json / modrinth.index.json / manifest.json) 中的作者补全")
+    matrix.add_argument("--no-instance-scan", action="store_true",
+                        help="不扫描各整合包的 kubejs/、datapacks/、global_packs/、resourcepacks/")
+    matrix.add_argument("-v", "--verbose", action="store_true", help="输出详细日志")
+    matrix.add_argument("-q", "--quiet", action="store_true", help="只输出警告和错误")
+    matrix.set_defaults(func=cli_matrix)
+
+    serve = subparsers.add_parser("serve", help="启动本地 HTTP 转换服务（上传 snbt，返回 .shopproj 与报告）")
+    serve.add_argument("--pack", action="append", required=True,
+                       help="登记整合包，格式为 ID=目录（省略 ID 时用目录名），可重复")
+    serve.add_argument("--host", default="127.0.0.1", help="监听地址 (默认: 127.0.0.1)")
+    serve.add_argument("--port", type=int, default=8765, help="监听端口 (默认: 8765)")
+    serve.add_argument("--workers", type=int, default=2, help="同时执行的转换数 (默认: 2)")
+    serve.add_argument("--queue", type=int, default=8, help="最多排队的请求数，超出时返回 503 (默认: 8)")
+    serve.add_argument("--max-upload-mb", type=int, default=64, help="上传 snbt 的大小上限 MB (默认: 64)")
+    serve.add_argument("-v", "--verbose", action="store_true", help="输出详细日志（包括每个 HTTP 请求）")
+    serve.add_argument("-q", "--quiet", action="store_true", help="只输出警告和错误")
+    serve.set_defaults(func=cli_serve)
+
+    return parser
+
+
+def setup_console_logging(args):
+    """命令行日志：输出到 stderr，并写入输出目录下的日志文件"""
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    if getattr(args, "quiet", False):
+        handler.setLevel(logging.WARNING)
+    set_log_level(getattr(args, "verbose", False))
+    if getattr(args, "output", None):
+        setup_file_logging(os.path.join(args.output, "3.报告"))
+
+
+def run_gui():
+    """启动 GUI"""
+    _import_tkinter()
     root = tk.Tk()
     app = ViScriptShopToolkitGUI(root)
     root.mainloop()
+    return 0
+
+
+def main(argv=None):
+    """主函数：不带子命令时启动 GUI，否则执行命令行功能"""
+    args = build_arg_parser().parse_args(argv)
+    if args.command in (None, "gui"):
+        return run_gui()
+
+    setup_console_logging(args)
+    return args.func(args)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
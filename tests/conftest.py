@@ -0,0 +1,55 @@
+"""测试公用的数据构造：直接导入仓库根目录下的 shop_toolkit_gui，生成小型商店数据"""
+import os
+import sys
+import zipfile
+from io import BytesIO
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shop_toolkit_gui as toolkit  # noqa: E402
+
+
+def make_item(item_id, count=1, price=10, is_sell=0):
+    return {"id": item_id, "count": count, "price": price, "is_sell": is_sell}
+
+
+def make_category(title, merchants=5, namespace="mod", price=10):
+    """一个 shopproj 分类，商人的物品、数量、价格和买卖方向各不相同"""
+    items = [make_item(f"{namespace}:item_{n}", count=n % 64 + 1, price=price + n, is_sell=n % 2)
+             for n in range(merchants)]
+    return toolkit.create_category(title, f"{namespace}:item_0", [toolkit.create_shopproj_item(i) for i in items])
+
+
+def reference_bytes(categories):
+    """用 NBTWriter 一次编码整个商店，作为其他写出方式的对照"""
+    shopproj = toolkit.build_shopproj(list(categories))
+    writer = toolkit.NBTWriter()
+    writer.write_root(shopproj["_root_name"], shopproj["data"])
+    return writer.get_bytes()
+
+
+def make_jar(path, files):
+    """写出一个 jar：files 为 {条目名: 内容}，内容为 dict 时作为内嵌 jar 的条目递归打包；返回路径"""
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as z:
+        for name, content in files.items():
+            if isinstance(content, dict):
+                content = make_jar(None, content)
+            z.writestr(name, content)
+    if path is None:
+        return buffer.getvalue()
+    with open(path, 'wb') as f:
+        f.write(buffer.getvalue())
+    return str(path)
+
+
+@pytest.fixture
+def shop_categories():
+    """几个大小不同的分类，含中文标题、空分类和 127 以上的数量"""
+    categories = [make_category(f"分类{n}", merchants=n * 7, namespace=f"mod{n}") for n in range(1, 5)]
+    categories.append(toolkit.create_category("空分类", "minecraft:barrier", []))
+    categories.append(toolkit.create_category("Big", "minecraft:stone",
+                                              [toolkit.create_shopproj_item(make_item("minecraft:stone", 1000, 2**31 - 1))]))
+    return categories
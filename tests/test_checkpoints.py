@@ -0,0 +1,44 @@
+from conftest import toolkit
+
+Store = toolkit.StageCheckpointStore
+
+
+def test_key_depends_on_stage_and_inputs():
+    assert Store.make_key("mods", "a") == Store.make_key("mods", "a")
+    assert Store.make_key("mods", "a") != Store.make_key("mods", "b")
+    assert Store.make_key("mods", "a") != Store.make_key("items", "a")
+
+
+def test_save_and_load_round_trip(tmp_path):
+    store = Store(str(tmp_path))
+    key = Store.make_key("items", "fp")
+    store.save("items", key, ({"a:b", "a:c"}, {"a": {"a:b", "a:c"}}))
+    assert store.load("items", key) == ({"a:b", "a:c"}, {"a": {"a:b", "a:c"}})
+    assert store.load("items", Store.make_key("items", "other")) is None
+
+
+def test_stage_version_bump_invalidates_checkpoint(tmp_path, monkeypatch):
+    store = Store(str(tmp_path))
+    key = Store.make_key("categories", "snbt-hash")
+    store.save("categories", key, [{"title": "A", "icon": "minecraft:stone", "items": []}])
+
+    monkeypatch.setitem(Store.STAGE_VERSIONS, "categories", Store.STAGE_VERSIONS["categories"] + 1)
+    new_key = Store.make_key("categories", "snbt-hash")
+    assert new_key != key
+    assert store.load("categories", new_key) is None
+
+
+def test_upstream_version_bump_invalidates_dependent_stage(monkeypatch):
+    shop_key = Store.make_key("shop", "inputs")
+    comparison_key = Store.make_key("comparison", "inputs")
+    monkeypatch.setitem(Store.STAGE_VERSIONS, "items", Store.STAGE_VERSIONS["items"] + 1)
+    # shop 依赖 items，comparison 不依赖
+    assert Store.make_key("shop", "inputs") != shop_key
+    assert Store.make_key("comparison", "inputs") == comparison_key
+
+
+def test_prune_keeps_latest(tmp_path):
+    store = Store(str(tmp_path), keep=2)
+    for n in range(4):
+        store.save("mods", Store.make_key("mods", n), {"n": n})
+    assert len([p for p in tmp_path.iterdir() if p.name.startswith("mods-")]) == 2
@@ -0,0 +1,79 @@
+import os
+
+from conftest import make_category, make_item, reference_bytes, toolkit
+
+
+def write(categories, nbt_file, index_file):
+    recorder = toolkit.PerfRecorder()
+    with toolkit.activate_perf(recorder):
+        toolkit.write_shopproj_file(categories, nbt_file, index_file=index_file)
+    return recorder.counters.get("categories_reused", 0), recorder.counters.get("categories_encoded", 0)
+
+
+def test_incremental_output_matches_full_encode(tmp_path, shop_categories):
+    nbt_file, index_file = str(tmp_path / "shop.shopproj"), str(tmp_path / "shop.index.json")
+    assert write(shop_categories, nbt_file, index_file) == (0, len(shop_categories))
+    assert write(shop_categories, nbt_file, index_file) == (len(shop_categories), 0)
+
+    changed = list(shop_categories)
+    changed[1] = make_category("分类2", merchants=3, namespace="changed")
+    assert write(changed, nbt_file, index_file) == (len(changed) - 1, 1)
+    assert (tmp_path / "shop.shopproj").read_bytes() == reference_bytes(changed)
+
+
+def test_index_ignored_when_output_changed(tmp_path, shop_categories):
+    nbt_file, index_file = str(tmp_path / "shop.shopproj"), str(tmp_path / "shop.index.json")
+    write(shop_categories, nbt_file, index_file)
+    with open(nbt_file, 'ab') as f:
+        f.write(b"\0")
+    assert write(shop_categories, nbt_file, index_file) == (0, len(shop_categories))
+    assert (tmp_path / "shop.shopproj").read_bytes() == reference_bytes(shop_categories)
+
+
+def write_snbt(path, tabs):
+    with open(path, 'w', encoding='utf-8') as f:
+        writer = toolkit.SNBTShopWriter(f)
+        for title, icon, entries in tabs:
+            writer.write_tab(title, icon, entries)
+        writer.close()
+
+
+def sample_tabs(price=10):
+    return [(f"分类{n}", f"mod:item_{n}", [make_item(f"mod:item_{n * 10 + i}", price=price if n == 1 else 5)
+                                           for i in range(4)])
+            for n in range(3)]
+
+
+def test_snbt_block_digests_change_only_for_edited_category(tmp_path):
+    snbt_file = str(tmp_path / "sdmshop.snbt")
+    write_snbt(snbt_file, sample_tabs())
+    before = [digest for _, digest in toolkit.iter_snbt_categories(snbt_file, digests=True)]
+    write_snbt(snbt_file, sample_tabs(price=99))
+    after = [digest for _, digest in toolkit.iter_snbt_categories(snbt_file, digests=True)]
+    assert [a == b for a, b in zip(before, after)] == [True, False, True]
+
+
+def test_streaming_incremental_reuses_unchanged_categories(tmp_path):
+    snbt_file = str(tmp_path / "sdmshop.snbt")
+    available = {f"mod:item_{n * 10 + i}" for n in range(3) for i in range(4)}
+    mods = {"mod": {}}
+
+    def convert(output_dir, index_file=None):
+        os.makedirs(output_dir, exist_ok=True)
+        recorder = toolkit.PerfRecorder()
+        with toolkit.activate_perf(recorder):
+            toolkit.stream_shop_outputs(snbt_file, available, mods, output_dir, output_dir, max_merchants=3,
+                                        index_file=index_file, index_context="ctx")
+        with open(os.path.join(output_dir, "extracted_shop_by_category.shopproj"), 'rb') as f:
+            data = f.read()
+        return data, recorder.counters.get("categories_reused", 0), recorder.counters.get("categories_encoded", 0)
+
+    index_file = str(tmp_path / "index.json")
+    write_snbt(snbt_file, sample_tabs())
+    _, reused, encoded = convert(str(tmp_path / "inc"), index_file)
+    assert (reused, encoded) == (0, 6)  # 每个分类 4 个商人，按 3 个拆成两个子分类
+
+    write_snbt(snbt_file, sample_tabs(price=99))
+    data, reused, encoded = convert(str(tmp_path / "inc"), index_file)
+    assert (reused, encoded) == (4, 2)
+    assert data == convert(str(tmp_path / "full"))[0]
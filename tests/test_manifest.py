@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from conftest import make_jar, toolkit
+
+FABRIC_JAR = {"fabric.mod.json": json.dumps({"id": "RealId", "version": "2.0", "name": "Real Mod"})}
+
+
+def write_json(path, data):
+    path.write_text(json.dumps(data), encoding="utf-8")
+    return str(path)
+
+
+def test_read_curseforge_instance(tmp_path):
+    manifest = write_json(tmp_path / "minecraftinstance.json", {"installedAddons": [
+        {"name": "Create", "primaryAuthor": "simibubi",
+         "installedFile": {"fileName": "create-1.21.1-6.0.jar", "fileLength": 123}},
+        {"name": "JEI", "authors": [{"name": "mezz"}, {"Name": "other"}],
+         "installedFile": {"fileName": "jei-19.0.jar"}},
+        {"name": "Pack", "installedFile": {"fileName": "config.zip"}},
+    ]})
+    assert toolkit.read_pack_manifest(manifest) == {
+        "create-1.21.1-6.0.jar": {"name": "Create", "author": "simibubi", "size": 123},
+        "jei-19.0.jar": {"name": "JEI", "author": "mezz, other", "size": None},
+    }
+
+
+def test_read_modrinth_index(tmp_path):
+    manifest = write_json(tmp_path / "modrinth.index.json", {"files": [
+        {"path": "mods/sodium-0.6.jar", "fileSize": 42},
+        {"path": "resourcepacks/pack.zip", "fileSize": 1},
+        {"path": "mods/sub/nested.jar"},
+    ]})
+    assert toolkit.read_pack_manifest(manifest) == {"sodium-0.6.jar": {"name": None, "author": None, "size": 42}}
+
+
+def test_read_curseforge_export(tmp_path):
+    manifest = write_json(tmp_path / "manifest.json", {"files": [
+        {"projectID": 1, "fileID": 2},
+        {"projectID": 3, "fileID": 4, "fileName": "mod-1.0.jar", "fileLength": 7},
+    ]})
+    assert toolkit.read_pack_manifest(manifest) == {"mod-1.0.jar": {"name": None, "author": None, "size": 7}}
+
+
+@pytest.fixture
+def pack(tmp_path):
+    mods_dir = tmp_path / "mods"
+    mods_dir.mkdir()
+    make_jar(mods_dir / "renamed-file-1.0.jar", FABRIC_JAR)
+    make_jar(mods_dir / "Plain_Lib-3.jar", {"assets/plain/models/item/thing.json": "{}"})
+    write_json(tmp_path / "minecraftinstance.json", {"installedAddons": [
+        {"name": "Real Mod", "primaryAuthor": "someone",
+         "installedFile": {"fileName": "renamed-file-1.0.jar"}},
+    ]})
+    return str(mods_dir)
+
+
+def test_manifest_only_fills_missing_author(pack):
+    mods = toolkit.get_installed_mods(pack, use_manifest=True)
+    assert "renamed" not in mods
+    assert (mods["realid"]["author"], mods["realid"]["version"]) == ("someone", "2.0")
+    without = toolkit.get_installed_mods(pack)
+    assert without["realid"]["author"] == "未知"
+    assert {k: v for k, v in mods["realid"].items() if k != "author"} == \
+        {k: v for k, v in without["realid"].items() if k != "author"}
+
+
+def test_ids_guessed_from_file_names_are_flagged(pack):
+    mods = toolkit.get_installed_mods(pack, use_manifest=True)
+    assert mods["plain"]["mod_id_inferred"] is True
+    assert "mod_id_inferred" not in mods["realid"]
+
+
+def test_unreadable_manifest_falls_back_to_jars(pack, tmp_path):
+    (tmp_path / "minecraftinstance.json").write_text("{not json", encoding="utf-8")
+    assert toolkit.get_installed_mods(pack, use_manifest=True)["realid"]["author"] == "未知"
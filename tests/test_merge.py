@@ -0,0 +1,62 @@
+import pytest
+
+from conftest import make_item, toolkit
+
+
+def category(title, icon, *item_ids):
+    return {"title": title, "icon": icon, "items": [make_item(item_id) for item_id in item_ids]}
+
+
+FIRST = [category("矿石", "a:ore", "a:iron", "a:gold"), category("工具", "a:pick", "a:pick")]
+SECOND = [category("食物", "b:bread", "b:bread"), category("矿石", "b:ore", "b:tin", "a:iron")]
+
+
+def summary(categories):
+    return [(c["title"], c["icon"], [item["id"] for item in c["items"]]) for c in categories]
+
+
+def test_merge_appends_and_dedupes():
+    merged, stats = toolkit.merge_snbt_categories([FIRST, SECOND], "merge")
+    assert summary(merged) == [("矿石", "a:ore", ["a:iron", "a:gold", "b:tin"]),
+                               ("工具", "a:pick", ["a:pick"]),
+                               ("食物", "b:bread", ["b:bread"])]
+    assert stats == {"conflicts": 1, "duplicates": 1}
+
+
+def test_first_keeps_earlier_category():
+    merged, stats = toolkit.merge_snbt_categories([FIRST, SECOND], "first")
+    assert summary(merged)[0] == ("矿石", "a:ore", ["a:iron", "a:gold"])
+    assert stats == {"conflicts": 1, "duplicates": 0}
+
+
+def test_last_replaces_in_place():
+    merged, stats = toolkit.merge_snbt_categories([FIRST, SECOND], "last")
+    assert [c["title"] for c in merged] == ["矿石", "工具", "食物"]
+    assert summary(merged)[0] == ("矿石", "b:ore", ["b:tin", "a:iron"])
+    assert stats == {"conflicts": 1, "duplicates": 0}
+
+
+def test_rename_numbers_later_titles():
+    third = [category("矿石", "c:ore", "c:lead")]
+    merged, stats = toolkit.merge_snbt_categories([FIRST, SECOND, third], "rename")
+    assert [c["title"] for c in merged] == ["矿石", "工具", "食物", "矿石 (2)", "矿石 (3)"]
+    assert summary(merged)[3] == ("矿石 (2)", "b:ore", ["b:tin", "a:iron"])
+    assert stats == {"conflicts": 2, "duplicates": 0}
+
+
+def test_duplicates_inside_one_category_are_dropped():
+    merged, stats = toolkit.merge_snbt_categories([[category("a", "m:i", "m:x", "m:x", "m:y")]], "first")
+    assert summary(merged) == [("a", "m:i", ["m:x", "m:y"])]
+    assert stats == {"conflicts": 0, "duplicates": 1}
+
+
+def test_inputs_are_not_modified():
+    before = summary(FIRST) + summary(SECOND)
+    for mode in toolkit.SNBT_MERGE_MODES:
+        toolkit.merge_snbt_categories([FIRST, SECOND], mode)
+    assert summary(FIRST) + summary(SECOND) == before
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        toolkit.merge_snbt_categories([FIRST], "union")
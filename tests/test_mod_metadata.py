@@ -0,0 +1,84 @@
+import json
+
+from conftest import make_jar, toolkit
+
+MODS_TOML = '''
+modLoader = "javafml"
+authors = "Top Author"
+
+[[mods]]
+modId = "FirstMod"
+version = "${file.jarVersion}"
+displayName = "First"
+
+[[mods]]
+modId = "second_mod"
+version = "1.2"
+authors = ["a", "b"]
+'''
+
+ITEM_ENTRY = "assets/outer/models/item/gear.json"
+
+
+def test_mods_toml_with_several_mods(tmp_path):
+    jar = make_jar(tmp_path / "first-1.0.jar", {
+        "META-INF/mods.toml": MODS_TOML,
+        "META-INF/MANIFEST.MF": "Manifest-Version: 1.0\nImplementation-Version: 3.4.5\n",
+    })
+    info = toolkit.get_mod_info_from_jar(jar)
+    assert (info["mod_id"], info["mod_ids"]) == ("firstmod", ["firstmod", "second_mod"])
+    assert (info["name"], info["version"], info["author"]) == ("First", "3.4.5", "Top Author")
+    assert "mod_id_inferred" not in info
+
+
+def test_fallback_mods_toml_parser():
+    declared = toolkit._parse_mods_toml_fallback(MODS_TOML)
+    assert [entry["modId"] for entry in declared["mods"]] == ["FirstMod", "second_mod"]
+    assert declared["authors"] == "Top Author"
+
+
+def test_wrongly_typed_metadata_keeps_file_name_id(tmp_path):
+    jar = make_jar(tmp_path / "oldmod_v2-1.0.jar", {
+        "mcmod.info": json.dumps([{"modid": 7, "authorList": [1, 2], "version": 3}]),
+    })
+    info = toolkit.get_mod_info_from_jar(jar)
+    assert (info["mod_id"], info["author"], info["version"]) == ("oldmod", "1, 2", "3")
+    assert info["mod_id_inferred"] is True
+
+
+def outer_jar(tmp_path):
+    """外层元数据正常，内嵌一个损坏的 jar、一个元数据类型错误的 jar 和一个正常的 jar"""
+    return make_jar(tmp_path / "outer-1.0.jar", {
+        "fabric.mod.json": json.dumps({"id": "outer", "authors": ["me"], "version": "1.0"}),
+        ITEM_ENTRY: "{}",
+        "META-INF/jars/broken.jar": b"not a zip file",
+        "META-INF/jars/odd.jar": {
+            "fabric.mod.json": json.dumps({"id": ["x"], "authors": 5, "name": None}),
+            "assets/odd/models/item/bolt.json": "{}",
+        },
+        "META-INF/jars/inner.jar": {
+            "fabric.mod.json": json.dumps({"id": "inner", "version": "0.1"}),
+            "assets/inner/models/item/foo.json": "{}",
+        },
+    })
+
+
+def test_malformed_nested_jars_do_not_hide_outer_metadata(tmp_path):
+    jar = outer_jar(tmp_path)
+    info = toolkit.get_mod_info_from_jar(jar, nested=True)
+    assert (info["mod_id"], info["author"], info["version"]) == ("outer", "me", "1.0")
+    assert [(m["mod_id"], m.get("mod_id_inferred", False)) for m in info["nested_mods"]] == \
+        [("odd", True), ("inner", False)]
+    assert toolkit.get_items_from_mod_jar(jar) == {"outer:gear", "odd:bolt", "inner:foo"}
+
+
+def test_nested_jars_are_read_only_on_request(tmp_path):
+    jar = outer_jar(tmp_path)
+    recorder = toolkit.PerfRecorder()
+    with toolkit.activate_perf(recorder):
+        info = toolkit.get_mod_info_from_jar(jar)
+    assert "nested_mods" not in info
+    assert recorder.counters.get("nested_jars_scanned", 0) == 0
+
+    mods = toolkit.get_installed_mods(str(tmp_path), nested_mods=True)
+    assert {"outer", "odd", "inner"} <= set(mods)
@@ -0,0 +1,30 @@
+from conftest import make_category, reference_bytes, toolkit
+
+
+def test_plan_encode_workers_thresholds(monkeypatch):
+    monkeypatch.setattr(toolkit.os, "cpu_count", lambda: 8)
+    assert toolkit.plan_encode_workers(toolkit.PARALLEL_ENCODE_MIN_BYTES - 1) == 0
+    assert toolkit.plan_encode_workers(toolkit.PARALLEL_ENCODE_MIN_BYTES) == 4
+    assert toolkit.plan_encode_workers(10 ** 12) == 8
+    monkeypatch.setattr(toolkit.os, "cpu_count", lambda: 1)
+    assert toolkit.plan_encode_workers(10 ** 12) == 0
+
+
+def test_parallel_encode_matches_sequential(monkeypatch, shop_categories):
+    odd = make_category("非模板", merchants=2)
+    odd["extra"] = {"_type": "int", "_value": 1}
+    categories = shop_categories[:2] + [odd] + shop_categories[2:]
+    sequential = toolkit.encode_categories(categories, parallel=False)
+
+    monkeypatch.setattr(toolkit, "plan_encode_workers", lambda estimated_bytes: 2)
+    recorder = toolkit.PerfRecorder()
+    with toolkit.activate_perf(recorder):
+        assert toolkit.encode_categories(categories) == sequential
+    assert recorder.counters["nbt_encode_workers"] == 2
+
+
+def test_parallel_written_file_matches_nbt_writer(monkeypatch, tmp_path, shop_categories):
+    monkeypatch.setattr(toolkit, "plan_encode_workers", lambda estimated_bytes: 2)
+    nbt_file = tmp_path / "shop.shopproj"
+    toolkit.write_shopproj_file(shop_categories, str(nbt_file), parallel=True)
+    assert nbt_file.read_bytes() == reference_bytes(shop_categories)
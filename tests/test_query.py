@@ -0,0 +1,62 @@
+import pytest
+
+from conftest import make_item, reference_bytes, toolkit
+
+ITEMS = "data.shop.categoryInfos.payload[*].merchants.payload"
+
+
+@pytest.fixture
+def shop_bytes():
+    categories = [
+        toolkit.create_category("矿石", "minecraft:diamond", [
+            toolkit.create_shopproj_item(make_item("minecraft:diamond", 1, 100, 1)),
+            toolkit.create_shopproj_item(make_item("create:zinc_ingot", 8, 5, 0)),
+        ]),
+        toolkit.create_category("工具", "mod:hammer", [
+            toolkit.create_shopproj_item(make_item("mod:hammer", 1, 30, 0)),
+            toolkit.create_shopproj_item(make_item("minecraft:diamond", 2, 150, 0)),
+        ]),
+    ]
+    return reference_bytes(categories)
+
+
+def query(data, expression):
+    return [(path, toolkit.nbt_to_plain(value)) for path, value in toolkit.query_nbt(data, expression)]
+
+
+def test_keys_and_wildcards(shop_bytes):
+    assert [v for _, v in query(shop_bytes, "data.shop.categoryInfos.payload[*].name")] == ["矿石", "工具"]
+    assert query(shop_bytes, "data.shop.categoryInfos.uid") == [("data.shop.categoryInfos.uid", 2)]
+    assert query(shop_bytes, "data.shop.missing") == []
+
+
+def test_indexes(shop_bytes):
+    assert [v for _, v in query(shop_bytes, "data.shop.categoryInfos.payload[-1].name")] == ["工具"]
+    assert query(shop_bytes, "data.shop.categoryInfos.payload[5].name") == []
+
+
+def test_equality_filter(shop_bytes):
+    results = query(shop_bytes, f"{ITEMS}[?itemResult.id==minecraft:diamond].money")
+    assert [v for _, v in results] == [100, 150]
+    assert [p for p, _ in results] == [
+        "data.shop.categoryInfos.payload[0].merchants.payload[0].money",
+        "data.shop.categoryInfos.payload[1].merchants.payload[1].money",
+    ]
+
+
+def test_inequality_substring_and_quoted_filters(shop_bytes):
+    assert [v for _, v in query(shop_bytes, f"{ITEMS}[?itemResult.id!=minecraft:diamond].money")] == [5, 30]
+    assert [v for _, v in query(shop_bytes, f"{ITEMS}[?itemResult.id~=zinc].itemResult.count")] == [8]
+    assert [v for _, v in query(shop_bytes, f"{ITEMS}[?money=='30'].itemResult.id")] == ["mod:hammer"]
+
+
+def test_filter_on_category_then_merchants(shop_bytes):
+    expression = "data.shop.categoryInfos.payload[?name==工具].merchants.payload[*].itemResult.id"
+    assert [v for _, v in query(shop_bytes, expression)] == ["mod:hammer", "minecraft:diamond"]
+
+
+def test_invalid_expressions():
+    with pytest.raises(ValueError):
+        toolkit.parse_nbt_path("data[?money>3]")
+    with pytest.raises(ValueError):
+        toolkit.parse_nbt_path("data[1")
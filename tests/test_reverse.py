@@ -0,0 +1,43 @@
+from conftest import make_item, toolkit
+
+
+def write_shopproj(path, tabs, max_merchants=0):
+    categories = []
+    for title, icon, items in tabs:
+        merchants = [toolkit.create_shopproj_item(item) for item in items]
+        categories.extend(toolkit.create_category(name, shard_icon, shard)
+                          for name, shard_icon, shard in toolkit.shard_category(title, icon, merchants,
+                                                                                max_merchants=max_merchants))
+    toolkit.write_shopproj_file(categories, str(path))
+
+
+TABS = [
+    ("矿石 \"稀有\"", "minecraft:diamond", [make_item("minecraft:diamond", 3, 100, 1),
+                                          make_item("create:zinc_ingot", 64, 5, 0)]),
+    ("工具", "mod:hammer", [make_item(f"mod:tool_{n}", n + 1, n * 7, n % 2) for n in range(7)]),
+    ("Misc\\Stuff", "minecraft:stone", [make_item("minecraft:stone", 1, 0, 0)]),
+]
+
+
+def test_shopproj_to_snbt_round_trip(tmp_path):
+    write_shopproj(tmp_path / "shop.shopproj", TABS)
+    _, tab_count, entry_count = toolkit.shopproj_to_snbt(str(tmp_path / "shop.shopproj"), str(tmp_path / "out.snbt"))
+    assert (tab_count, entry_count) == (3, 10)
+    parsed = toolkit.parse_snbt_by_category(str(tmp_path / "out.snbt"))
+    assert [(c["title"], c["icon"], c["items"]) for c in parsed] == TABS
+
+
+def test_round_trip_merges_shards(tmp_path):
+    write_shopproj(tmp_path / "shop.shopproj", TABS, max_merchants=3)
+    toolkit.shopproj_to_snbt(str(tmp_path / "shop.shopproj"), str(tmp_path / "merged.snbt"))
+    assert [c["title"] for c in toolkit.parse_snbt_by_category(str(tmp_path / "merged.snbt"))] == [t for t, _, _ in TABS]
+
+    toolkit.shopproj_to_snbt(str(tmp_path / "shop.shopproj"), str(tmp_path / "split.snbt"), merge_shards=False)
+    titles = [c["title"] for c in toolkit.parse_snbt_by_category(str(tmp_path / "split.snbt"))]
+    assert titles == ["矿石 \"稀有\"", "工具 (1)", "工具 (2)", "工具 (3)", "Misc\\Stuff"]
+
+
+def test_count_is_clamped_to_snbt_byte(tmp_path):
+    write_shopproj(tmp_path / "shop.shopproj", [("a", "minecraft:stone", [make_item("minecraft:stone", 1000, 1)])])
+    toolkit.shopproj_to_snbt(str(tmp_path / "shop.shopproj"), str(tmp_path / "out.snbt"))
+    assert toolkit.parse_snbt_by_category(str(tmp_path / "out.snbt"))[0]["items"][0]["count"] == 127
@@ -0,0 +1,100 @@
+import http.client
+import json
+import threading
+import zipfile
+from io import BytesIO
+
+import pytest
+
+from conftest import make_item, toolkit
+
+
+@pytest.fixture
+def service(tmp_path):
+    (tmp_path / "mods").mkdir()
+    service = toolkit.ConversionService({"pack": str(tmp_path)}, workers=1, queue_size=0)
+    yield service
+    service.shutdown()
+
+
+@pytest.fixture
+def server(service):
+    server = toolkit.make_conversion_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def request(server, method, path, body=None):
+    connection = http.client.HTTPConnection(*server.server_address[:2], timeout=10)
+    try:
+        connection.request(method, path, body=body)
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def test_admission_counts_slots(service):
+    assert service.try_admit()
+    assert not service.try_admit()
+    service.release_slot()
+    assert service.try_admit()
+    service.release_slot()
+    assert service.status() == {"packs": ["pack"], "workers": 1, "capacity": 1, "pending": 0,
+                                "accepted": 2, "rejected": 1, "completed": 0, "failed": 0}
+
+
+def test_full_queue_returns_503(service, server):
+    assert service.try_admit()
+    try:
+        status, headers, payload = request(server, "POST", "/convert?pack=pack", b"{}")
+    finally:
+        service.release_slot()
+    assert status == 503
+    assert headers["Retry-After"] == "5"
+    assert "error" in payload
+    assert service.status()["rejected"] == 1
+    assert service.status()["pending"] == 0
+
+
+def test_rejected_requests_before_admission(service, server):
+    assert request(server, "POST", "/convert?pack=other", b"{}")[0] == 404
+    assert request(server, "POST", "/convert?pack=pack", b"")[0] == 400
+    assert request(server, "POST", "/missing", b"{}")[0] == 404
+    assert service.status()["accepted"] == 0
+
+
+def test_upload_limit(service):
+    server = toolkit.make_conversion_server(service, port=0, max_upload=4)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        assert request(server, "POST", "/convert?pack=pack", b"0123456789")[0] == 413
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_status_and_packs(server):
+    status, _, payload = request(server, "GET", "/packs")
+    assert (status, payload) == (200, {"packs": ["pack"]})
+    status, _, payload = request(server, "GET", "/status")
+    assert (status, payload["capacity"], payload["pending"]) == (200, 1, 0)
+
+
+def test_request_log_is_packed_with_outputs(service, tmp_path):
+    snbt_file = tmp_path / "sdmshop.snbt"
+    with open(snbt_file, 'w', encoding='utf-8') as f:
+        writer = toolkit.SNBTShopWriter(f)
+        writer.write_tab("原版", "minecraft:stone", [make_item("minecraft:stone", 1, 5)])
+        writer.close()
+    assert service.try_admit()
+    archive, result = service.submit(snbt_file.read_bytes(), "pack").result(timeout=60)
+    with zipfile.ZipFile(BytesIO(archive)) as z:
+        assert "2.输出/extracted_shop_by_category.shopproj" in z.namelist()
+        log_text = z.read("3.报告/转换日志.log").decode("utf-8")
+    assert f"请求 1: {result.category_count} 个分类" in log_text
+    assert service.status()["completed"] == 1
@@ -0,0 +1,42 @@
+import pytest
+
+from conftest import make_item, toolkit
+
+
+def merchants(count):
+    return [toolkit.create_shopproj_item(make_item(f"mod:item_{n}")) for n in range(count)]
+
+
+def test_small_category_keeps_its_name():
+    shards = list(toolkit.shard_category("工具", "mod:icon", merchants(3), max_merchants=5))
+    assert [(name, icon, len(items)) for name, icon, items in shards] == [("工具", "mod:icon", 3)]
+
+
+def test_shard_splits_into_numbered_categories_in_order():
+    source = merchants(12)
+    shards = list(toolkit.shard_category("工具", "mod:icon", iter(source), max_merchants=5))
+    assert [name for name, _, _ in shards] == ["工具 (1)", "工具 (2)", "工具 (3)"]
+    assert [len(items) for _, _, items in shards] == [5, 5, 2]
+    assert {icon for _, icon, _ in shards} == {"mod:icon"}
+    assert [m for _, _, items in shards for m in items] == source
+
+
+def test_shard_by_encoded_bytes():
+    source = merchants(10)
+    size = toolkit.merchant_encoded_size(source[0])
+    shards = list(toolkit.shard_category("工具", "mod:icon", source, max_merchants=0, max_bytes=size * 3 + 1))
+    assert [len(items) for _, _, items in shards] == [3, 3, 3, 1]
+
+
+def test_truncate_and_none_modes():
+    assert [len(items) for _, _, items in toolkit.shard_category("a", "m:i", merchants(12), "truncate", 5)] == [5]
+    assert [len(items) for _, _, items in toolkit.shard_category("a", "m:i", merchants(12), "none", 5)] == [12]
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        list(toolkit.shard_category("a", "m:i", merchants(2), "split"))
+
+
+def test_empty_category_yields_nothing():
+    assert list(toolkit.shard_category("a", "m:i", [], max_merchants=5)) == []
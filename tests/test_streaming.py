@@ -0,0 +1,43 @@
+from io import BytesIO
+
+from conftest import reference_bytes, toolkit
+
+
+def test_streaming_writer_matches_nbt_writer(shop_categories):
+    count = toolkit.DeferredInt()
+
+    def categories():
+        for category in shop_categories:
+            count.value += 1
+            yield category
+
+    shopproj = toolkit.build_shopproj(categories(), uid=count)
+    stream = BytesIO()
+    writer = toolkit.StreamingNBTWriter(stream)
+    writer.write_root(shopproj["_root_name"], shopproj["data"])
+    writer.finish()
+    assert stream.getvalue() == reference_bytes(shop_categories)
+
+
+def test_streaming_writer_patches_empty_list():
+    shopproj = toolkit.build_shopproj(iter([]), uid=toolkit.DeferredInt())
+    stream = BytesIO()
+    writer = toolkit.StreamingNBTWriter(stream)
+    writer.write_root(shopproj["_root_name"], shopproj["data"])
+    writer.finish()
+    assert stream.getvalue() == reference_bytes([])
+
+
+def test_write_shopproj_file_from_generator(tmp_path, shop_categories):
+    nbt_file = str(tmp_path / "shop.shopproj")
+    count = toolkit.DeferredInt()
+
+    def categories():
+        for category in shop_categories:
+            count.value += 1
+            yield category
+
+    toolkit.write_shopproj_file(categories(), nbt_file, uid=count)
+    assert (tmp_path / "shop.shopproj").read_bytes() == reference_bytes(shop_categories)
+    assert toolkit.validate_shopproj(nbt_file) == ([], 0)
+    assert not (tmp_path / "shop.shopproj.tmp").exists()
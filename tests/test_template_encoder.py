@@ -0,0 +1,40 @@
+from conftest import make_category, make_item, reference_bytes, toolkit
+
+
+def writer_payload(value):
+    writer = toolkit.NBTWriter()
+    writer.write_payload(toolkit.NBTWriter.TYPE_IDS["compound"], value)
+    return writer.get_bytes()
+
+
+def test_category_payload_matches_nbt_writer(shop_categories):
+    encoder = toolkit.get_template_encoder()
+    for category in shop_categories:
+        assert bytes(encoder.encode_category(category)) == writer_payload(category)
+
+
+def test_merchant_size_matches_nbt_writer():
+    for item in (make_item("minecraft:stone", 1, 0, 0), make_item("模组:物品", 1000, 2**31 - 1, 1)):
+        merchant = toolkit.create_shopproj_item(item)
+        assert toolkit.get_template_encoder().merchant_size(merchant) == len(writer_payload(merchant))
+
+
+def test_unexpected_structure_falls_back_to_nbt_writer():
+    category = make_category("工具", merchants=3)
+    category["extra"] = {"_type": "int", "_value": 1}
+    odd_merchant = make_category("商人", merchants=2)
+    odd_merchant["merchants"]["payload"]["_value"][0]["tradeType"]["_value"] = "custom"
+    encoder = toolkit.get_template_encoder()
+    for value in (category, odd_merchant):
+        assert encoder.encode_category(value) is None
+        assert toolkit.encode_category_payload(value) == writer_payload(value)
+
+
+def test_written_file_matches_nbt_writer(tmp_path, shop_categories):
+    nbt_file = tmp_path / "shop.shopproj"
+    recorder = toolkit.PerfRecorder()
+    with toolkit.activate_perf(recorder):
+        toolkit.write_shopproj_file(shop_categories, str(nbt_file))
+    assert nbt_file.read_bytes() == reference_bytes(shop_categories)
+    assert recorder.counters["merchants_template_encoded"] == sum(
+        len(c["merchants"]["payload"]["_value"]) for c in shop_categories)
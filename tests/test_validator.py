@@ -0,0 +1,64 @@
+from conftest import make_category, make_item, toolkit
+
+
+def write_nbt(path, data, root_name=""):
+    writer = toolkit.NBTWriter()
+    writer.write_root(root_name, data)
+    path.write_bytes(writer.get_bytes())
+    return str(path)
+
+
+def test_generated_shop_is_valid(tmp_path, shop_categories):
+    nbt_file = str(tmp_path / "shop.shopproj")
+    toolkit.write_shopproj_file(shop_categories, nbt_file)
+    assert toolkit.validate_shopproj(nbt_file) == ([], 0)
+
+
+def test_reports_wrong_values_with_paths(tmp_path):
+    category = make_category("工具", merchants=2)
+    merchant = category["merchants"]["payload"]["_value"][1]
+    merchant["itemResult"]["id"]["_value"] = "Bad Id"
+    merchant["money"]["_value"] = -1
+    category["merchants"]["uid"]["_value"] = 5
+    shopproj = toolkit.build_shopproj([category])
+    errors, count = toolkit.validate_shopproj(write_nbt(tmp_path / "bad.shopproj", shopproj["data"]))
+    prefix = "data.shop.categoryInfos.payload[0].merchants"
+    assert count == 3
+    assert errors[0].startswith(f"{prefix}.payload[1].itemResult.id: ")
+    assert errors[1].startswith(f"{prefix}.payload[1].money: ")
+    assert errors[2] == f"{prefix}.uid: 为 5，但 payload 有 2 个元素"
+
+
+def test_count_of_at_root_has_no_leading_dot(tmp_path):
+    schema = {
+        "type": "compound",
+        "keys": {
+            "payload": {"type": "list", "items": toolkit.MERCHANT_SCHEMA},
+            "uid": {"type": "int", "count_of": "payload"},
+        },
+    }
+    data = {
+        "_type": "compound",
+        "payload": {"_type": "list", "_element_type": "compound",
+                    "_value": [toolkit.create_shopproj_item(make_item("mod:a"))]},
+        "uid": {"_type": "int", "_value": 3},
+    }
+    validator = toolkit.ShopprojValidator(schema=schema)
+    assert validator.validate_file(write_nbt(tmp_path / "root.nbt", data)) == ["uid: 为 3，但 payload 有 1 个元素"]
+
+
+def test_missing_and_unknown_keys(tmp_path):
+    shopproj = toolkit.build_shopproj([])
+    del shopproj["data"]["meta"]["suffix"]
+    shopproj["data"]["meta"]["extra"] = {"_type": "int", "_value": 1}
+    errors, _ = toolkit.validate_shopproj(write_nbt(tmp_path / "keys.shopproj", shopproj["data"]))
+    assert sorted(errors) == ["meta.extra: 未知的键", "meta.suffix: 缺少必需的键"]
+
+
+def test_truncated_file(tmp_path, shop_categories):
+    nbt_file = tmp_path / "shop.shopproj"
+    toolkit.write_shopproj_file(shop_categories, str(nbt_file))
+    nbt_file.write_bytes(nbt_file.read_bytes()[:-40])
+    errors, count = toolkit.validate_shopproj(str(nbt_file))
+    assert count == len(errors) >= 1
+    assert errors[-1].startswith("<根>: 文件不完整或已损坏")